@@ -2,12 +2,16 @@
 import imaplib
 import email
 from email.header import decode_header, make_header
+from email.parser import BytesHeaderParser
 from datetime import datetime, timezone, timedelta
+from functools import lru_cache
 from typing import List, Dict, Optional
 import html
 import ssl
 import re
 
+from policy_engine import get_engine, header_class
+
 try:
     from zoneinfo import ZoneInfo
     SAO_PAULO_TZ = ZoneInfo("America/Sao_Paulo")
@@ -19,22 +23,55 @@ HEADER_FIELDS = (
     "AUTO-SUBMITTED PRECEDENCE X-AUTO-RESPONSE-SUPPRESS"
 )
 
-def _decode_mime(s: Optional[str]) -> str:
-    if not s:
-        return ""
+# One pass over the FETCH metadata, e.g.
+# b'12 (UID 345 INTERNALDATE "17-Jul-2026 02:44:25 -0700" FLAGS (\\Seen) RFC822.SIZE 2048 BODY[...] {512}'
+_FETCH_META_RE = re.compile(
+    rb'\b(UID|INTERNALDATE|FLAGS|RFC822\.SIZE)\s+(?:"([^"]*)"|\(([^)]*)\)|(\d+))'
+)
+_TRAILING_WS_RE = re.compile(r"\s+\n")
+_SPACES_RE = re.compile(r"[ \t]+")
+
+_header_parser = BytesHeaderParser()
+
+
+def _decode_header_value(s) -> str:
     try:
         return str(make_header(decode_header(s)))
     except Exception:
         return s
 
+
+# Sender names and newsletter subjects repeat a lot across a header scan.
+_decode_mime_words = lru_cache(maxsize=4096)(_decode_header_value)
+
+
+def _decode_mime(s: Optional[str]) -> str:
+    if not s:
+        return ""
+    if not isinstance(s, str):
+        # compat32 hands back email.header.Header for raw 8-bit values
+        return _decode_header_value(s)
+    if "=?" not in s:
+        return s
+    return _decode_mime_words(s)
+
 def _clean_text(s: str) -> str:
     if not s:
         return ""
-    s = html.unescape(s)
-    s = re.sub(r"\s+\n", "\n", s)
-    s = re.sub(r"[ \t]+", " ", s)
+    if "&" in s:
+        s = html.unescape(s)
+    s = _TRAILING_WS_RE.sub("\n", s)
+    s = _SPACES_RE.sub(" ", s)
     return s.strip()
 
+_IMAP_MONTHS = ("Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec")
+
+
+def _imap_date(dt: datetime) -> str:
+    """SEARCH date (RFC 3501 date-text, e.g. 17-Jan-2026), locale-independent."""
+    return f"{dt.day}-{_IMAP_MONTHS[dt.month - 1]}-{dt.year}"
+
+
 def _parse_internaldate(internaldate: str) -> datetime:
     try:
         tup = imaplib.Internaldate2tuple(internaldate)
@@ -51,23 +88,118 @@ def _parse_internaldate(internaldate: str) -> datetime:
     except Exception:
         return datetime.now(timezone.utc)
 
-def _classify_email(from_addr: str, subj: str, headers: Dict[str, str]) -> str:
-    f = (from_addr or "").lower()
-    s = (subj or "").lower()
-
-    otp_keywords = ["código", "codigo", "verification", "verify", "otp", "confirmação", "confirmacao"]
-    if any(k in s for k in otp_keywords) or "one-time" in s:
-        return "otp"
-
-    auto = headers.get("auto-submitted", "").lower()
-    precedence = headers.get("precedence", "").lower()
-    if "no-reply" in f or "noreply" in f or auto or precedence in ("bulk", "junk", "list"):
-        return "automated"
-
-    if headers.get("list-id") or "unsubscribe" in s:
-        return "newsletter"
+_INTERNALDATE_RE = re.compile(
+    r"\s*(\d{1,2})-([A-Za-z]{3})-(\d{4}) (\d{2}):(\d{2}):(\d{2}) ([+-])(\d{2})(\d{2})"
+)
+_MONTHS = {m: i for i, m in enumerate(
+    ("Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"), 1
+)}
+
+
+def _parse_internaldate_fast(internaldate: str) -> datetime:
+    m = _INTERNALDATE_RE.match(internaldate)
+    month = _MONTHS.get(m.group(2).title()) if m else None
+    if not month:
+        return _parse_internaldate(internaldate)
+    offset = timedelta(hours=int(m.group(8)), minutes=int(m.group(9)))
+    if m.group(7) == "-":
+        offset = -offset
+    local = datetime(int(m.group(3)), month, int(m.group(1)),
+                     int(m.group(4)), int(m.group(5)), int(m.group(6)), tzinfo=timezone.utc)
+    return local - offset
+
+
+class FetchedHeader:
+    """One item of a UID FETCH header batch, decoded once."""
+
+    __slots__ = ("uid", "dt_utc", "flags", "size", "from_addr", "subject", "date_header", "headers")
+
+    def __init__(self, uid: int, dt_utc: datetime, flags: tuple, size: int,
+                 from_addr: str, subject: str, date_header: str, headers: Dict[str, str]):
+        self.uid = uid
+        self.dt_utc = dt_utc
+        self.flags = flags
+        self.size = size
+        self.from_addr = from_addr
+        self.subject = subject
+        self.date_header = date_header
+        self.headers = headers
+
+    @property
+    def seen(self) -> bool:
+        return "\\Seen" in self.flags
+
+
+def parse_fetch_headers(data) -> List[FetchedHeader]:
+    """
+    Parse the response of
+    UID FETCH (UID INTERNALDATE FLAGS RFC822.SIZE BODY.PEEK[HEADER.FIELDS (...)]).
+    Items without a UID are dropped.
+    """
+    records: List[FetchedHeader] = []
+    for item in data or ():
+        if not isinstance(item, tuple) or len(item) < 2:
+            continue
+
+        uid = None
+        internaldate = ""
+        flags: tuple = ()
+        size = 0
+        for m in _FETCH_META_RE.finditer(item[0]):
+            name = m.group(1)
+            if name == b"UID":
+                if m.group(4):
+                    uid = int(m.group(4))
+            elif name == b"INTERNALDATE":
+                internaldate = (m.group(2) or b"").decode("ascii", errors="ignore")
+            elif name == b"FLAGS":
+                flags = tuple((m.group(3) or b"").decode("ascii", errors="ignore").split())
+            else:
+                size = int(m.group(4) or 0)
+        if uid is None:
+            continue
+
+        msg = _header_parser.parsebytes(item[1] or b"")
+        records.append(FetchedHeader(
+            uid=uid,
+            dt_utc=_parse_internaldate_fast(internaldate) if internaldate else datetime.now(timezone.utc),
+            flags=flags,
+            size=size,
+            from_addr=_decode_mime(msg.get("From", "")),
+            subject=_decode_mime(msg.get("Subject", "")),
+            date_header=_decode_mime(msg.get("Date", "")),
+            headers={
+                "auto-submitted": msg.get("Auto-Submitted", "") or "",
+                "precedence": msg.get("Precedence", "") or "",
+                "list-id": msg.get("List-Id", "") or "",
+                "x-auto-response-suppress": msg.get("X-Auto-Response-Suppress", "") or "",
+            },
+        ))
+    return records
+
+
+def _classify_records(records: List[FetchedHeader]) -> List[str]:
+    """
+    Header-only classification for a FETCH batch: policy keywords in one pass
+    (the subject doubles as the body, there is none yet), then the
+    Auto-Submitted / Precedence / List-Id headers.
+    """
+    categories = get_engine().classify_batch([(r.from_addr, r.subject, r.subject) for r in records])
+    out = []
+    for rec, category in zip(records, categories):
+        headers = rec.headers
+        auto = headers.get("auto-submitted", "").lower()
+        precedence = headers.get("precedence", "").lower()
+        if category == "otp":
+            out.append("otp")
+        elif category == "automated" or auto or precedence in ("bulk", "junk", "list"):
+            out.append("automated")
+        elif category == "newsletter" or headers.get("list-id"):
+            out.append("newsletter")
+        else:
+            out.append("human")
+    return out
 
-    return "human"
 
 class AppleIMAPClient:
     """
@@ -103,9 +235,9 @@ class AppleIMAPClient:
         if typ != "OK":
             raise RuntimeError(f"Could not select folder {folder}: {data}")
 
-    def _uid_search_all(self) -> List[int]:
+    def _uid_search(self, *criteria: str) -> List[int]:
         assert self.conn
-        typ, data = self.conn.uid("SEARCH", None, "ALL")
+        typ, data = self.conn.uid("SEARCH", None, *criteria)
         if typ != "OK":
             return []
         raw = data[0].decode("utf-8", errors="ignore").strip()
@@ -113,15 +245,13 @@ class AppleIMAPClient:
             return []
         return [int(x) for x in raw.split() if x.isdigit()]
 
-    def _uid_search_unseen(self) -> List[int]:
-        assert self.conn
-        typ, data = self.conn.uid("SEARCH", None, "UNSEEN")
-        if typ != "OK":
-            return []
-        raw = data[0].decode("utf-8", errors="ignore").strip()
-        if not raw:
-            return []
-        return [int(x) for x in raw.split() if x.isdigit()]
+    def _uid_search_all(self) -> List[int]:
+        return self._uid_search("ALL")
+
+    def _uid_search_unseen(self, since: Optional[datetime] = None) -> List[int]:
+        if since is None:
+            return self._uid_search("UNSEEN")
+        return self._uid_search("UNSEEN", "SINCE", _imap_date(since))
 
     def get_folder_stats(self, folder: str = "INBOX") -> Dict:
         assert self.conn
@@ -145,23 +275,18 @@ class AppleIMAPClient:
         buffer_days: int = 2,
         unseen_boost: bool = True,
         batch_size: int = 150,
+        unseen_only: bool = False,
     ) -> List[Dict]:
         """
         Returns messages in range [start_utc, end_utc], filtered locally,
         plus optional unseen boost (ensures "unread today" doesn't vanish).
         Unseen emails within range are always prioritized.
+        With unseen_only the server search is UID SEARCH UNSEEN SINCE <cutoff>,
+        so only unread mail is fetched and the limit counts unread messages.
         """
         assert self.conn
         self.select_folder(folder)
 
-        all_uids = self._uid_search_all()
-        if not all_uids:
-            return []
-
-        all_uids.sort(reverse=True)
-
-        unseen_uids = set(self._uid_search_unseen()) if unseen_boost else set()
-
         now_utc = datetime.now(timezone.utc)
         if end_utc is None:
             end_utc = now_utc
@@ -177,6 +302,17 @@ class AppleIMAPClient:
 
         cutoff_utc = start_utc - timedelta(days=buffer_days)
 
+        if unseen_only:
+            all_uids = self._uid_search_unseen(since=cutoff_utc)
+            unseen_uids = set(all_uids)
+        else:
+            all_uids = self._uid_search_all()
+            unseen_uids = set(self._uid_search_unseen()) if unseen_boost and all_uids else set()
+        if not all_uids:
+            return []
+
+        all_uids.sort(reverse=True)
+
         results: List[Dict] = []
         seen_keys = set()
 
@@ -199,43 +335,14 @@ class AppleIMAPClient:
 
             batch_old = False
 
-            for item in data:
-                if not isinstance(item, tuple) or len(item) < 2:
-                    continue
-
-                meta = item[0].decode("utf-8", errors="ignore")
-                raw_headers = item[1]
-
-                m = re.search(r"UID\s+(\d+)", meta)
-                if not m:
-                    continue
-                uid = int(m.group(1))
+            records = parse_fetch_headers(data)
+            for rec, classification in zip(records, _classify_records(records)):
+                uid = rec.uid
                 key = f"apple:{uid}"
                 if key in seen_keys:
                     continue
 
-                im = re.search(r'INTERNALDATE\s+"([^"]+)"', meta)
-                internaldate = im.group(1) if im else ""
-                dt_utc = _parse_internaldate(internaldate)
-
-                flags = []
-                fm = re.search(r"FLAGS\s+\(([^)]*)\)", meta)
-                if fm:
-                    flags = [f.strip() for f in fm.group(1).split() if f.strip()]
-
-                msg = email.message_from_bytes(raw_headers)
-                from_addr = _decode_mime(msg.get("From", ""))
-                subject = _decode_mime(msg.get("Subject", ""))
-                date_hdr = _decode_mime(msg.get("Date", ""))
-
-                headers_norm = {
-                    "auto-submitted": (msg.get("Auto-Submitted", "") or ""),
-                    "precedence": (msg.get("Precedence", "") or ""),
-                    "list-id": (msg.get("List-Id", "") or ""),
-                    "x-auto-response-suppress": (msg.get("X-Auto-Response-Suppress", "") or ""),
-                }
-
-                classification = _classify_email(from_addr, subject, headers_norm)
+                dt_utc = rec.dt_utc
 
                 in_range = (start_utc <= dt_utc <= end_utc)
 
@@ -245,14 +352,15 @@ class AppleIMAPClient:
                         "provider": "apple",
                         "id": str(uid),
                         "key": key,
-                        "from": _clean_text(from_addr),
-                        "subject": _clean_text(subject),
+                        "from": _clean_text(rec.from_addr),
+                        "subject": _clean_text(rec.subject),
                         "date": dt_utc.isoformat(),
                         "dt_utc": dt_utc,  # Store parsed datetime for priority sorting
-                        "date_header": date_hdr,
-                        "flags": flags,
-                        "unseen": (uid in unseen_uids) or ("\\Seen" not in flags),
+                        "date_header": rec.date_header,
+                        "flags": list(rec.flags),
+                        "unseen": (uid in unseen_uids) or not rec.seen,
                         "class": classification,
+                        "header_class": header_class(rec.headers),
                         "preview": "",
                     })
 
@@ -0,0 +1,253 @@
+"""
+Async listing on top of the sync providers.
+
+Gmail REST and Microsoft Graph are called with a shared httpx.AsyncClient;
+IMAP (Apple) has no async client here, so its blocking calls run through
+asyncio.to_thread. Each provider gets a semaphore (PROVIDER_CONCURRENCY) that
+bounds its in-flight HTTP requests / IMAP sessions, so fan_out() can run every
+provider x folder pair at once on the event loop. The client is closed by
+aclose(), which the app runs on shutdown.
+
+Given a shared listing.TopK, the Gmail and Graph listings offer each page to it
+and stop once their next page can no longer get into the top k; the result is
+then a listing.Listing whose counts come from a cheap ids/isRead listing.
+"""
+import os
+import asyncio
+import logging
+import random
+import weakref
+from datetime import datetime
+from typing import Dict, List, Iterable, Tuple
+
+import httpx
+
+from listing import Listing, TopK, message_ts
+from providers.base import EmailMessage
+from graph import GRAPH_ROOT, GRAPH_TIMEOUT_S, GRAPH_MAX_RETRIES, RETRY_STATUSES, _retry_delay
+
+logger = logging.getLogger(__name__)
+
+GMAIL_API_ROOT = (os.getenv("GMAIL_API_ENDPOINT") or "https://gmail.googleapis.com").rstrip("/")
+ASYNC_TIMEOUT_S = int(os.getenv("ASYNC_TIMEOUT_S", str(GRAPH_TIMEOUT_S)))
+PROVIDER_CONCURRENCY = {
+    "apple": int(os.getenv("APPLE_ASYNC_CONCURRENCY", "2")),
+    "gmail": int(os.getenv("GMAIL_ASYNC_CONCURRENCY", "16")),
+    "microsoft": int(os.getenv("MS_ASYNC_CONCURRENCY", "8")),
+}
+DEFAULT_CONCURRENCY = int(os.getenv("ASYNC_PROVIDER_CONCURRENCY", "4"))
+# Gmail metadata requests per top-k check.
+GMAIL_LIST_CHUNK = int(os.getenv("GMAIL_LIST_CHUNK", "25"))
+
+# Semaphores and the client belong to the loop they were first used on.
+_loop_state = weakref.WeakKeyDictionary()
+
+
+def _state() -> dict:
+    loop = asyncio.get_running_loop()
+    state = _loop_state.get(loop)
+    if state is None:
+        state = {"semaphores": {}, "client": None}
+        _loop_state[loop] = state
+    return state
+
+
+def _semaphore(provider_name: str) -> asyncio.Semaphore:
+    semaphores = _state()["semaphores"]
+    if provider_name not in semaphores:
+        limit = PROVIDER_CONCURRENCY.get(provider_name, DEFAULT_CONCURRENCY)
+        semaphores[provider_name] = asyncio.Semaphore(max(limit, 1))
+    return semaphores[provider_name]
+
+
+def _client() -> httpx.AsyncClient:
+    state = _state()
+    if state["client"] is None:
+        state["client"] = httpx.AsyncClient(
+            timeout=ASYNC_TIMEOUT_S,
+            limits=httpx.Limits(max_connections=sum(PROVIDER_CONCURRENCY.values()),
+                                max_keepalive_connections=sum(PROVIDER_CONCURRENCY.values())),
+        )
+    return state["client"]
+
+
+async def aclose():
+    """Close the running loop's shared client (app shutdown, or the end of a one-off loop)."""
+    state = _loop_state.get(asyncio.get_running_loop())
+    if state and state["client"] is not None:
+        client, state["client"] = state["client"], None
+        await client.aclose()
+
+
+async def _get_json(provider_name: str, url: str, token: str, params=None, headers: dict = None) -> dict:
+    """GET with the provider's semaphore held; 429/5xx are retried (Retry-After honoured)."""
+    request_headers = {"Authorization": f"Bearer {token}", **(headers or {})}
+    for attempt in range(GRAPH_MAX_RETRIES + 1):
+        async with _semaphore(provider_name):
+            r = await _client().get(url, params=params, headers=request_headers)
+        if r.status_code in RETRY_STATUSES and attempt < GRAPH_MAX_RETRIES:
+            delay = _retry_delay(r.headers.get("Retry-After"), attempt)
+            await asyncio.sleep(delay + random.uniform(0, delay / 4))
+            continue
+        if r.status_code == 401:
+            raise Exception(f"{provider_name}: authentication failed (401)")
+        r.raise_for_status()
+        return r.json()
+
+
+def _page_closed(topk: TopK, page: List[EmailMessage]) -> bool:
+    """Offer a newest-first page to the shared top-k; True once nothing after it can get in."""
+    if topk is None:
+        return False
+    stamps = [message_ts(msg) for msg in page]
+    for ts in stamps:
+        topk.offer(ts)
+    dated = [ts for ts in stamps if ts]
+    return bool(dated) and topk.excludes(min(dated))
+
+
+async def _gmail_ids(base: str, token: str, query: str, limit: int) -> List[str]:
+    ids, page_token = [], None
+    while len(ids) < limit:
+        params = {"q": query, "maxResults": min(500, limit - len(ids))}
+        if page_token:
+            params["pageToken"] = page_token
+        data = await _get_json("gmail", base, token, params=params)
+        ids.extend(m["id"] for m in data.get("messages", []))
+        page_token = data.get("nextPageToken")
+        if not page_token:
+            break
+    return ids[:limit]
+
+
+async def _gmail_list(provider, folder: str, limit: int, date_start, date_end, unread_only,
+                      topk: TopK = None) -> List[EmailMessage]:
+    from providers.gmail import LIST_METADATA_HEADERS, LIST_FIELDS
+
+    creds = await asyncio.to_thread(provider._get_credentials)
+    query = provider._list_query(folder, date_start, date_end, unread_only)
+    base = f"{GMAIL_API_ROOT}/gmail/v1/users/me/messages"
+    ids = await _gmail_ids(base, creds.token, query, limit)
+
+    meta_params = [("format", "metadata"), ("fields", LIST_FIELDS)]
+    meta_params += [("metadataHeaders", h) for h in LIST_METADATA_HEADERS]
+
+    async def _one(msg_id):
+        try:
+            return await _get_json("gmail", f"{base}/{msg_id}", creds.token, params=meta_params)
+        except Exception as e:
+            logger.warning(f"[ASYNC][GMAIL] get {msg_id} failed: {e}")
+            return None
+
+    emails = []
+    step = GMAIL_LIST_CHUNK if topk is not None else max(len(ids), 1)
+    for start in range(0, len(ids), step):
+        page = []
+        for message in await asyncio.gather(*(_one(msg_id) for msg_id in ids[start:start + step])):
+            if not message:
+                continue
+            email_msg = provider._parse_metadata(message)
+            if email_msg:
+                email_msg.folder = folder
+                page.append(email_msg)
+        emails.extend(page)
+        if start + step < len(ids) and _page_closed(topk, page):
+            if unread_only:
+                unread = len(ids)
+            else:
+                unread_query = provider._list_query(folder, date_start, date_end, True)
+                unread = len(set(ids) & set(await _gmail_ids(base, creds.token, unread_query, limit)))
+            return Listing(emails, total=len(ids), unread=unread)
+    return emails
+
+
+async def _graph_counts(token: str, url: str, params: dict, limit: int):
+    """(total, unread) of the first `limit` messages of a listing, from isRead alone."""
+    params = {**params, "$select": "isRead", "$top": str(min(limit, 1000))}
+    flags = []
+    while url and len(flags) < limit:
+        data = await _get_json("microsoft", url, token, params=params)
+        flags.extend(bool(m.get("isRead")) for m in data.get("value", []))
+        url, params = data.get("@odata.nextLink"), None
+    flags = flags[:limit]
+    return len(flags), sum(1 for is_read in flags if not is_read)
+
+
+async def _graph_list(provider, folder: str, limit: int, date_start, date_end, unread_only,
+                      topk: TopK = None) -> List[EmailMessage]:
+    from providers.microsoft import LIST_SELECT_HEADERS, MS_PAGE_SIZE, PREFER_TEXT, _folder_path, _graph_time
+
+    token = await asyncio.to_thread(provider.get_token)
+    filters = []
+    if date_start:
+        filters.append(f"receivedDateTime ge {_graph_time(date_start)}")
+    if date_end:
+        filters.append(f"receivedDateTime le {_graph_time(date_end)}")
+    if unread_only:
+        filters.append("isRead eq false")
+    params = {"$select": LIST_SELECT_HEADERS, "$top": str(min(limit, MS_PAGE_SIZE)), "$orderby": "receivedDateTime desc"}
+    if filters:
+        params["$filter"] = " and ".join(filters)
+
+    emails = []
+    list_url = f"{GRAPH_ROOT}/me/mailFolders/{_folder_path(folder)}/messages"
+    url, page_params = list_url, params
+    while url and len(emails) < limit:
+        data = await _get_json("microsoft", url, token, params=page_params, headers=PREFER_TEXT)
+        page = [provider._list_item(m, folder) for m in data.get("value", [])]
+        emails.extend(page)
+        url, page_params = data.get("@odata.nextLink"), None
+        if url and len(emails) < limit and _page_closed(topk, page):
+            total, unread = await _graph_counts(token, list_url, params, limit)
+            return Listing(emails, total=total, unread=unread)
+    return emails[:limit]
+
+
+async def list_emails(
+    provider,
+    folder: str = "inbox",
+    limit: int = 50,
+    date_start: datetime = None,
+    date_end: datetime = None,
+    unread_only: bool = False,
+    topk: TopK = None,
+) -> List[EmailMessage]:
+    """
+    Async list_emails(); providers without an HTTP path run the sync call in a
+    worker thread and list in full. topk: shared cut-off to stop paging early.
+    """
+    name = getattr(provider, "provider_name", "")
+    if name == "gmail" and hasattr(provider, "_list_query"):
+        return await _gmail_list(provider, folder, limit, date_start, date_end, unread_only, topk)
+    if name == "microsoft" and hasattr(provider, "_list_item"):
+        return await _graph_list(provider, folder, limit, date_start, date_end, unread_only, topk)
+    async with _semaphore(name):
+        return await asyncio.to_thread(
+            provider.list_emails, folder=folder, limit=limit,
+            date_start=date_start, date_end=date_end, unread_only=unread_only,
+        )
+
+
+def start_fan_out(providers: Dict, jobs: Iterable[Tuple[str, str]], **kwargs) -> Dict[Tuple[str, str], asyncio.Task]:
+    """Schedule list_emails for every (provider_name, folder) job; returns {job: task}."""
+    return {
+        (name, folder): asyncio.ensure_future(list_emails(providers[name], folder=folder, **kwargs))
+        for name, folder in jobs if name in providers
+    }
+
+
+def task_result(task: asyncio.Task):
+    """Result of a finished task, or the exception it raised."""
+    if task.cancelled():
+        return Exception("cancelled")
+    return task.exception() or task.result()
+
+
+async def fan_out(providers: Dict, jobs: Iterable[Tuple[str, str]], **kwargs) -> Dict[Tuple[str, str], object]:
+    """
+    Run list_emails for every (provider_name, folder) job concurrently.
+    Returns {(provider_name, folder): [EmailMessage] or Exception}.
+    """
+    tasks = start_fan_out(providers, jobs, **kwargs)
+    results = await asyncio.gather(*tasks.values(), return_exceptions=True)
+    return dict(zip(tasks, results))
@@ -1,21 +1,27 @@
-import json
 import os
-from datetime import datetime, timedelta
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 from typing import List, Dict, Optional, Any
 from dataclasses import dataclass, asdict
 
 from db import (
     init_db, log_action as db_log_action, list_logs,
-    upsert_message, get_message, mark_status, make_key, set_draft
+    upsert_messages, mark_status, mark_status_many, make_key, set_draft, message_statuses
 )
+from llm import draft_reply
+from mail_sync import local_emails
+from policy_engine import get_engine, load_policy as load_shared_policy
 
 POLICY_PATH = "policy.json"
+AUTOMATION_FETCH_WORKERS = int(os.getenv("AUTOMATION_FETCH_WORKERS", "4"))
+AUTOMATION_DRAFT_WORKERS = int(os.getenv("AUTOMATION_DRAFT_WORKERS", "4"))
+SEND_MODES = ("send_only", "full")
 
 
 def load_policy() -> dict:
     if os.path.exists(POLICY_PATH):
-        with open(POLICY_PATH, "r", encoding="utf-8") as f:
-            return json.load(f)
+        return load_shared_policy()
     return {
         "allow_auto_reply_domains": [],
         "block_reply_domains": ["no-reply", "noreply"],
@@ -33,7 +39,7 @@ def load_policy() -> dict:
 
 def log_action(provider: str, msg_id: str, action: str, status: str, reason: str = "", meta: dict = None):
     key = make_key(provider, msg_id) if msg_id else ""
-    db_log_action(key, provider, msg_id, action, status, reason, meta)
+    db_log_action(key, provider, msg_id, action, status, reason, meta, source="automation")
 
 
 def get_logs(limit: int = 100) -> List[dict]:
@@ -69,45 +75,43 @@ class SkippedEmail:
     reason: str
 
 
-class AutomationEngine:
-    def __init__(self, providers_map: dict):
-        self.providers = providers_map
-        self.policy = load_policy()
-
-    def _matches_keywords(self, text: str, keywords: List[str]) -> bool:
-        text_lower = text.lower()
-        return any(kw.lower() in text_lower for kw in keywords)
+def _elapsed_ms(t0: float) -> float:
+    return round((time.perf_counter() - t0) * 1000, 1)
 
-    def _is_blocked_sender(self, from_addr: str) -> bool:
-        from_lower = from_addr.lower()
-        for domain in self.policy.get("block_reply_domains", []):
-            if domain.lower() in from_lower:
-                return True
-        return False
 
-    def _is_otp_email(self, subject: str, body: str) -> bool:
-        keywords = self.policy.get("never_reply_keywords", [])
-        return self._matches_keywords(subject, keywords) or self._matches_keywords(body[:500], keywords)
+_CLASSIFICATIONS = {
+    "otp": ("otp", "baixa", "mark_read", "Email contém código/OTP - nunca responder"),
+    "automated": ("automated", "baixa", "mark_read", "Remetente no-reply - não requer resposta"),
+    "newsletter": ("newsletter", "baixa", "delete_candidate", "Newsletter detectada - candidato a exclusão"),
+    "human": ("human", "média", "suggest_reply", "Email de pessoa - sugerir resposta"),
+}
 
-    def _is_newsletter(self, subject: str, body: str) -> bool:
-        keywords = self.policy.get("safe_newsletter_keywords", [])
-        return self._matches_keywords(body[:1000], keywords)
 
-    def classify_email(self, email: dict) -> tuple:
-        from_addr = email.get("from", "")
-        subject = email.get("subject", "")
-        body = email.get("body", "")
-
-        if self._is_otp_email(subject, body):
-            return "otp", "baixa", "mark_read", "Email contém código/OTP - nunca responder"
+class AutomationEngine:
+    """
+    run() is a staged pipeline over the whole batch:
+    fetch (one unread listing per provider x folder, concurrently) ->
+    classify (compiled policy engine, one pass per batch, one bulk upsert) ->
+    draft (LLM calls on a bounded pool) ->
+    act (sends capped by max_send_per_run, then one mark_read_many per provider).
+    """
 
-        if self._is_blocked_sender(from_addr):
-            return "automated", "baixa", "mark_read", "Remetente no-reply - não requer resposta"
+    def __init__(self, providers_map: dict):
+        self.providers = providers_map
+        self.policy = load_policy()
+        self._engine = get_engine(self.policy)
 
-        if self._is_newsletter(subject, body):
-            return "newsletter", "baixa", "delete_candidate", "Newsletter detectada - candidato a exclusão"
+    def classify_many(self, emails: List[dict]) -> List[tuple]:
+        """(category, priority, action, reason) per email, in order."""
+        categories = self._engine.classify_batch(
+            [(e.get("from", "") or "", e.get("subject", "") or "", e.get("body", "") or "") for e in emails],
+            otp_window=500, newsletter_window=1000,
+            header_classes=[e.get("header_class") for e in emails],
+        )
+        return [_CLASSIFICATIONS[category] for category in categories]
 
-        return "human", "média", "suggest_reply", "Email de pessoa - sugerir resposta"
+    def classify_email(self, email: dict) -> tuple:
+        return self.classify_many([email])[0]
 
     def _parse_date(self, date_str: str) -> Optional[datetime]:
         from email.utils import parsedate_to_datetime
@@ -128,33 +132,200 @@ class AutomationEngine:
             cutoff = cutoff.replace(tzinfo=timezone.utc)
         return parsed < cutoff
 
+    def _email_dicts(self, emails) -> List[dict]:
+        result = []
+        for email_msg in emails:
+            email_dict = email_msg.to_dict()
+            email_dict["_fetched"] = True
+            email_dict["_message"] = email_msg
+            email_dict["header_class"] = getattr(email_msg, "header_class", None)
+            result.append(email_dict)
+        return result
+
+    def fetch_local_emails(self, provider_name: str, folder: str, max_count: int, since_hours: int) -> List[dict]:
+        """
+        Unread mail from the store kept by the sync scheduler (source=local);
+        rows stored without a body are fetched before classification.
+        """
+        since = datetime.now(timezone.utc) - timedelta(hours=since_hours)
+        try:
+            emails = local_emails(provider_name, folder, date_start=since, unread_only=True, limit=max_count,
+                                  providers=self.providers)
+        except Exception as e:
+            log_action(provider_name, "unknown", "fetch", "error", str(e))
+            return []
+        return self._email_dicts(emails)
+
     def fetch_emails(self, provider_name: str, folder: str, max_count: int, since_hours: int) -> List[dict]:
+        """
+        One unread listing for the folder; snippet-only messages get their bodies
+        in one fetch_many, except those the list headers already classify.
+        """
         if provider_name not in self.providers:
             return []
 
         provider = self.providers[provider_name]
-        emails = []
-        cutoff = datetime.utcnow() - timedelta(hours=since_hours)
-
-        for _ in range(max_count):
+        since = datetime.now(timezone.utc) - timedelta(hours=since_hours)
+        try:
+            emails = provider.list_emails(folder=folder, limit=max_count, date_start=since, unread_only=True)
+            snippets = [m.id for m in emails
+                        if getattr(m, "body_is_snippet", False) and not getattr(m, "header_class", None)]
+            if snippets:
+                full = provider.fetch_many(snippets)
+                emails = [full.get(m.id, m) for m in emails]
+        except Exception as e:
+            log_action(provider_name, "unknown", "fetch", "error", str(e))
+            return []
+        return self._email_dicts(emails)
+
+    def _hydrate_stage(self, entries: List[dict]) -> List[dict]:
+        """
+        Full bodies for snippet-only candidates (local rows synced from
+        metadata), one fetch_many per provider. Candidates whose body can't be
+        fetched are marked skip and left out, so nothing is drafted or sent
+        against an empty body.
+        """
+        by_provider: Dict[str, List[dict]] = {}
+        for entry in entries:
+            if getattr(entry["email"].get("_message"), "body_is_snippet", False):
+                by_provider.setdefault(entry["provider"], []).append(entry)
+        if not by_provider:
+            return entries
+
+        rows = []
+        missing = set()
+        for provider_name, group in by_provider.items():
             try:
-                email_msg = provider.queue_next(folder)
-                if not email_msg:
-                    break
-                email_dict = email_msg.to_dict()
-                
-                if self._is_too_old(email_dict.get("date", ""), cutoff):
-                    log_action(provider_name, email_dict.get("id", "unknown"), "skip", "skipped", 
-                              f"Email mais antigo que {since_hours}h")
-                    continue
-                
-                email_dict["_fetched"] = True
-                emails.append(email_dict)
+                full = self.providers[provider_name].fetch_many([entry["email"].get("id") for entry in group])
             except Exception as e:
                 log_action(provider_name, "unknown", "fetch", "error", str(e))
-                break
+                full = {}
+            for entry in group:
+                email_msg = full.get(entry["email"].get("id"))
+                if not email_msg or not email_msg.body:
+                    entry["proc"].recommended_action = "skip"
+                    entry["proc"].reason = "Corpo da mensagem indisponível"
+                    missing.add(entry["key"])
+                    continue
+                entry["email"].update(body=email_msg.body, _message=email_msg)
+                rows.append({"key": entry["key"], "provider": provider_name, "msg_id": email_msg.id,
+                             "body": email_msg.body, "status": None})
+        upsert_messages(rows)
+        return [entry for entry in entries if entry["key"] not in missing]
+
+    def _draft_one(self, entry: dict):
+        email = entry["email"]
+        proc = entry["proc"]
+        provider = self.providers[entry["provider"]]
+        # provider-specific sender checks (e.g. Apple's OTP patterns) are pure string tests
+        if hasattr(type(provider), "_is_otp_email"):
+            skip, reason = provider._is_otp_email(proc.from_addr or "", proc.subject or "")
+            if skip:
+                proc.recommended_action = "skip"
+                proc.reason = reason or "Filtrado pelo provider"
+                return
+        try:
+            suggestion = draft_reply(proc.from_addr, proc.subject, email.get("body", ""))
+            proc.draft_reply = suggestion.get("reply", suggestion["raw"])
+            if proc.draft_reply:
+                set_draft(entry["key"], proc.draft_reply)
+                entry["draft_ok"] = True
+        except Exception as e:
+            proc.draft_reply = f"Erro ao gerar sugestão: {str(e)}"
+
+    def _draft_stage(self, entries: List[dict]):
+        if not entries:
+            return
+        with ThreadPoolExecutor(max_workers=max(min(len(entries), AUTOMATION_DRAFT_WORKERS), 1)) as pool:
+            list(pool.map(self._draft_one, entries))
+
+    def _send_one(self, entry: dict, executed: List[dict]) -> bool:
+        provider_name, email_id = entry["provider"], entry["email"].get("id", "unknown")
+        try:
+            self.providers[provider_name].send_reply(email_id, entry["proc"].draft_reply,
+                                                     original=entry["email"].get("_message"))
+        except Exception as e:
+            executed.append(asdict(ExecutedAction(provider_name, email_id, "send", "error", str(e))))
+            log_action(provider_name, email_id, "send", "error", str(e))
+            return False
+        entry["sent"] = True
+        mark_status(entry["key"], "sent")
+        executed.append(asdict(ExecutedAction(provider_name, email_id, "send", "success", "Resposta enviada")))
+        log_action(provider_name, email_id, "send", "success", "Resposta enviada")
+        return True
+
+    def _reply_stage(self, candidates: List[dict], max_send: int):
+        """
+        Draft and send in waves: each wave drafts only as many candidates as
+        sends are still allowed, and bodies that couldn't be fetched, skipped
+        drafts or failed sends are made up from the next candidates until
+        max_send replies went out or the candidates run out.
+        Returns (executed, draft_ms).
+        """
+        executed = []
+        sent = 0
+        drafted = 0
+        draft_ms = 0.0
+        while sent < max_send and drafted < len(candidates):
+            wave = candidates[drafted:drafted + max_send - sent]
+            drafted += len(wave)
+            t0 = time.perf_counter()
+            wave = self._hydrate_stage(wave)
+            self._draft_stage(wave)
+            draft_ms += _elapsed_ms(t0)
+            for entry in wave:
+                if entry.get("draft_ok") and self._send_one(entry, executed):
+                    sent += 1
+        return executed, round(draft_ms, 1)
+
+    def _act_stage(self, entries: List[dict], mode: str) -> List[dict]:
+        executed = []
+        to_mark_read: Dict[str, List[dict]] = {}
+
+        for entry in entries:
+            provider_name, action = entry["provider"], entry["action"]
+
+            if action == "mark_read" and mode in SEND_MODES:
+                to_mark_read.setdefault(provider_name, []).append(dict(entry, final_status="read"))
 
-        return emails
+            elif action == "suggest_reply" and entry.get("sent"):
+                to_mark_read.setdefault(provider_name, []).append(dict(entry, final_status=None))
+
+            elif action == "delete_candidate":
+                if mode == "full" and self.policy.get("delete_strategy") == "two_step":
+                    to_mark_read.setdefault(provider_name, []).append(dict(entry, final_status="pending_delete"))
+
+        # one bulk mark-read per provider; two-step deletes only become pending_delete once read
+        for provider_name, group in to_mark_read.items():
+            ids = [entry["email"].get("id", "unknown") for entry in group]
+            try:
+                results = self.providers[provider_name].mark_read_many(ids)
+            except Exception as e:
+                results = {msg_id: e for msg_id in ids}
+
+            by_status: Dict[str, List[str]] = {}
+            for entry, msg_id in zip(group, ids):
+                result = results.get(msg_id)
+                failed = isinstance(result, Exception)
+                status = entry["final_status"]
+                if status is None:
+                    continue
+                if status == "read":
+                    action, reason = "mark_read", entry["reason"]
+                else:
+                    action, reason = "pending_delete", "Marcado como lido, pendente exclusão"
+                if failed:
+                    if action == "mark_read":
+                        executed.append(asdict(ExecutedAction(provider_name, msg_id, action, "error", str(result))))
+                    log_action(provider_name, msg_id, action, "error", str(result))
+                    continue
+                by_status.setdefault(status, []).append(entry["key"])
+                executed.append(asdict(ExecutedAction(provider_name, msg_id, action, "success", reason)))
+                log_action(provider_name, msg_id, action, "success", reason)
+            for status, keys in by_status.items():
+                mark_status_many(keys, status)
+
+        return executed
 
     def run(
         self,
@@ -162,131 +333,115 @@ class AutomationEngine:
         folders: List[str],
         max_per_provider: int,
         mode: str,
-        since_hours: int
+        since_hours: int,
+        source: str = "live"
     ) -> dict:
-        processed = []
-        executed = []
         skipped = []
-        send_count = 0
+        timings = {}
         max_send = self.policy.get("max_send_per_run", 3)
 
+        # 1. fetch: every provider x folder listing at once
+        t0 = time.perf_counter()
+        jobs = []
         for provider_name in provider_names:
             if provider_name not in self.providers:
                 skipped.append(SkippedEmail(provider_name, "n/a", f"Provider {provider_name} não disponível"))
                 continue
-
-            provider = self.providers[provider_name]
-
-            for folder in folders:
-                emails = self.fetch_emails(provider_name, folder, max_per_provider, since_hours)
-
-                for email in emails:
-                    email_id = email.get("id", "unknown")
-                    from_addr = email.get("from", "")
-                    subject = email.get("subject", "")
-                    body = email.get("body", "")
-                    
-                    key = make_key(provider_name, email_id)
-                    existing = get_message(key)
-                    if existing and existing.get("status") in ("sent", "deleted"):
-                        skipped.append(SkippedEmail(provider_name, email_id, f"Já processado: {existing['status']}"))
-                        continue
-
-                    category, priority, action, reason = self.classify_email(email)
-                    
-                    upsert_message(
-                        key=key,
-                        provider=provider_name,
-                        msg_id=email_id,
-                        folder=folder,
-                        from_addr=from_addr,
-                        subject=subject,
-                        date=email.get("date", ""),
-                        body=body,
-                        status="classified",
-                        category=category,
-                        priority=priority
-                    )
-
-                    proc = ProcessedEmail(
-                        provider=provider_name,
-                        id=email_id,
-                        from_addr=from_addr,
-                        subject=subject,
-                        category=category,
-                        priority=priority,
-                        recommended_action=action,
-                        reason=reason
-                    )
-
-                    if action == "suggest_reply" and send_count < max_send:
-                        try:
-                            suggestion = provider.suggest_reply(email_id)
-                            if suggestion.get("skip"):
-                                proc.recommended_action = "skip"
-                                proc.reason = suggestion.get("reason", "Filtrado pelo provider")
-                            else:
-                                proc.draft_reply = suggestion.get("suggested_reply", "")
-                                if proc.draft_reply:
-                                    set_draft(key, proc.draft_reply)
-                        except Exception as e:
-                            proc.draft_reply = f"Erro ao gerar sugestão: {str(e)}"
-
-                    processed.append(asdict(proc))
-
-                    if mode == "dry_run":
-                        log_action(provider_name, email_id, action, "dry_run", reason)
-                        continue
-
-                    if action == "mark_read":
-                        if mode in ("send_only", "full"):
-                            try:
-                                provider.mark_read(email_id)
-                                mark_status(key, "read")
-                                executed.append(asdict(ExecutedAction(
-                                    provider_name, email_id, "mark_read", "success", reason
-                                )))
-                                log_action(provider_name, email_id, "mark_read", "success", reason)
-                            except Exception as e:
-                                executed.append(asdict(ExecutedAction(
-                                    provider_name, email_id, "mark_read", "error", str(e)
-                                )))
-                                log_action(provider_name, email_id, "mark_read", "error", str(e))
-
-                    elif action == "suggest_reply" and proc.draft_reply and send_count < max_send:
-                        if mode in ("send_only", "full"):
-                            try:
-                                provider.send(email_id)
-                                send_count += 1
-                                mark_status(key, "sent")
-                                executed.append(asdict(ExecutedAction(
-                                    provider_name, email_id, "send", "success", "Resposta enviada"
-                                )))
-                                log_action(provider_name, email_id, "send", "success", "Resposta enviada")
-                                provider.mark_read(email_id)
-                            except Exception as e:
-                                executed.append(asdict(ExecutedAction(
-                                    provider_name, email_id, "send", "error", str(e)
-                                )))
-                                log_action(provider_name, email_id, "send", "error", str(e))
-
-                    elif action == "delete_candidate":
-                        if mode == "full" and self.policy.get("delete_strategy") == "two_step":
-                            try:
-                                provider.mark_read(email_id)
-                                mark_status(key, "pending_delete")
-                                executed.append(asdict(ExecutedAction(
-                                    provider_name, email_id, "pending_delete", "success",
-                                    "Marcado como lido, pendente exclusão"
-                                )))
-                                log_action(provider_name, email_id, "pending_delete", "success",
-                                          "Marcado como lido, pendente exclusão")
-                            except Exception as e:
-                                log_action(provider_name, email_id, "pending_delete", "error", str(e))
+            jobs.extend((provider_name, folder) for folder in folders)
+
+        fetch = self.fetch_local_emails if source == "local" else self.fetch_emails
+        fetched = []
+        if jobs:
+            with ThreadPoolExecutor(max_workers=max(min(len(jobs), AUTOMATION_FETCH_WORKERS), 1)) as pool:
+                fetched = list(pool.map(lambda job: fetch(job[0], job[1], max_per_provider, since_hours), jobs))
+        batch = [
+            (provider_name, folder, email)
+            for (provider_name, folder), emails in zip(jobs, fetched)
+            for email in emails
+        ]
+        timings["fetch_ms"] = _elapsed_ms(t0)
+
+        # 2. classify the whole batch, one status lookup and one upsert
+        t0 = time.perf_counter()
+        keys = [make_key(provider_name, email.get("id", "unknown"), folder) for provider_name, folder, email in batch]
+        statuses = message_statuses(keys)
+        pending = []
+        seen = set()
+        for (provider_name, folder, email), key in zip(batch, keys):
+            status = statuses.get(key)
+            if status in ("sent", "deleted"):
+                skipped.append(SkippedEmail(provider_name, email.get("id", "unknown"), f"Já processado: {status}"))
+                continue
+            if key in seen:
+                continue
+            seen.add(key)
+            pending.append((provider_name, folder, email, key))
+
+        entries = []
+        rows = []
+        classes = self.classify_many([email for _, _, email, _ in pending])
+        for (provider_name, folder, email, key), (category, priority, action, reason) in zip(pending, classes):
+            email_id = email.get("id", "unknown")
+            rows.append({
+                "key": key,
+                "provider": provider_name,
+                "msg_id": email_id,
+                "folder": folder,
+                "from_addr": email.get("from", ""),
+                "subject": email.get("subject", ""),
+                "date": email.get("date", ""),
+                "body": None if getattr(email.get("_message"), "body_is_snippet", False) else email.get("body", ""),
+                "status": "classified",
+                "category": category,
+                "priority": priority,
+                "header_class": email.get("header_class"),
+            })
+            entries.append({
+                "provider": provider_name,
+                "key": key,
+                "email": email,
+                "action": action,
+                "reason": reason,
+                "proc": ProcessedEmail(
+                    provider=provider_name,
+                    id=email_id,
+                    from_addr=email.get("from", ""),
+                    subject=email.get("subject", ""),
+                    category=category,
+                    priority=priority,
+                    recommended_action=action,
+                    reason=reason
+                ),
+            })
+        upsert_messages(rows)
+        timings["classify_ms"] = _elapsed_ms(t0)
+
+        # 3. drafts; when sending, drafted in waves until max_send replies went out
+        t0 = time.perf_counter()
+        candidates = [e for e in entries if e["action"] == "suggest_reply"]
+        executed = []
+        if mode in SEND_MODES:
+            executed, draft_ms = self._reply_stage(candidates, max_send)
+        else:
+            self._draft_stage(self._hydrate_stage(candidates if mode == "dry_run" else candidates[:max_send]))
+            draft_ms = _elapsed_ms(t0)
+        send_ms = _elapsed_ms(t0) - draft_ms
+        timings["draft_ms"] = draft_ms
+
+        # 4. act
+        t0 = time.perf_counter()
+        if mode == "dry_run":
+            for entry in entries:
+                log_action(entry["provider"], entry["email"].get("id", "unknown"), entry["action"],
+                           "dry_run", entry["reason"])
+        else:
+            executed += self._act_stage(entries, mode)
+        timings["act_ms"] = round(_elapsed_ms(t0) + send_ms, 1)
 
         return {
             "mode": mode,
-            "processed": processed,
+            "processed": [asdict(entry["proc"]) for entry in entries],
             "executed": executed,
-            "skipped": [asdict(s) if isinstance(s, SkippedEmail) else s for s in skipped]
+            "skipped": [asdict(s) if isinstance(s, SkippedEmail) else s for s in skipped],
+            "timings": timings,
         }
@@ -0,0 +1,54 @@
+"""
+Micro-benchmark: bulk classification.
+
+Compares assistant_loop.classify_email() called once per email (one dict per
+result) against policy_engine.classify_many() over the same emails as
+columns (one byte code per row), at 1k / 10k / 100k synthetic emails using
+policy.json. A quarter of the emails carry a header_class.
+
+Run from the repo root:
+    python benchmarks/bench_classify_many.py [count ...]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from assistant_loop import classify_email  # noqa: E402
+from policy_engine import CATEGORY_NAMES, classify_many, load_policy, np  # noqa: E402
+from bench_policy_engine import build_emails, bench  # noqa: E402
+
+HEADER_CLASSES = [None, None, None, "list"]
+
+
+def build_records(count: int):
+    emails = build_emails(count)
+    return {
+        "from": [e[0] for e in emails],
+        "subject": [e[1] for e in emails],
+        "body": [e[2] for e in emails],
+        "header_class": [HEADER_CLASSES[i % 4] for i in range(count)],
+    }
+
+
+def per_email(records, policy):
+    return [
+        classify_email(f, s, b, policy=policy, header_class=hc)
+        for f, s, b, hc in zip(records["from"], records["subject"], records["body"], records["header_class"])
+    ]
+
+
+if __name__ == "__main__":
+    counts = [int(arg) for arg in sys.argv[1:]] or [1_000, 10_000, 100_000]
+    policy = load_policy()
+    print(f"numpy: {'yes' if np is not None else 'no (bytes output)'}")
+    for count in counts:
+        records = build_records(count)
+        expected = [r["category"] for r in per_email(records, policy)]
+        assert [CATEGORY_NAMES[c] for c in classify_many(records, policy)["category"]] == expected
+
+        t_single = bench(lambda: per_email(records, policy))
+        t_many = bench(lambda: classify_many(records, policy))
+        print(f"{count:>7} emails   per email {t_single * 1000:8.1f} ms   "
+              f"classify_many {t_many * 1000:8.1f} ms   ({t_single / t_many:.2f}x)")
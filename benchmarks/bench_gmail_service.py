@@ -0,0 +1,102 @@
+"""
+Micro-benchmark: per-call overhead of GmailProvider._get_service().
+
+Serves a tiny stand-in for the Gmail REST API on 127.0.0.1 and times
+`users.labels.get` calls made the previous way (discovery build() plus a
+fresh HTTP object on every call) against the cached service with a
+per-thread keep-alive transport.
+
+Run from the repo root:
+    python benchmarks/bench_gmail_service.py [calls]
+"""
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class _GmailStandIn(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        body = json.dumps({"id": "INBOX", "messagesTotal": 42, "messagesUnread": 7}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def _start_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _GmailStandIn)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def _fake_creds():
+    from google.oauth2.credentials import Credentials
+    creds = Credentials(token="bench-token", refresh_token="bench-refresh",
+                        client_id="bench", client_secret="bench")
+    creds.expiry = datetime.utcnow() + timedelta(hours=1)
+    return creds
+
+
+def run_legacy(endpoint: str, calls: int):
+    from googleapiclient.discovery import build
+    creds = _fake_creds()
+    for _ in range(calls):
+        service = build('gmail', 'v1', credentials=creds, cache_discovery=False,
+                        client_options={"api_endpoint": endpoint})
+        service.users().labels().get(userId='me', id='INBOX').execute()
+
+
+def run_cached(provider, calls: int):
+    for _ in range(calls):
+        provider._get_service().users().labels().get(userId='me', id='INBOX').execute()
+
+
+def timed(fn, *args) -> float:
+    t0 = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - t0
+
+
+if __name__ == "__main__":
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    server = _start_server()
+    endpoint = f"http://127.0.0.1:{server.server_address[1]}/"
+
+    import providers.gmail as gmail
+    gmail.GMAIL_API_ENDPOINT = endpoint
+    provider = gmail.GmailProvider(base_url="http://localhost")
+    creds = _fake_creds()
+    provider._load_credentials = lambda: creds
+
+    run_cached(provider, 5)  # warm: first build + connection
+
+    t_legacy = timed(run_legacy, endpoint, calls)
+    t_cached = timed(run_cached, provider, calls)
+
+    workers = 8
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        t0 = time.perf_counter()
+        list(pool.map(lambda _: run_cached(provider, calls // workers), range(workers)))
+        t_threads = time.perf_counter() - t0
+
+    print(f"calls:                  {calls}")
+    print(f"build() per call:       {t_legacy / calls * 1000:8.2f} ms/call")
+    print(f"cached service:         {t_cached / calls * 1000:8.2f} ms/call")
+    print(f"cached, {workers} threads:      {t_threads / calls * 1000:8.2f} ms/call")
+    print(f"speedup (serial):       {t_legacy / t_cached:8.2f}x")
+    server.shutdown()
@@ -0,0 +1,127 @@
+"""
+Micro-benchmark: IMAP FETCH header batch parsing.
+
+Compares the previous per-item path (three re.search calls, a full
+email.message_from_bytes per item, uncached MIME decoding) against
+apple_imap.parse_fetch_headers on a synthetic 1,500-message header scan.
+
+Run from the repo root:
+    python benchmarks/bench_imap_fetch_parser.py
+"""
+import email
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from apple_imap import parse_fetch_headers, _parse_internaldate, _clean_text  # noqa: E402
+from email.header import decode_header, make_header  # noqa: E402
+
+SENDERS = [
+    "=?UTF-8?B?TG9qYSBWaXJ0dWFs?= <ofertas@loja.com.br>",
+    "Ana Souza <ana@cliente.com>",
+    "=?UTF-8?Q?Jo=C3=A3o_Silva?= <joao@empresa.com>",
+    "GitHub <noreply@github.com>",
+    "Newsletter <news@example.com>",
+]
+SUBJECTS = [
+    "=?UTF-8?Q?Promo=C3=A7=C3=A3o_da_semana?=",
+    "Reunião amanhã",
+    "=?UTF-8?B?U2V1IGPDs2RpZ28gZGUgdmVyaWZpY2HDp8Ojbw==?=",
+    "[repo] New pull request",
+    "Weekly digest",
+]
+
+
+def build_response(count: int):
+    data = []
+    for i in range(count):
+        flags = "\\Seen" if i % 3 else ""
+        meta = (
+            f'{i + 1} (UID {10000 + i} INTERNALDATE "{(i % 28) + 1:02d}-Jul-2026 10:{i % 60:02d}:00 -0300" '
+            f'FLAGS ({flags}) RFC822.SIZE {2048 + i} '
+            f'BODY[HEADER.FIELDS (FROM SUBJECT DATE LIST-ID)] {{256}}'
+        ).encode()
+        headers = (
+            f"From: {SENDERS[i % len(SENDERS)]}\r\n"
+            f"Subject: {SUBJECTS[i % len(SUBJECTS)]}\r\n"
+            f"Date: Fri, {(i % 28) + 1:02d} Jul 2026 10:{i % 60:02d}:00 -0300\r\n"
+            + ("List-Id: <news.example.com>\r\n" if i % 5 == 4 else "")
+            + "\r\n"
+        ).encode()
+        data.append((meta, headers))
+        data.append(b")")
+    return data
+
+
+def _legacy_decode_mime(s):
+    if not s:
+        return ""
+    try:
+        return str(make_header(decode_header(s)))
+    except Exception:
+        return s
+
+
+def legacy_parse(data):
+    out = []
+    for item in data:
+        if not isinstance(item, tuple) or len(item) < 2:
+            continue
+        meta = item[0].decode("utf-8", errors="ignore")
+        m = re.search(r"UID\s+(\d+)", meta)
+        if not m:
+            continue
+        uid = int(m.group(1))
+        im = re.search(r'INTERNALDATE\s+"([^"]+)"', meta)
+        dt_utc = _parse_internaldate(im.group(1) if im else "")
+        flags = []
+        fm = re.search(r"FLAGS\s+\(([^)]*)\)", meta)
+        if fm:
+            flags = [f.strip() for f in fm.group(1).split() if f.strip()]
+        msg = email.message_from_bytes(item[1])
+        out.append((
+            uid, dt_utc, flags,
+            _clean_text(_legacy_decode_mime(msg.get("From", ""))),
+            _clean_text(_legacy_decode_mime(msg.get("Subject", ""))),
+            _legacy_decode_mime(msg.get("Date", "")),
+            msg.get("List-Id", "") or "",
+        ))
+    return out
+
+
+def fast_parse(data):
+    return [
+        (r.uid, r.dt_utc, r.flags, _clean_text(r.from_addr), _clean_text(r.subject),
+         r.date_header, r.headers["list-id"])
+        for r in parse_fetch_headers(data)
+    ]
+
+
+def bench(fn, data, rounds: int = 5) -> float:
+    best = float("inf")
+    for _ in range(rounds):
+        t0 = time.perf_counter()
+        fn(data)
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1500
+    data = build_response(count)
+
+    legacy = legacy_parse(data)
+    fast = fast_parse(data)
+    assert [r[0] for r in legacy] == [r[0] for r in fast]
+    assert [r[3] for r in legacy] == [r[3] for r in fast]
+    assert [r[1] for r in legacy] == [r[1] for r in fast]
+
+    t_legacy = bench(legacy_parse, data)
+    t_fast = bench(fast_parse, data)
+    print(f"messages:        {count}")
+    print(f"legacy parser:   {t_legacy * 1000:8.1f} ms")
+    print(f"fetch parser:    {t_fast * 1000:8.1f} ms")
+    print(f"speedup:         {t_legacy / t_fast:8.2f}x")
@@ -0,0 +1,97 @@
+"""
+Micro-benchmark: policy classification.
+
+Compares the previous classifier (policy.json stat()ed per email, every keyword
+lower()ed per call, subject+body copied and lower()ed per check) against
+policy_engine: categorize() per email and classify_batch() over the whole
+set, on 100,000 synthetic emails using policy.json.
+
+Run from the repo root:
+    python benchmarks/bench_policy_engine.py [count]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from policy_engine import PolicyEngine, load_policy  # noqa: E402
+
+SENDERS = [
+    "Ana Souza <ana@cliente.com>",
+    "GitHub <noreply@github.com>",
+    "Banco <seguranca@banco.com.br>",
+    "Newsletter <news@example.com>",
+    "João Silva <joao@empresa.com>",
+]
+SUBJECTS = [
+    "Reunião amanhã",
+    "[repo] New pull request",
+    "Seu código de verificação",
+    "Weekly digest",
+    "Proposta comercial",
+]
+BODIES = [
+    "Oi, podemos conversar amanhã sobre o projeto? " * 20,
+    "A new pull request was opened in your repository. " * 15,
+    "Use o código 123456 para acessar sua conta. " * 5,
+    "Here is this week's digest. " * 40 + "To unsubscribe click here.",
+    "Segue em anexo a proposta revisada conforme combinamos. " * 25,
+]
+
+
+def build_emails(count: int):
+    return [
+        (SENDERS[i % 5], SUBJECTS[(i // 5) % 5], BODIES[(i // 25) % 5] + f" #{i}")
+        for i in range(count)
+    ]
+
+
+def legacy_classify(policy: dict, from_addr: str, subject: str, body: str) -> str:
+    never_reply_kw = policy.get("never_reply_keywords", [])
+    newsletter_kw = policy.get("newsletter_keywords", []) or policy.get("safe_newsletter_keywords", [])
+    check_text = f"{subject} {body[:1000]}".lower()
+    if any(kw.lower() in check_text for kw in never_reply_kw):
+        return "otp"
+    from_lower = from_addr.lower()
+    if any(domain.lower() in from_lower for domain in policy.get("block_reply_domains", [])):
+        return "automated"
+    body_lower = body[:2000].lower()
+    if any(kw.lower() in body_lower for kw in newsletter_kw):
+        return "newsletter"
+    return "human"
+
+
+def legacy_with_stat(policy: dict, from_addr: str, subject: str, body: str) -> str:
+    os.path.getmtime("policy.json")
+    return legacy_classify(policy, from_addr, subject, body)
+
+
+def bench(fn, rounds: int = 3) -> float:
+    best = float("inf")
+    for _ in range(rounds):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    policy = load_policy()
+    engine = PolicyEngine(policy)
+    emails = build_emails(count)
+
+    legacy = [legacy_classify(policy, *e) for e in emails]
+    assert [engine.categorize(*e) for e in emails] == legacy
+    assert engine.classify_batch(emails) == legacy
+
+    t_stat = bench(lambda: [legacy_with_stat(policy, *e) for e in emails])
+    t_legacy = bench(lambda: [legacy_classify(policy, *e) for e in emails])
+    t_single = bench(lambda: [engine.categorize(*e) for e in emails])
+    t_batch = bench(lambda: engine.classify_batch(emails))
+    print(f"emails:          {count}")
+    print(f"legacy + stat:   {t_stat * 1000:8.1f} ms")
+    print(f"legacy:          {t_legacy * 1000:8.1f} ms")
+    print(f"engine / email:  {t_single * 1000:8.1f} ms   ({t_stat / t_single:.2f}x / {t_legacy / t_single:.2f}x)")
+    print(f"engine batch:    {t_batch * 1000:8.1f} ms   ({t_stat / t_batch:.2f}x / {t_legacy / t_batch:.2f}x)")
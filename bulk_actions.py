@@ -0,0 +1,83 @@
+"""
+Grouped execution of provider mutations.
+
+Dispatch paths walk their actions one by one for validation (skip rules,
+dry runs, status checks, two-step delete). Actions that pass and need a
+provider call are added to a GroupedActions batch with what to do on
+success and on failure; execute() then makes one *_many call per
+(provider, action) group (single calls for groups of one or actions without
+a bulk form) and reports each item through its callbacks. Nothing reaches the
+provider before validation is done.
+"""
+import logging
+from typing import Any, Callable, Dict, Iterable, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+BULK_METHODS = {
+    "mark_read": "mark_read_many",
+    "mark_unread": "mark_unread_many",
+    "delete": "delete_many",
+}
+
+
+def execute_grouped(providers: Dict, ops: Iterable[Tuple[str, str, str]]) -> Dict[Tuple[str, str, str], Any]:
+    """
+    Run validated (provider_name, action, msg_id) ops, grouped per provider and
+    action. Returns {op: result or Exception} for every op.
+    """
+    groups: Dict[Tuple[str, str], List[str]] = {}
+    for provider_name, action, msg_id in ops:
+        ids = groups.setdefault((provider_name, action), [])
+        if msg_id not in ids:
+            ids.append(msg_id)
+
+    results: Dict[Tuple[str, str, str], Any] = {}
+    for (provider_name, action), ids in groups.items():
+        provider = providers.get(provider_name)
+        if provider is None:
+            for msg_id in ids:
+                results[(provider_name, action, msg_id)] = Exception(f"Provider not available: {provider_name}")
+            continue
+        if action in BULK_METHODS and len(ids) > 1:
+            try:
+                per_id = getattr(provider, BULK_METHODS[action])(ids)
+            except Exception as e:
+                logger.warning(f"Bulk {action} on {provider_name} failed for {len(ids)} ids: {e}")
+                per_id = {msg_id: e for msg_id in ids}
+            logger.info(f"Bulk {action} on {provider_name}: {len(ids)} ids in one call")
+            for msg_id in ids:
+                results[(provider_name, action, msg_id)] = per_id.get(
+                    msg_id, Exception(f"No result for {msg_id}"))
+            continue
+        for msg_id in ids:
+            try:
+                results[(provider_name, action, msg_id)] = getattr(provider, action)(msg_id)
+            except Exception as e:
+                results[(provider_name, action, msg_id)] = e
+    return results
+
+
+class GroupedActions:
+    """Provider mutations collected during validation, executed together by execute()."""
+
+    def __init__(self, providers: Dict):
+        self.providers = providers
+        self._pending: List[Tuple[Tuple[str, str, str], Callable, Callable]] = []
+
+    def add(self, provider_name: str, action: str, msg_id: str,
+            on_success: Callable[[Any], None], on_error: Callable[[Exception], None]):
+        self._pending.append(((provider_name, action, msg_id), on_success, on_error))
+
+    def __len__(self):
+        return len(self._pending)
+
+    def execute(self):
+        pending, self._pending = self._pending, []
+        results = execute_grouped(self.providers, [op for op, _ok, _err in pending])
+        for op, on_success, on_error in pending:
+            result = results[op]
+            if isinstance(result, Exception):
+                on_error(result)
+            else:
+                on_success(result)
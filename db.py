@@ -1,8 +1,9 @@
 import sqlite3
 import json
 import hashlib
-from datetime import datetime
-from typing import Optional, List, Dict, Any
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Optional, List, Dict, Any, Tuple
 
 DB_PATH = "automation.db"
 
@@ -47,6 +48,29 @@ def init_db():
     except:
         pass
     
+    try:
+        cursor.execute("ALTER TABLE messages ADD COLUMN unread INTEGER")
+    except:
+        pass
+    
+    try:
+        cursor.execute("ALTER TABLE messages ADD COLUMN received_ts INTEGER")
+    except:
+        pass
+    
+    try:
+        cursor.execute("ALTER TABLE messages ADD COLUMN header_class TEXT")
+    except:
+        pass
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_messages_local ON messages(provider, folder, received_ts)")
+    version = cursor.execute("PRAGMA user_version").fetchone()[0]
+    if version < 1:
+        _backfill_received_ts(cursor)
+    if version < 2:
+        # classes stored while List-Id/List-Unsubscribe/no-reply senders still counted as definitive
+        cursor.execute("UPDATE messages SET header_class = NULL")
+        cursor.execute("PRAGMA user_version = 2")
+    
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS drafts (
             key TEXT PRIMARY KEY,
@@ -75,6 +99,11 @@ def init_db():
     except:
         pass
     
+    try:
+        cursor.execute("ALTER TABLE actions ADD COLUMN source TEXT")
+    except:
+        pass
+    
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS logs (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -238,48 +267,109 @@ def init_db():
     cursor.execute("CREATE INDEX IF NOT EXISTS idx_ui_snapshots_session ON ui_snapshots(session_id, created_at)")
     cursor.execute("CREATE INDEX IF NOT EXISTS idx_ui_snapshots_created ON ui_snapshots(created_at)")
 
+    # /ui/messages response cache: latest snapshot per normalized filter set
+    for column in ("filter_key TEXT", "etag TEXT", "response_json TEXT"):
+        try:
+            cursor.execute(f"ALTER TABLE ui_snapshots ADD COLUMN {column}")
+        except:
+            pass
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_ui_snapshots_filter ON ui_snapshots(filter_key, created_at)")
+
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS sync_state (
+            provider TEXT NOT NULL,
+            scope TEXT NOT NULL DEFAULT 'default',
+            cursor TEXT,
+            meta_json TEXT,
+            updated_ts TEXT,
+            PRIMARY KEY (provider, scope)
+        )
+    """)
+
+    # alias -> canonical messages.key (dashboard provider:folder:id keys, ids changed by a move)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS message_aliases (
+            alias TEXT PRIMARY KEY,
+            key TEXT NOT NULL
+        )
+    """)
+
     conn.commit()
     conn.close()
 
 
+def _backfill_received_ts(cursor):
+    """received_ts for rows stored before the column existed (local listings order by it)."""
+    rows = cursor.execute(
+        "SELECT key, date FROM messages WHERE received_ts IS NULL AND date IS NOT NULL AND date != ''"
+    ).fetchall()
+    updates = []
+    for row in rows:
+        ts = date_to_ts(row["date"])
+        if ts is not None:
+            updates.append((ts, row["key"]))
+    cursor.executemany("UPDATE messages SET received_ts = ? WHERE key = ?", updates)
+
+
 def snapshot_save(snapshot_id: str, session_id: str, providers: List[str], folders: List[str],
-                  filters: dict, message_keys: List[str], payload: List[dict]) -> str:
+                  filters: dict, message_keys: List[str], payload: List[dict],
+                  filter_key: str = None, etag: str = None, response: dict = None) -> str:
     conn = _get_conn()
     now = datetime.utcnow().isoformat()
     conn.execute("""
-        INSERT OR REPLACE INTO ui_snapshots (snapshot_id, session_id, providers, folders, filters, created_at, message_keys, payload_json)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        INSERT OR REPLACE INTO ui_snapshots (snapshot_id, session_id, providers, folders, filters, created_at,
+                                             message_keys, payload_json, filter_key, etag, response_json)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
     """, (
         snapshot_id, session_id,
         json.dumps(providers), json.dumps(folders), json.dumps(filters),
-        now, json.dumps(message_keys), json.dumps(payload)
+        now, json.dumps(message_keys), json.dumps(payload),
+        filter_key, etag, json.dumps(response) if response is not None else None,
     ))
     conn.commit()
     conn.close()
     return snapshot_id
 
 
+def _snapshot_row(row) -> Optional[Dict]:
+    if not row:
+        return None
+    d = dict(row)
+    d["message_keys"] = json.loads(d.get("message_keys", "[]"))
+    d["payload_json"] = json.loads(d.get("payload_json", "[]"))
+    d["providers"] = json.loads(d.get("providers", "[]"))
+    d["folders"] = json.loads(d.get("folders", "[]"))
+    d["filters"] = json.loads(d.get("filters", "{}"))
+    d["response"] = json.loads(d["response_json"]) if d.get("response_json") else None
+    return d
+
+
 def snapshot_get_latest(session_id: str = None) -> Optional[Dict]:
+    """Latest snapshot with items; rows that only cache an empty /ui/messages result are skipped."""
     conn = _get_conn()
     if session_id:
         row = conn.execute(
-            "SELECT * FROM ui_snapshots WHERE session_id = ? ORDER BY created_at DESC LIMIT 1",
+            "SELECT * FROM ui_snapshots WHERE session_id = ? AND message_keys != '[]' "
+            "ORDER BY created_at DESC LIMIT 1",
             (session_id,)
         ).fetchone()
     else:
         row = conn.execute(
-            "SELECT * FROM ui_snapshots ORDER BY created_at DESC LIMIT 1"
+            "SELECT * FROM ui_snapshots WHERE message_keys != '[]' ORDER BY created_at DESC LIMIT 1"
         ).fetchone()
     conn.close()
-    if not row:
-        return None
-    d = dict(row)
-    d["message_keys"] = json.loads(d.get("message_keys", "[]"))
-    d["payload_json"] = json.loads(d.get("payload_json", "[]"))
-    d["providers"] = json.loads(d.get("providers", "[]"))
-    d["folders"] = json.loads(d.get("folders", "[]"))
-    d["filters"] = json.loads(d.get("filters", "{}"))
-    return d
+    return _snapshot_row(row)
+
+
+def snapshot_get_by_filter(filter_key: str) -> Optional[Dict]:
+    """Latest snapshot saved for a normalized filter set, with its cached response."""
+    conn = _get_conn()
+    row = conn.execute(
+        "SELECT * FROM ui_snapshots WHERE filter_key = ? ORDER BY created_at DESC LIMIT 1",
+        (filter_key,)
+    ).fetchone()
+    conn.close()
+    return _snapshot_row(row)
 
 
 def snapshot_cleanup(keep: int = 10):
@@ -498,15 +588,90 @@ def llm_log_insert(session_id: str, action: str, email_key: str,
     conn.close()
 
 
-def make_key(provider: str, msg_id: str) -> str:
+# Providers whose ids are only unique within a folder (IMAP UIDs are per mailbox).
+FOLDER_SCOPED_PROVIDERS = {"apple"}
+
+
+def make_key(provider: str, msg_id: str, folder: str = None) -> str:
+    """
+    The canonical message key: provider:id, or provider:folder:id outside the
+    inbox for providers in FOLDER_SCOPED_PROVIDERS.
+    """
+    if folder and provider in FOLDER_SCOPED_PROVIDERS and folder.lower() != "inbox":
+        return f"{provider}:{folder.lower()}:{msg_id}"
     return f"{provider}:{msg_id}"
 
 
+def split_key(key: str) -> Tuple[str, Optional[str], str]:
+    """provider:id or provider:folder:id -> (provider, folder or None, msg_id)."""
+    parts = (key or "").split(":", 2)
+    if len(parts) == 3:
+        return parts[0], parts[1], parts[2]
+    if len(parts) == 2:
+        return parts[0], None, parts[1]
+    return "", None, key or ""
+
+
+def canonical_key(key: str) -> str:
+    """make_key() form of any key, without a lookup (aliases from moves need resolve_key)."""
+    provider, folder, msg_id = split_key(key)
+    return make_key(provider, msg_id, folder) if provider else key
+
+
+_ALIAS_SQL = "COALESCE((SELECT key FROM message_aliases WHERE alias = ?), ?)"
+
+
+def _alias_params(key: str) -> Tuple[str, str]:
+    return key, canonical_key(key)
+
+
+def register_aliases(aliases: Dict[str, str]) -> int:
+    """Record alias -> canonical key pairs; keys that already are canonical are skipped."""
+    pairs = [(alias, key) for alias, key in aliases.items() if alias and key and alias != key]
+    if not pairs:
+        return 0
+    init_db()
+    conn = _get_conn()
+    conn.executemany("INSERT OR REPLACE INTO message_aliases (alias, key) VALUES (?, ?)", pairs)
+    conn.commit()
+    conn.close()
+    return len(pairs)
+
+
+def resolve_key(key: str) -> str:
+    """Canonical key for any alias in one lookup."""
+    init_db()
+    conn = _get_conn()
+    row = conn.execute(f"SELECT {_ALIAS_SQL} AS key", _alias_params(key)).fetchone()
+    conn.close()
+    return row["key"]
+
+
 def body_hash(body: str) -> str:
     return hashlib.md5(body.encode('utf-8', errors='ignore')).hexdigest()[:16]
 
 
-def upsert_message(
+def date_to_ts(date_str: str) -> Optional[int]:
+    """Epoch seconds for an ISO-8601 or RFC 2822 date string; None if it can't be parsed."""
+    if not date_str:
+        return None
+    try:
+        dt = datetime.fromisoformat(date_str.replace("Z", "+00:00"))
+    except (TypeError, ValueError):
+        try:
+            dt = parsedate_to_datetime(date_str)
+        except (TypeError, ValueError, IndexError):
+            return None
+    if dt is None:
+        return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return int(dt.timestamp())
+
+
+def _upsert_message_row(
+    cursor,
+    now: str,
     key: str,
     provider: str,
     msg_id: str,
@@ -517,19 +682,16 @@ def upsert_message(
     body: str = None,
     status: str = "new",
     category: str = None,
-    priority: str = None
+    priority: str = None,
+    unread: bool = None,
+    header_class: str = None
 ) -> bool:
-    init_db()
-    conn = _get_conn()
-    cursor = conn.cursor()
-    now = datetime.utcnow().isoformat()
-    
     cursor.execute("SELECT key, status FROM messages WHERE key = ?", (key,))
     existing = cursor.fetchone()
+    unread_val = None if unread is None else int(bool(unread))
     
     if existing:
         if existing["status"] in ("sent", "deleted"):
-            conn.close()
             return False
         
         cursor.execute("""
@@ -543,17 +705,164 @@ def upsert_message(
                 status = COALESCE(?, status),
                 category = COALESCE(?, category),
                 priority = COALESCE(?, priority),
+                unread = COALESCE(?, unread),
+                received_ts = COALESCE(?, received_ts),
+                header_class = COALESCE(?, header_class),
                 updated_ts = ?
             WHERE key = ?
         """, (folder, from_addr, subject, date, body_hash(body) if body else None,
-              body, status, category, priority, now, key))
+              body, status, category, priority, unread_val, date_to_ts(date), header_class, now, key))
     else:
         cursor.execute("""
-            INSERT INTO messages (key, provider, msg_id, folder, from_addr, subject, date, body_hash, body_text, status, category, priority, created_ts, updated_ts)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            INSERT INTO messages (key, provider, msg_id, folder, from_addr, subject, date, body_hash, body_text, status, category, priority, unread, received_ts, header_class, created_ts, updated_ts)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
         """, (key, provider, msg_id, folder, from_addr, subject, date, 
-              body_hash(body) if body else None, body, status, category, priority, now, now))
+              body_hash(body) if body else None, body, status, category, priority, unread_val,
+              date_to_ts(date), header_class, now, now))
+    return True
+
+
+def upsert_message(
+    key: str,
+    provider: str,
+    msg_id: str,
+    folder: str = None,
+    from_addr: str = None,
+    subject: str = None,
+    date: str = None,
+    body: str = None,
+    status: str = "new",
+    category: str = None,
+    priority: str = None,
+    unread: bool = None,
+    header_class: str = None
+) -> bool:
+    init_db()
+    conn = _get_conn()
+    cursor = conn.cursor()
+    now = datetime.utcnow().isoformat()
     
+    ok = _upsert_message_row(cursor, now, key, provider, msg_id, folder, from_addr, subject,
+                             date, body, status, category, priority, unread, header_class)
+    
+    conn.commit()
+    conn.close()
+    return ok
+
+
+def upsert_messages(rows: List[Dict]) -> int:
+    """Upsert many messages in one transaction. Each row takes upsert_message's kwargs."""
+    if not rows:
+        return 0
+    init_db()
+    conn = _get_conn()
+    cursor = conn.cursor()
+    now = datetime.utcnow().isoformat()
+    written = 0
+    for row in rows:
+        if _upsert_message_row(cursor, now, **row):
+            written += 1
+    conn.commit()
+    conn.close()
+    return written
+
+
+def existing_message_keys(keys: List[str]) -> set:
+    if not keys:
+        return set()
+    init_db()
+    conn = _get_conn()
+    found = set()
+    keys = list(keys)
+    for i in range(0, len(keys), 500):
+        chunk = keys[i:i + 500]
+        placeholders = ",".join("?" * len(chunk))
+        rows = conn.execute(f"SELECT key FROM messages WHERE key IN ({placeholders})", chunk).fetchall()
+        found.update(r["key"] for r in rows)
+    conn.close()
+    return found
+
+
+def message_statuses(keys: List[str]) -> Dict[str, Optional[str]]:
+    """{key: status} for the keys already stored."""
+    if not keys:
+        return {}
+    init_db()
+    conn = _get_conn()
+    statuses = {}
+    keys = list(keys)
+    for i in range(0, len(keys), 500):
+        chunk = keys[i:i + 500]
+        placeholders = ",".join("?" * len(chunk))
+        rows = conn.execute(f"SELECT key, status FROM messages WHERE key IN ({placeholders})", chunk).fetchall()
+        statuses.update((r["key"], r["status"]) for r in rows)
+    conn.close()
+    return statuses
+
+
+def draft_keys(keys: List[str]) -> set:
+    """The subset of keys that have a saved draft."""
+    if not keys:
+        return set()
+    init_db()
+    conn = _get_conn()
+    found = set()
+    keys = list(keys)
+    for i in range(0, len(keys), 500):
+        chunk = keys[i:i + 500]
+        placeholders = ",".join("?" * len(chunk))
+        rows = conn.execute(f"SELECT key FROM drafts WHERE key IN ({placeholders})", chunk).fetchall()
+        found.update(r["key"] for r in rows)
+    conn.close()
+    return found
+
+
+def mark_status_many(keys: List[str], status: str) -> int:
+    if not keys:
+        return 0
+    init_db()
+    conn = _get_conn()
+    cursor = conn.cursor()
+    now = datetime.utcnow().isoformat()
+    cursor.executemany(f"UPDATE messages SET status = ?, updated_ts = ? WHERE key = {_ALIAS_SQL}",
+                       [(status, now, *_alias_params(k)) for k in keys])
+    affected = cursor.rowcount
+    conn.commit()
+    conn.close()
+    return affected
+
+
+def sync_state_get(provider: str, scope: str = "default") -> Optional[Dict]:
+    init_db()
+    conn = _get_conn()
+    row = conn.execute(
+        "SELECT * FROM sync_state WHERE provider = ? AND scope = ?", (provider, scope)
+    ).fetchone()
+    conn.close()
+    if not row:
+        return None
+    d = dict(row)
+    d["meta"] = json.loads(d.pop("meta_json") or "{}")
+    return d
+
+
+def sync_state_set(provider: str, scope: str = "default", cursor_value: str = None, meta: dict = None) -> bool:
+    init_db()
+    conn = _get_conn()
+    now = datetime.utcnow().isoformat()
+    conn.execute("""
+        INSERT OR REPLACE INTO sync_state (provider, scope, cursor, meta_json, updated_ts)
+        VALUES (?, ?, ?, ?, ?)
+    """, (provider, scope, cursor_value, json.dumps(meta or {}), now))
+    conn.commit()
+    conn.close()
+    return True
+
+
+def sync_state_clear(provider: str, scope: str = "default") -> bool:
+    init_db()
+    conn = _get_conn()
+    conn.execute("DELETE FROM sync_state WHERE provider = ? AND scope = ?", (provider, scope))
     conn.commit()
     conn.close()
     return True
@@ -563,18 +872,46 @@ def get_message(key: str) -> Optional[Dict]:
     init_db()
     conn = _get_conn()
     cursor = conn.cursor()
-    cursor.execute("SELECT * FROM messages WHERE key = ?", (key,))
+    cursor.execute(f"SELECT * FROM messages WHERE key = {_ALIAS_SQL}", _alias_params(key))
     row = cursor.fetchone()
     conn.close()
     return dict(row) if row else None
 
 
+def list_local_messages(provider: str, folder: str = None, since_ts: int = None, until_ts: int = None,
+                        unread_only: bool = False, limit: int = 50) -> List[Dict]:
+    """Newest-first messages from the local store (sent/deleted excluded)."""
+    init_db()
+    clauses = ["provider = ?", "COALESCE(status, '') NOT IN ('sent', 'deleted')"]
+    params: List[Any] = [provider]
+    if folder:
+        clauses.append("folder = ?")
+        params.append(folder)
+    if since_ts is not None:
+        clauses.append("received_ts >= ?")
+        params.append(since_ts)
+    if until_ts is not None:
+        clauses.append("received_ts <= ?")
+        params.append(until_ts)
+    if unread_only:
+        clauses.append("unread = 1")
+    params.append(limit)
+    conn = _get_conn()
+    rows = conn.execute(
+        f"SELECT * FROM messages WHERE {' AND '.join(clauses)} ORDER BY received_ts DESC LIMIT ?",
+        params
+    ).fetchall()
+    conn.close()
+    return [dict(r) for r in rows]
+
+
 def mark_status(key: str, status: str) -> bool:
     init_db()
     conn = _get_conn()
     cursor = conn.cursor()
     now = datetime.utcnow().isoformat()
-    cursor.execute("UPDATE messages SET status = ?, updated_ts = ? WHERE key = ?", (status, now, key))
+    cursor.execute(f"UPDATE messages SET status = ?, updated_ts = ? WHERE key = {_ALIAS_SQL}",
+                   (status, now, *_alias_params(key)))
     affected = cursor.rowcount
     conn.commit()
     conn.close()
@@ -586,10 +923,10 @@ def set_draft(key: str, text: str) -> bool:
     conn = _get_conn()
     cursor = conn.cursor()
     now = datetime.utcnow().isoformat()
-    cursor.execute("""
+    cursor.execute(f"""
         INSERT OR REPLACE INTO drafts (key, draft_text, created_ts)
-        VALUES (?, ?, ?)
-    """, (key, text, now))
+        VALUES ({_ALIAS_SQL}, ?, ?)
+    """, (*_alias_params(key), text, now))
     conn.commit()
     conn.close()
     return True
@@ -599,7 +936,7 @@ def get_draft(key: str) -> Optional[str]:
     init_db()
     conn = _get_conn()
     cursor = conn.cursor()
-    cursor.execute("SELECT draft_text FROM drafts WHERE key = ?", (key,))
+    cursor.execute(f"SELECT draft_text FROM drafts WHERE key = {_ALIAS_SQL}", _alias_params(key))
     row = cursor.fetchone()
     conn.close()
     return row["draft_text"] if row else None
@@ -612,22 +949,49 @@ def log_action(
     action: str,
     status: str,
     reason: str = "",
-    meta: dict = None
+    meta: dict = None,
+    source: str = None
 ) -> int:
     init_db()
     conn = _get_conn()
     cursor = conn.cursor()
     now = datetime.utcnow().isoformat()
     cursor.execute("""
-        INSERT INTO actions (key, provider, msg_id, action, status, reason, meta_json, ts)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-    """, (key, provider, msg_id, action, status, reason, json.dumps(meta or {}), now))
+        INSERT INTO actions (key, provider, msg_id, action, status, reason, meta_json, ts, source)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, (key, provider, msg_id, action, status, reason, json.dumps(meta or {}), now, source))
     action_id = cursor.lastrowid
     conn.commit()
     conn.close()
     return action_id
 
 
+def training_actions(after_id: int, actions: List[str], limit: int = 1000,
+                     exclude_sources: Tuple[str, ...] = ()) -> List[Dict]:
+    """
+    Completed actions (success / pending) after after_id, oldest first, with the
+    sender and subject of the message they were taken on; actions logged with a
+    source in exclude_sources are skipped.
+    """
+    init_db()
+    conn = _get_conn()
+    placeholders = ",".join("?" * len(actions))
+    source_clause = ""
+    if exclude_sources:
+        source_clause = f"AND COALESCE(a.source, '') NOT IN ({','.join('?' * len(exclude_sources))})"
+    rows = conn.execute(f"""
+        SELECT a.id, a.action, m.from_addr, m.subject
+        FROM actions a
+        JOIN messages m ON m.key = COALESCE((SELECT key FROM message_aliases WHERE alias = a.key), a.key)
+        WHERE a.id > ? AND a.status IN ('success', 'pending') AND a.action IN ({placeholders})
+          {source_clause}
+        ORDER BY a.id
+        LIMIT ?
+    """, (after_id, *actions, *exclude_sources, limit)).fetchall()
+    conn.close()
+    return [dict(row) for row in rows]
+
+
 def list_logs(limit: int = 100) -> List[Dict]:
     init_db()
     conn = _get_conn()
@@ -747,6 +1111,29 @@ def add_session_item(session_id: str, key: str, provider: str, message_id: str,
     return result
 
 
+def add_session_items(session_id: str, items: List[Dict]) -> int:
+    """
+    add_session_item + link_message_to_session for many messages in one transaction.
+    Each item has key, provider, message_id, date, classification, subject, sender.
+    """
+    if not items:
+        return 0
+    init_db()
+    conn = _get_conn()
+    cursor = conn.cursor()
+    cursor.executemany("""
+        INSERT OR IGNORE INTO session_items (session_id, key, provider, message_id, date, classification, subject, sender)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    """, [(session_id, it["key"], it["provider"], it["message_id"], it.get("date"), it.get("classification"),
+           it.get("subject"), it.get("sender")) for it in items])
+    added = cursor.rowcount
+    cursor.executemany("UPDATE messages SET session_id = ? WHERE key = ?",
+                       [(session_id, it["key"]) for it in items])
+    conn.commit()
+    conn.close()
+    return added
+
+
 def get_session_items(session_id: str, limit: int = 100, provider: str = None, folder: str = None, classification: str = None) -> List[Dict]:
     init_db()
     conn = _get_conn()
@@ -787,9 +1174,8 @@ def add_queued_action(key: str, action: str, session_id: str = None, body: str =
     cursor = conn.cursor()
     now = datetime.utcnow().isoformat()
     
-    parts = key.split(":", 1)
-    provider = parts[0] if len(parts) > 1 else ""
-    msg_id = parts[1] if len(parts) > 1 else key
+    key = resolve_key(key)
+    provider, _folder, msg_id = split_key(key)
     
     meta = {"body": body} if body else {}
     
@@ -833,7 +1219,7 @@ def link_message_to_session(key: str, session_id: str) -> bool:
     init_db()
     conn = _get_conn()
     cursor = conn.cursor()
-    cursor.execute("UPDATE messages SET session_id = ? WHERE key = ?", (session_id, key))
+    cursor.execute(f"UPDATE messages SET session_id = ? WHERE key = {_ALIAS_SQL}", (session_id, *_alias_params(key)))
     affected = cursor.rowcount
     conn.commit()
     conn.close()
@@ -3,6 +3,7 @@ import io
 import uuid
 import json
 from datetime import datetime, timedelta, timezone
+from functools import partial
 from typing import Optional, List, Dict, Any
 from fastapi import APIRouter, HTTPException, Header, Depends, Query
 from fastapi.responses import StreamingResponse
@@ -15,8 +16,9 @@ from reportlab.lib.units import inch
 from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont
 
-from db import init_db, get_message, mark_status, log_action, get_draft, _get_conn
+from db import init_db, get_message, mark_status, log_action, get_draft, split_key, _get_conn
 from time_filters import get_date_range_info
+import bulk_actions
 
 router = APIRouter()
 
@@ -369,6 +371,33 @@ class DispatchImportRequest(BaseModel):
     compose_emails: List[ComposeEmail] = []
 
 
+# decision -> (message status, log reason, result detail) for provider mutations
+_DISPATCH_MUTATIONS = {
+    "mark_read": ("read", "Marked as read via dispatch", "Marked as read"),
+    "mark_unread": ("unread", "Marked as unread via dispatch", "Marked as unread"),
+    "delete": ("deleted", "Deleted via dispatch", "Deleted"),
+}
+
+
+def _dispatch_done(key: str, provider_name: str, msg_id: str, decision: str, msg_in_db: bool,
+                   result: dict, counts: dict, _provider_result=None):
+    status, reason, detail = _DISPATCH_MUTATIONS[decision]
+    if msg_in_db:
+        mark_status(key, status)
+    log_action(key, provider_name, msg_id, decision, "success", reason)
+    result["status"] = "done"
+    result["detail"] = detail
+    counts[decision] += 1
+
+
+def _dispatch_failed(key: str, provider_name: str, msg_id: str, decision: str,
+                     result: dict, counts: dict, error: Exception):
+    result["status"] = "error"
+    result["detail"] = str(error)
+    counts["errors"] += 1
+    log_action(key, provider_name, msg_id, decision, "error", str(error))
+
+
 @router.post("/dispatch/import")
 def dispatch_import(request: DispatchImportRequest, _: bool = Depends(check_api_key)):
     init_db()
@@ -381,6 +410,8 @@ def dispatch_import(request: DispatchImportRequest, _: bool = Depends(check_api_
     counts = {"send": 0, "mark_read": 0, "mark_unread": 0, "delete": 0, "skip": 0, "suggest_reply": 0, "ignored": 0, "errors": 0, "reset": 0}
     results = []
     
+    grouped = bulk_actions.GroupedActions(_providers_map)
+    
     for action in sorted_actions:
         key = action.key
         decision = action.decision
@@ -430,9 +461,7 @@ def dispatch_import(request: DispatchImportRequest, _: bool = Depends(check_api_
             results.append(result)
             continue
         
-        parts = key.split(":", 1)
-        provider_name = parts[0] if len(parts) > 1 else ""
-        msg_id = parts[1] if len(parts) > 1 else key
+        provider_name, _folder, msg_id = split_key(key)
         
         try:
             if provider_name not in _providers_map:
@@ -448,24 +477,14 @@ def dispatch_import(request: DispatchImportRequest, _: bool = Depends(check_api_
                 result["detail"] = "Skipped"
                 counts["skip"] += 1
             
-            elif decision == "mark_read":
-                provider.mark_read(msg_id)
-                if msg_in_db:
-                    mark_status(key, "read")
-                log_action(key, provider_name, msg_id, "mark_read", "success", "Marked as read via dispatch")
-                result["status"] = "done"
-                result["detail"] = "Marked as read"
-                counts["mark_read"] += 1
-            
-            elif decision == "mark_unread":
-                if hasattr(provider, 'mark_unread'):
-                    provider.mark_unread(msg_id)
-                if msg_in_db:
-                    mark_status(key, "unread")
-                log_action(key, provider_name, msg_id, "mark_unread", "success", "Marked as unread via dispatch")
-                result["status"] = "done"
-                result["detail"] = "Marked as unread"
-                counts["mark_unread"] += 1
+            elif decision in _DISPATCH_MUTATIONS:
+                on_success = partial(_dispatch_done, key, provider_name, msg_id, decision, msg_in_db, result, counts)
+                if decision == "mark_unread" and not hasattr(provider, 'mark_unread'):
+                    on_success(None)
+                else:
+                    # provider call runs with the rest of its group after validation
+                    grouped.add(provider_name, decision, msg_id, on_success,
+                                partial(_dispatch_failed, key, provider_name, msg_id, decision, result, counts))
             
             elif decision == "suggest_reply":
                 suggested = action.suggested_text or "Sugestao pendente"
@@ -477,15 +496,6 @@ def dispatch_import(request: DispatchImportRequest, _: bool = Depends(check_api_
                 result["suggested_text"] = suggested
                 counts["suggest_reply"] += 1
             
-            elif decision == "delete":
-                provider.delete(msg_id)
-                if msg_in_db:
-                    mark_status(key, "deleted")
-                log_action(key, provider_name, msg_id, "delete", "success", "Deleted via dispatch")
-                result["status"] = "done"
-                result["detail"] = "Deleted"
-                counts["delete"] += 1
-            
             elif decision == "send":
                 body = action.reply.body
                 provider.send_reply(msg_id, body)
@@ -519,6 +529,8 @@ def dispatch_import(request: DispatchImportRequest, _: bool = Depends(check_api_
         
         results.append(result)
     
+    grouped.execute()
+    
     compose_results = []
     compose_count = {"sent": 0, "errors": 0}
     
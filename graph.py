@@ -1,48 +1,168 @@
+import os
+import time
+import logging
+import threading
+
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
 
 GRAPH_ROOT = "https://graph.microsoft.com/v1.0"
+GRAPH_TIMEOUT_S = int(os.getenv("GRAPH_TIMEOUT_S", "30"))
+GRAPH_MAX_RETRIES = int(os.getenv("GRAPH_MAX_RETRIES", "3"))
+GRAPH_POOL_SIZE = int(os.getenv("GRAPH_POOL_SIZE", "16"))
+# JSON $batch accepts at most 20 requests per call.
+GRAPH_BATCH_LIMIT = 20
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# A 5xx can come back after the server already acted (sendMail, move), so
+# POST is only retried when it certainly wasn't: 429 or no connection at all.
+IDEMPOTENT_METHODS = {"GET", "PATCH", "DELETE"}
+POST_RETRY_STATUSES = {429}
+
+logger = logging.getLogger(__name__)
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def _get_session() -> requests.Session:
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=GRAPH_POOL_SIZE)
+                session.mount("https://", adapter)
+                _session = session
+    return _session
+
+
+def _retry_delay(retry_after, attempt: int) -> float:
+    try:
+        return min(float(retry_after), 60.0)
+    except (TypeError, ValueError):
+        return min(2 ** attempt, 30)
+
+
+def _retry_statuses(methods) -> set:
+    return RETRY_STATUSES if all(m.upper() in IDEMPOTENT_METHODS for m in methods) else POST_RETRY_STATUSES
+
+
+def _not_sent(exc: requests.exceptions.ConnectionError) -> bool:
+    """True when the connection failed before the request went out."""
+    if isinstance(exc, requests.exceptions.ConnectTimeout):
+        return True
+    return isinstance(getattr(exc.args[0] if exc.args else None, "reason", None), NewConnectionError)
 
-def graph_get(access_token: str, path: str, params: dict | None = None):
-    r = requests.get(
-        GRAPH_ROOT + path,
-        headers={"Authorization": f"Bearer {access_token}"},
-        params=params,
-        timeout=30,
-    )
-    r.raise_for_status()
-    return r.json()
+
+def _request(method: str, access_token: str, path: str, params: dict | None = None, json_body: dict | None = None,
+             extra_headers: dict | None = None, retry_statuses: set | None = None):
+    headers = {"Authorization": f"Bearer {access_token}"}
+    if json_body is not None:
+        headers["Content-Type"] = "application/json"
+    if extra_headers:
+        headers.update(extra_headers)
+    # nextLink / deltaLink values are absolute URLs
+    url = path if path.startswith("https://") else GRAPH_ROOT + path
+    if retry_statuses is None:
+        retry_statuses = _retry_statuses([method])
+    idempotent = method.upper() in IDEMPOTENT_METHODS
+    session = _get_session()
+    for attempt in range(GRAPH_MAX_RETRIES + 1):
+        try:
+            r = session.request(
+                method,
+                url,
+                headers=headers,
+                params=params,
+                json=json_body,
+                timeout=GRAPH_TIMEOUT_S,
+            )
+        except requests.exceptions.ConnectionError as e:
+            if attempt >= GRAPH_MAX_RETRIES or not (idempotent or _not_sent(e)):
+                raise
+            delay = _retry_delay(None, attempt)
+            logger.warning(f"Graph {method} {path} -> {e}, retrying in {delay:.1f}s")
+            time.sleep(delay)
+            continue
+        if r.status_code in retry_statuses and attempt < GRAPH_MAX_RETRIES:
+            delay = _retry_delay(r.headers.get("Retry-After"), attempt)
+            logger.warning(f"Graph {method} {path} -> {r.status_code}, retrying in {delay:.1f}s")
+            time.sleep(delay)
+            continue
+        r.raise_for_status()
+        return r
+
+
+def graph_get(access_token: str, path: str, params: dict | None = None, headers: dict | None = None):
+    return _request("GET", access_token, path, params=params, extra_headers=headers).json()
 
 def graph_post(access_token: str, path: str, json_body: dict):
-    r = requests.post(
-        GRAPH_ROOT + path,
-        headers={
-            "Authorization": f"Bearer {access_token}",
-            "Content-Type": "application/json",
-        },
-        json=json_body,
-        timeout=30,
-    )
-    r.raise_for_status()
+    r = _request("POST", access_token, path, json_body=json_body)
     return r.json() if r.text else {}
 
 def graph_patch(access_token: str, path: str, json_body: dict):
-    r = requests.patch(
-        GRAPH_ROOT + path,
-        headers={
-            "Authorization": f"Bearer {access_token}",
-            "Content-Type": "application/json",
-        },
-        json=json_body,
-        timeout=30,
-    )
-    r.raise_for_status()
+    r = _request("PATCH", access_token, path, json_body=json_body)
     return r.json() if r.text else {}
 
 def graph_delete(access_token: str, path: str):
-    r = requests.delete(
-        GRAPH_ROOT + path,
-        headers={"Authorization": f"Bearer {access_token}"},
-        timeout=30,
-    )
-    r.raise_for_status()
+    _request("DELETE", access_token, path)
     return {}
+
+
+def graph_batch(access_token: str, batch_requests: list) -> list:
+    """
+    Run requests through JSON $batch, GRAPH_BATCH_LIMIT per HTTP call.
+    Each request is {"method", "url" (relative, e.g. "/me/messages/{id}"), "body"?, "headers"?}.
+    Returns [{"status", "body", "headers"}] in input order; 429 sub-responses are
+    retried, 5xx ones only for GET/PATCH/DELETE (same for the $batch call itself).
+    """
+    results = [None] * len(batch_requests)
+    for start in range(0, len(batch_requests), GRAPH_BATCH_LIMIT):
+        pending = {str(i): batch_requests[i] for i in range(start, min(start + GRAPH_BATCH_LIMIT, len(batch_requests)))}
+        for attempt in range(GRAPH_MAX_RETRIES + 1):
+            payload = []
+            for req_id, req in pending.items():
+                item = {"id": req_id, "method": req.get("method", "GET"), "url": req["url"]}
+                if req.get("body") is not None:
+                    item["body"] = req["body"]
+                    item["headers"] = {"Content-Type": "application/json", **(req.get("headers") or {})}
+                elif req.get("headers"):
+                    item["headers"] = req["headers"]
+                payload.append(item)
+
+            r = _request("POST", access_token, "/$batch", json_body={"requests": payload},
+                         retry_statuses=_retry_statuses(item["method"] for item in payload))
+            data = r.json() if r.text else {}
+            retry = {}
+            delay = 0.0
+            for resp in data.get("responses", []):
+                req_id = str(resp.get("id"))
+                if req_id not in pending:
+                    continue
+                status = int(resp.get("status", 0))
+                headers = resp.get("headers") or {}
+                if status in _retry_statuses([pending[req_id].get("method", "GET")]) and attempt < GRAPH_MAX_RETRIES:
+                    retry[req_id] = pending[req_id]
+                    delay = max(delay, _retry_delay(headers.get("Retry-After"), attempt))
+                    continue
+                results[int(req_id)] = {"status": status, "body": resp.get("body") or {}, "headers": headers}
+
+            if not retry:
+                break
+            logger.warning(f"Graph $batch: {len(retry)} sub-requests throttled, retrying in {delay:.1f}s")
+            time.sleep(delay)
+            pending = retry
+
+    for i, res in enumerate(results):
+        if res is None:
+            results[i] = {"status": 0, "body": {"error": {"message": "No response in $batch"}}, "headers": {}}
+    return results
+
+
+def batch_error(response: dict) -> Exception | None:
+    status = response.get("status", 0)
+    if 200 <= status < 300:
+        return None
+    error = (response.get("body") or {}).get("error") or {}
+    return Exception(f"Graph {status}: {error.get('message') or error.get('code') or 'request failed'}")
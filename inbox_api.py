@@ -1,5 +1,6 @@
 import os
 from datetime import datetime, timedelta, timezone
+from functools import partial
 from typing import Optional, List, Dict, Any
 from fastapi import APIRouter, HTTPException, Header, Depends, Query
 from fastapi.responses import PlainTextResponse
@@ -7,9 +8,12 @@ from pydantic import BaseModel
 
 from db import (
     init_db, upsert_message, get_message, set_draft, get_draft,
-    log_action, list_logs, mark_status, make_key, get_messages_by_status
+    log_action, list_logs, mark_status, make_key, split_key, get_messages_by_status
 )
-from assistant_loop import load_policy, classify_email, safe_extract_text, sanitize_reply
+from assistant_loop import load_policy, safe_extract_text, sanitize_reply
+from mail_sync import hydrate_message_body
+from policy_engine import CATEGORY_NAMES, PRIORITY_NAMES, classify_many
+import bulk_actions
 
 router = APIRouter()
 
@@ -139,7 +143,7 @@ def inbox_message(
     if ":" not in key:
         raise HTTPException(400, "Invalid key format. Use provider:id")
     
-    provider_name, msg_id = key.split(":", 1)
+    provider_name, _folder, msg_id = split_key(key)
     
     if provider_name not in _providers_map:
         raise HTTPException(400, f"Unknown provider: {provider_name}")
@@ -148,6 +152,7 @@ def inbox_message(
     
     existing = get_message(key)
     if existing:
+        existing = hydrate_message_body(existing, _providers_map)
         has_draft = get_draft(key) is not None
         draft_text = get_draft(key) if has_draft else None
         body_text = existing.get("body_text") or existing.get("subject", "")
@@ -174,13 +179,16 @@ def inbox_message(
         email_dict = email_msg.to_dict()
         body_text = safe_extract_text(email_dict.get("body", ""))
         
-        policy = load_policy()
-        classification = classify_email(
-            email_dict.get("from", ""),
-            email_dict.get("subject", ""),
-            body_text,
-            policy
-        )
+        codes = classify_many({
+            "from": [email_dict.get("from", "")],
+            "subject": [email_dict.get("subject", "")],
+            "body": [body_text],
+            "header_class": [getattr(email_msg, "header_class", None)],
+        }, load_policy())
+        classification = {
+            "category": CATEGORY_NAMES[codes["category"][0]],
+            "priority": PRIORITY_NAMES[codes["priority"][0]],
+        }
         
         upsert_message(
             key=key,
@@ -226,7 +234,7 @@ def inbox_suggest_reply(
     if ":" not in key:
         raise HTTPException(400, "Invalid key format. Use provider:id")
     
-    provider_name, msg_id = key.split(":", 1)
+    provider_name, _folder, msg_id = split_key(key)
     
     if provider_name not in _providers_map:
         raise HTTPException(400, f"Unknown provider: {provider_name}")
@@ -265,7 +273,7 @@ def queue_add(
     if ":" not in key:
         raise HTTPException(400, "Invalid key format. Use provider:id")
     
-    provider_name, msg_id = key.split(":", 1)
+    provider_name, _folder, msg_id = split_key(key)
     
     existing = get_message(key)
     if existing and existing.get("status") in ("sent", "deleted"):
@@ -328,6 +336,27 @@ def queue_list(_: bool = Depends(check_api_key)):
     }
 
 
+# action -> (message status, log reason, summary counter, detail message)
+_COMMIT_MUTATIONS = {
+    "delete": ("deleted", "Email excluído via commit", "deleted", "Deleted successfully"),
+    "mark_read": ("read", "Marcado como lido via commit", "marked_read", "Marked as read"),
+}
+
+
+def _commit_done(key: str, provider_name: str, msg_id: str, action: str, results: Dict, _provider_result=None):
+    status, reason, counter, message = _COMMIT_MUTATIONS[action]
+    mark_status(key, status)
+    log_action(key, provider_name, msg_id, action, "success", reason)
+    results["summary"][counter] += 1
+    results["details"].append({"key": key, "action": action, "status": "ok", "message": message})
+
+
+def _commit_failed(key: str, provider_name: str, msg_id: str, action: str, results: Dict, error: Exception):
+    log_action(key, provider_name, msg_id, action, "error", str(error))
+    results["summary"]["errors"] += 1
+    results["details"].append({"key": key, "action": action, "status": "error", "message": str(error)})
+
+
 @router.post("/queue/commit")
 def queue_commit(
     request: QueueCommitRequest = None,
@@ -379,15 +408,16 @@ def queue_commit(
         "details": []
     }
     
+    grouped = bulk_actions.GroupedActions(_providers_map)
+    
     for action_item in actions_to_execute:
         key = action_item.get("key", "")
         action = action_item.get("action", "skip")
         provider_name = action_item.get("provider", "")
         
-        if ":" in key and not provider_name:
-            provider_name = key.split(":")[0]
-        
-        msg_id = key.split(":", 1)[1] if ":" in key else key
+        key_provider, _folder, msg_id = split_key(key)
+        if not provider_name:
+            provider_name = key_provider
         
         if provider_name not in _providers_map:
             results["details"].append({
@@ -421,29 +451,11 @@ def queue_commit(
                     "message": "Sent successfully"
                 })
                 
-            elif action == "delete":
-                result = provider.delete(msg_id)
-                mark_status(key, "deleted")
-                log_action(key, provider_name, msg_id, "delete", "success", "Email excluído via commit")
-                results["summary"]["deleted"] += 1
-                results["details"].append({
-                    "key": key,
-                    "action": "delete",
-                    "status": "ok",
-                    "message": "Deleted successfully"
-                })
-                
-            elif action == "mark_read":
-                result = provider.mark_read(msg_id)
-                mark_status(key, "read")
-                log_action(key, provider_name, msg_id, "mark_read", "success", "Marcado como lido via commit")
-                results["summary"]["marked_read"] += 1
-                results["details"].append({
-                    "key": key,
-                    "action": "mark_read",
-                    "status": "ok",
-                    "message": "Marked as read"
-                })
+            elif action in _COMMIT_MUTATIONS:
+                # provider call runs with the rest of its group after validation
+                grouped.add(provider_name, action, msg_id,
+                            partial(_commit_done, key, provider_name, msg_id, action, results),
+                            partial(_commit_failed, key, provider_name, msg_id, action, results))
                 
             elif action == "skip":
                 mark_status(key, "skipped")
@@ -466,6 +478,7 @@ def queue_commit(
                 "message": str(e)
             })
     
+    grouped.execute()
     return results
 
 
@@ -0,0 +1,91 @@
+"""
+Top-k merging of newest-first message listings.
+
+Each source (one provider x folder listing) is ordered by normalize_ts()
+descending. merge_top_k() walks all sources with a k-way heap (heapq.merge)
+and stops after k items, so only the survivors are built and classified.
+TopK keeps the running cut-off for sources that arrive one at a time
+(streamed batches), and paging sources share one to stop fetching once their
+next page can no longer get in (see async_providers); such a source comes
+back as a Listing carrying the counts of the full listing.
+"""
+import heapq
+from datetime import datetime, timezone
+from itertools import islice
+from typing import Callable, Iterable, List, Optional, Tuple
+
+from db import date_to_ts
+
+
+def normalize_ts(value) -> float:
+    """Epoch seconds for a datetime or an ISO-8601 / RFC 2822 string; 0.0 if unknown (sorts last)."""
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value.timestamp()
+    ts = date_to_ts(value) if isinstance(value, str) else None
+    return float(ts) if ts is not None else 0.0
+
+
+def message_ts(msg) -> float:
+    return normalize_ts(getattr(msg, "date", None))
+
+
+def newest_first(items: Iterable, key: Callable = message_ts) -> List:
+    return sorted(items, key=key, reverse=True)
+
+
+def listing_counts(msgs) -> Tuple[int, int]:
+    """(total, unread) of a source: a Listing's own counts, else what was listed."""
+    if isinstance(msgs, Listing):
+        return msgs.total, msgs.unread
+    return len(msgs), sum(1 for msg in msgs if getattr(msg, "unread", True))
+
+
+def merge_top_k(sources: Iterable[Iterable], k: int, key: Callable = message_ts) -> List:
+    """The k newest items across sources that are each already newest-first."""
+    if k <= 0:
+        return []
+    return list(islice(heapq.merge(*sources, key=key, reverse=True), k))
+
+
+class TopK:
+    """Running cut-off for the k newest timestamps seen so far."""
+
+    def __init__(self, k: int):
+        self.k = k
+        self._heap: List[float] = []
+
+    @property
+    def threshold(self) -> Optional[float]:
+        """Timestamp an item must beat to get in, or None while there is room."""
+        return self._heap[0] if len(self._heap) >= self.k else None
+
+    def offer(self, ts: float) -> bool:
+        """Admit ts if it is among the k newest so far (it may be pushed out later)."""
+        if self.k <= 0:
+            return False
+        if len(self._heap) < self.k:
+            heapq.heappush(self._heap, ts)
+            return True
+        if ts > self._heap[0]:
+            heapq.heapreplace(self._heap, ts)
+            return True
+        return False
+
+    def excludes(self, ts: float) -> bool:
+        """True once k items at least as new as ts are in: nothing older can get in."""
+        threshold = self.threshold
+        return threshold is not None and ts <= threshold
+
+
+class Listing(list):
+    """
+    Newest-first messages of a source that stopped paging early;
+    total/unread count the full listing.
+    """
+
+    def __init__(self, items: Iterable = (), total: int = 0, unread: int = 0):
+        super().__init__(items)
+        self.total = total
+        self.unread = unread
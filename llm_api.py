@@ -2,6 +2,7 @@ import os
 import json
 import re
 import logging
+from functools import partial
 from typing import Optional, List, Dict
 from fastapi import APIRouter, Depends, HTTPException, Header
 from pydantic import BaseModel
@@ -11,12 +12,14 @@ from db import (
     init_db, get_message, set_draft,
     add_chat_message, get_chat_history, clear_chat_history,
     aq_add, aq_list, aq_remove, aq_get_queued, aq_update_status,
-    mark_status, log_action,
+    mark_status, log_action, make_key, split_key,
     job_create, job_get, job_queue_stats, rate_limit_check, rate_limit_status,
     get_recent_messages, snapshot_get_latest,
 )
 from llm_client import call_llm, call_llm_multi, parse_json_response, LLM_MAX_INPUT_CHARS
 from utils.text import clean_text, truncate_text, build_email_llm_context, parse_email_address
+from mail_sync import hydrate_message_body
+import bulk_actions
 
 router = APIRouter(prefix="/llm", tags=["llm"])
 
@@ -43,13 +46,23 @@ NO_REPLY_PATTERNS = re.compile(
 )
 
 
-def _classify_for_blocking(from_addr: str, subject: str, category: str) -> dict:
+# header classes that settle a message without its body: Precedence bulk/junk is
+# promotional, Precedence list is list traffic (not reply-worthy, but not junk either).
+# auto_generated is left to the category rules (automated is not blocked).
+BLOCKING_HEADER_CLASSES = {"bulk": "delete", "list": "skip"}
+
+
+def _classify_for_blocking(from_addr: str, subject: str, category: str, header_class: str = None) -> dict:
     email_addr = parse_email_address(from_addr).lower()
 
     if category == "otp":
         return {"blocked": True, "suggested_action": "mark_read", "classification": "otp",
                 "notes": ["Email OTP/verificacao - sem resposta necessaria"]}
 
+    if header_class in BLOCKING_HEADER_CLASSES:
+        return {"blocked": True, "suggested_action": BLOCKING_HEADER_CLASSES[header_class],
+                "classification": header_class, "notes": [f"Cabecalhos de lista ({header_class})"]}
+
     if NO_REPLY_PATTERNS.search(email_addr):
         return {"blocked": True, "suggested_action": "skip", "classification": "no-reply",
                 "notes": ["Endereco no-reply detectado"]}
@@ -66,16 +79,30 @@ def _classify_for_blocking(from_addr: str, subject: str, category: str) -> dict:
             "notes": []}
 
 
+# where _get_email_data found the message: the local store or a live provider fetch
+_email_data_stats = {"local": 0, "provider": 0}
+
+
+def _list_view_data(key: str) -> dict:
+    """The stored row as-is when its list headers already block it (no body download), else _get_email_data."""
+    msg = get_message(key)
+    if msg and msg.get("header_class") in BLOCKING_HEADER_CLASSES:
+        _email_data_stats["local"] += 1
+        return msg
+    return _get_email_data(key)
+
+
 def _get_email_data(key: str) -> dict:
     msg = get_message(key)
     if msg:
-        return msg
+        _email_data_stats["local"] += 1
+        return hydrate_message_body(msg, _providers_map)
 
-    parts = key.split(":", 1)
-    if len(parts) != 2:
+    provider_name, _folder, msg_id = split_key(key)
+    if not provider_name:
         raise HTTPException(404, f"Email {key} not found")
 
-    provider_name, msg_id = parts
+    _email_data_stats["provider"] += 1
     if provider_name not in _providers_map:
         raise HTTPException(400, f"Unknown provider: {provider_name}")
 
@@ -86,7 +113,7 @@ def _get_email_data(key: str) -> dict:
             raise HTTPException(404, f"Email {key} not found in provider")
         d = email_msg.to_dict()
         return {
-            "key": key,
+            "key": make_key(provider_name, msg_id),
             "provider": provider_name,
             "msg_id": msg_id,
             "from_addr": d.get("from", ""),
@@ -112,17 +139,26 @@ def _auto_fetch_provider_emails(limit: int = 30) -> List[str]:
     date_start = now - timedelta(days=7)
     date_end = now
 
+    # With the sync scheduler running the store is current: read it instead of the providers.
+    import sync_scheduler
+    from mail_sync import local_emails
+    use_local = sync_scheduler.is_running()
+
     per_provider = max(limit // max(len(_providers_map), 1), 10)
     for provider_name, provider in _providers_map.items():
         if len(keys) >= limit:
             break
         try:
-            msgs = provider.list_emails(
-                folder="inbox",
-                limit=min(limit - len(keys), per_provider),
-                date_start=date_start,
-                date_end=date_end,
-            )
+            if use_local:
+                msgs = local_emails(provider_name, "inbox", date_start, date_end,
+                                    limit=min(limit - len(keys), per_provider))
+            else:
+                msgs = provider.list_emails(
+                    folder="inbox",
+                    limit=min(limit - len(keys), per_provider),
+                    date_start=date_start,
+                    date_end=date_end,
+                )
             for msg in msgs:
                 key = f"{provider_name}:{msg.id}"
                 keys.append(key)
@@ -158,12 +194,12 @@ def _enqueue_job(session_id: str, job_type: str, payload: dict) -> dict:
 def llm_suggest_reply(req: SuggestReplyRequest, _: bool = Depends(_check_api_key)):
     init_db()
 
-    email_data = _get_email_data(req.key)
+    email_data = _list_view_data(req.key)
     from_addr = email_data.get("from_addr", email_data.get("from", ""))
     subject = email_data.get("subject", "")
     category = email_data.get("category", "human")
 
-    blocking = _classify_for_blocking(from_addr, subject, category)
+    blocking = _classify_for_blocking(from_addr, subject, category, email_data.get("header_class"))
 
     if blocking["blocked"] and not req.force:
         return {
@@ -176,6 +212,7 @@ def llm_suggest_reply(req: SuggestReplyRequest, _: bool = Depends(_check_api_key
             "cached": False,
         }
 
+    email_data = hydrate_message_body(email_data, _providers_map)
     context = build_email_llm_context(email_data, LLM_MAX_INPUT_CHARS)
 
     tone_map = {
@@ -263,7 +300,7 @@ def llm_triage(req: TriageRequest, _: bool = Depends(_check_api_key)):
     email_summaries = []
     for key in req.keys:
         try:
-            email_data = _get_email_data(key)
+            email_data = _list_view_data(key)
             from_addr = email_data.get("from_addr", email_data.get("from", ""))
             subject = email_data.get("subject", "") or "(sem assunto)"
             date = email_data.get("date", "")
@@ -272,7 +309,7 @@ def llm_triage(req: TriageRequest, _: bool = Depends(_check_api_key)):
             body_clean = clean_text(body)
             body_short = truncate_text(body_clean, 1200)
 
-            blocking = _classify_for_blocking(from_addr, subject, category)
+            blocking = _classify_for_blocking(from_addr, subject, category, email_data.get("header_class"))
             if blocking["blocked"]:
                 notes = blocking.get("notes", ["Auto-classificado"])
                 email_summaries.append({
@@ -420,12 +457,10 @@ def llm_chat(req: ChatRequest, _: bool = Depends(_check_api_key)):
         keys_to_use = [k for k in keys_to_use if k.split(":")[0].lower() in provider_filter]
 
     def _parse_key_label(key: str) -> str:
-        parts = key.split(":")
-        if len(parts) >= 2:
-            provider = parts[0].capitalize()
-            folder = parts[1].capitalize() if len(parts) > 1 else ""
-            return f"[{provider} {folder}]"
-        return ""
+        provider, folder, _msg_id = split_key(key)
+        if not provider:
+            return ""
+        return f"[{provider.capitalize()} {folder.capitalize()}]" if folder else f"[{provider.capitalize()}]"
 
     if keys_to_use:
         body_limit = 800 if len(keys_to_use) <= 15 else (400 if len(keys_to_use) <= 30 else 200)
@@ -662,9 +697,11 @@ def queue_execute(req: QueueExecuteRequest, _: bool = Depends(_check_api_key)):
     delete_items = [i for i in items if i["action"] == "delete"]
     skip_items = [i for i in items if i["action"] == "skip"]
 
-    for item in (send_items + mark_items + delete_items + skip_items):
-        r = _execute_queue_item(item, dry_run)
-        results.append(r)
+    ordered = send_items + mark_items + delete_items + skip_items
+    grouped = bulk_actions.GroupedActions(_providers_map)
+    dispatched = [(item, _execute_queue_item(item, dry_run, grouped)) for item in ordered]
+    grouped.execute()
+    results = [_finish_queue_item(item, r, dry_run) for item, r in dispatched]
 
     return {"ok": True, "dry_run": dry_run, "results": results}
 
@@ -684,63 +721,81 @@ def assistant_dispatch(req: DispatchRequest, _: bool = Depends(_check_api_key)):
     delete_actions = [a for a in req.actions if a.action == "delete"]
     skip_actions = [a for a in req.actions if a.action == "skip"]
 
-    for action in (send_actions + mark_actions + delete_actions + skip_actions):
-        r = _dispatch_action(action.key, action.action, action.body, dry_run, req.session_id, confirm_delete=req.confirm_delete)
-        print(f"  RESULT: key={action.key}, status={r['status']}, message={r['message']}", flush=True)
-        results.append(r)
+    ordered = send_actions + mark_actions + delete_actions + skip_actions
+    grouped = bulk_actions.GroupedActions(_providers_map)
+    for action in ordered:
+        results.append(_dispatch_action(action.key, action.action, action.body, dry_run, req.session_id,
+                                        confirm_delete=req.confirm_delete, grouped=grouped))
+    grouped.execute()
+    for r in results:
+        print(f"  RESULT: key={r['key']}, status={r['status']}, message={r['message']}", flush=True)
 
     return {"ok": True, "dry_run": dry_run, "results": results}
 
 
-def _execute_queue_item(item: Dict, dry_run: bool) -> Dict:
-    aq_id = item["id"]
-    key = item["key"]
-    action = item["action"]
-    body = item.get("body")
+def _execute_queue_item(item: Dict, dry_run: bool, grouped: "bulk_actions.GroupedActions" = None) -> Dict:
+    """Dispatch one queued item; its mark_read/delete provider call lands in grouped."""
+    if dry_run:
+        return {"key": item["key"], "action": item["action"], "status": "ok", "message": f"DRY RUN: {item['action']}"}
+    try:
+        return _dispatch_action(item["key"], item["action"], item.get("body"), False, item.get("session_id", ""),
+                                grouped=grouped)
+    except Exception as e:
+        return {"key": item["key"], "action": item["action"], "status": "error", "message": str(e)}
 
-    result = {"key": key, "action": action, "status": "ok", "message": ""}
 
+def _finish_queue_item(item: Dict, r: Dict, dry_run: bool) -> Dict:
     if dry_run:
-        result["message"] = f"DRY RUN: {action}"
-        aq_update_status(aq_id, "dry_run", result["message"])
-        return result
+        aq_update_status(item["id"], "dry_run", r["message"])
+    else:
+        aq_update_status(item["id"], "executed" if r["status"] == "ok" else "error", r["message"])
+    return {"key": item["key"], "action": item["action"], "status": r["status"], "message": r["message"]}
 
-    try:
-        r = _dispatch_action(key, action, body, False, item.get("session_id", ""))
-        result["status"] = r["status"]
-        result["message"] = r["message"]
-        aq_update_status(aq_id, "executed" if r["status"] == "ok" else "error", r["message"])
-    except Exception as e:
-        result["status"] = "error"
-        result["message"] = str(e)
-        aq_update_status(aq_id, "error", str(e))
 
-    return result
+def _split_dispatch_key(key: str):
+    """provider:id or provider:folder:id -> (provider, msg_id); None if malformed."""
+    provider_name, _folder, msg_id = split_key(key)
+    if not provider_name:
+        return None
+    return provider_name, msg_id
 
 
-def _dispatch_action(key: str, action: str, body: str, dry_run: bool, session_id: str, confirm_delete: bool = False) -> Dict:
+def _dispatch_done(result: Dict, key: str, provider_name: str, msg_id: str, status: str, message: str,
+                   _provider_result=None):
+    mark_status(key, status)
+    log_action(key, provider_name, msg_id, result["action"], "success", message)
+    result["status"] = "ok"
+    result["message"] = message
+    print(f"  {result['action'].upper()} OK: {key} via {provider_name}", flush=True)
+
+
+def _dispatch_failed(result: Dict, key: str, provider_name: str, msg_id: str, error: Exception):
+    result["status"] = "error"
+    result["message"] = str(error)
+    log_action(key, provider_name, msg_id, result["action"], "error", str(error))
+
+
+def _dispatch_action(key: str, action: str, body: str, dry_run: bool, session_id: str, confirm_delete: bool = False,
+                     grouped: "bulk_actions.GroupedActions" = None) -> Dict:
+    """
+    Validate and run one action. mark_read and confirmed deletes are added to
+    grouped (result filled in by grouped.execute()); without one they run now.
+    """
     result = {"key": key, "action": action, "status": "ok", "message": "", "provider": ""}
 
     if dry_run:
-        parts = key.split(":", 1)
-        result["provider"] = parts[0] if len(parts) > 1 else ""
+        result["provider"] = split_key(key)[0]
         result["message"] = f"DRY RUN: {action}"
         return result
 
-    parts = key.split(":", 1)
-    if len(parts) < 2:
+    split = _split_dispatch_key(key)
+    if not split:
         result["status"] = "error"
         result["message"] = "Invalid key format"
         return result
 
-    provider_name = parts[0]
+    provider_name, msg_id = split
     result["provider"] = provider_name
-    msg_id_part = parts[1]
-
-    if ":" in msg_id_part:
-        msg_id = msg_id_part.split(":", 1)[1]
-    else:
-        msg_id = msg_id_part
 
     if provider_name not in _providers_map:
         result["status"] = "error"
@@ -754,6 +809,7 @@ def _dispatch_action(key: str, action: str, body: str, dry_run: bool, session_id
         result["message"] = f"Already {existing['status']}"
         return result
 
+    deferred = None
     try:
         if action == "send":
             send_body = body
@@ -773,21 +829,14 @@ def _dispatch_action(key: str, action: str, body: str, dry_run: bool, session_id
             print(f"  SEND OK: {key} reply sent via {provider_name}", flush=True)
 
         elif action == "mark_read":
-            provider.mark_read(msg_id)
-            mark_status(key, "read")
-            log_action(key, provider_name, msg_id, "mark_read", "success", "Marked as read")
-            result["message"] = "Marked as read"
+            deferred = ("read", "Marked as read")
 
         elif action == "delete":
             existing_msg = get_message(key)
             current_status = existing_msg.get("status") if existing_msg else None
             print(f"  DELETE: key={key}, current_status={current_status}, confirm_delete={confirm_delete}", flush=True)
             if current_status == "pending_delete" or confirm_delete:
-                provider.delete(msg_id)
-                mark_status(key, "deleted")
-                log_action(key, provider_name, msg_id, "delete", "success", "Email deleted")
-                result["message"] = "Email deleted"
-                print(f"  DELETE OK: {key} deleted via {provider_name}", flush=True)
+                deferred = ("deleted", "Email deleted")
             else:
                 mark_status(key, "pending_delete")
                 log_action(key, provider_name, msg_id, "delete", "pending", "Marked for deletion (two-step)")
@@ -803,7 +852,18 @@ def _dispatch_action(key: str, action: str, body: str, dry_run: bool, session_id
         result["status"] = "error"
         result["message"] = str(e)
         log_action(key, provider_name, msg_id, action, "error", str(e))
+        return result
 
+    if deferred:
+        run_now = grouped is None
+        if run_now:
+            grouped = bulk_actions.GroupedActions(_providers_map)
+        result["status"] = "pending"
+        grouped.add(provider_name, action, msg_id,
+                    partial(_dispatch_done, result, key, provider_name, msg_id, *deferred),
+                    partial(_dispatch_failed, result, key, provider_name, msg_id))
+        if run_now:
+            grouped.execute()
     return result
 
 
@@ -855,9 +915,14 @@ def debug_status(_: bool = Depends(_check_api_key)):
     stats = job_queue_stats()
     rl = rate_limit_status("default")
     worker = get_worker_status()
+    lookups = sum(_email_data_stats.values())
     return {
         "ok": True,
         "worker": worker,
         "queue": stats,
         "rate_limit": rl,
+        "email_data": {
+            **_email_data_stats,
+            "local_hit_rate": round(_email_data_stats["local"] / lookups, 3) if lookups else None,
+        },
     }
@@ -4,10 +4,13 @@ import threading
 import logging
 from datetime import datetime
 
+from typing import Dict
+
 from db import (
     init_db, job_claim_next, job_update, job_get,
     get_message, rate_limit_check,
 )
+from mail_sync import hydrate_message_body
 from llm_client import call_llm, call_llm_multi, parse_json_response, LLM_MAX_INPUT_CHARS
 from utils.text import clean_text, truncate_text, build_email_llm_context
 
@@ -22,11 +25,19 @@ LLM_MIN_INTERVAL = int(os.getenv("LLM_MIN_SECONDS_BETWEEN_CALLS", "3"))
 _worker_thread = None
 _worker_running = False
 _worker_last_heartbeat = 0
+_providers_map: Dict = {}
+
+
+def set_providers(providers: Dict):
+    global _providers_map
+    _providers_map = providers
 
 
 def _get_email_data_safe(key: str) -> dict:
     msg = get_message(key)
     if msg:
+        if not msg.get("body_text"):
+            msg = hydrate_message_body(msg, _providers_map)
         return msg
     return {"key": key, "from_addr": "", "subject": "", "body_text": "", "date": "", "category": "human"}
 
@@ -338,8 +349,10 @@ def _worker_loop():
             time.sleep(2)
 
 
-def start_worker():
+def start_worker(providers: Dict = None):
     global _worker_thread, _worker_running, _worker_last_heartbeat
+    if providers is not None:
+        set_providers(providers)
     if _worker_running:
         return
     _worker_running = True
@@ -0,0 +1,380 @@
+"""
+Incremental mailbox sync into the local message store (db.messages).
+
+Gmail: the last seen historyId is kept in sync_state; each sync asks
+users.history.list for what changed since then, so a refresh with no new
+mail costs one small request. If the history id has expired (or the
+backlog is too long) we fall back to a bounded full sync.
+
+Microsoft: one Graph /messages/delta deltaLink per folder, same idea.
+
+Providers without a change feed (iCloud IMAP) get a windowed ListSync:
+the last LIST_SYNC_WINDOW_DAYS of each folder are re-listed and upserted.
+"""
+import os
+import logging
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+from db import (
+    make_key, upsert_message, upsert_messages, mark_status_many, existing_message_keys,
+    sync_state_get, sync_state_set, list_local_messages
+)
+from providers.base import EmailMessage
+from assistant_loop import safe_extract_text
+
+logger = logging.getLogger(__name__)
+
+GMAIL_FULL_SYNC_MAX = int(os.getenv("GMAIL_FULL_SYNC_MAX", "500"))
+GMAIL_SYNC_HEADERS = [
+    'From', 'Subject', 'Date',
+    'List-Id', 'List-Unsubscribe', 'Auto-Submitted', 'Precedence', 'X-Auto-Response-Suppress',
+]
+LIST_SYNC_WINDOW_DAYS = int(os.getenv("LIST_SYNC_WINDOW_DAYS", "14"))
+LIST_SYNC_LIMIT = int(os.getenv("LIST_SYNC_LIMIT", "200"))
+
+
+def hydrate_message_body(msg: Dict, providers: Dict) -> Dict:
+    """
+    Fill in body_text for a stored message that was listed from metadata only
+    (Gmail list views keep just the snippet). The body is fetched once from the
+    provider and persisted, so later opens and LLM jobs read it locally.
+    """
+    if not msg or msg.get("body_text"):
+        return msg
+    provider = providers.get(msg.get("provider", ""))
+    if provider is None or not msg.get("msg_id"):
+        return msg
+    try:
+        email_msg = provider.get_message(msg["msg_id"])
+    except Exception as e:
+        logger.warning(f"Body fetch failed for {msg.get('key')}: {e}")
+        return msg
+    if not email_msg or not email_msg.body:
+        return msg
+    body_text = safe_extract_text(email_msg.body)
+    upsert_message(key=msg["key"], provider=msg["provider"], msg_id=msg["msg_id"],
+                   body=body_text, status=None)
+    return dict(msg, body_text=body_text)
+
+
+def _sync_folders(folders: List[str], sync_folder) -> Dict[str, Dict]:
+    """
+    {folder: stats} with one folder's failure recorded as {"error": ...}
+    instead of stopping the others; raises when every folder failed.
+    """
+    results, errors = {}, []
+    for folder in folders:
+        try:
+            results[folder] = sync_folder(folder)
+        except Exception as e:
+            logger.warning(f"Sync of folder {folder} failed: {e}")
+            results[folder] = {"error": str(e)}
+            errors.append(e)
+    if errors and len(errors) == len(folders):
+        raise errors[0]
+    return results
+
+
+def gmail_folder_for_labels(label_ids: List[str]) -> str:
+    labels = set(label_ids or [])
+    if "TRASH" in labels:
+        return "trash"
+    if "SPAM" in labels:
+        return "spam"
+    if "INBOX" in labels:
+        return "inbox"
+    return "archive"
+
+
+class GmailHistorySync:
+    provider_name = "gmail"
+
+    def __init__(self, provider, full_sync_max: int = GMAIL_FULL_SYNC_MAX):
+        self.provider = provider
+        self.full_sync_max = full_sync_max
+        self._lock = threading.Lock()
+
+    def sync(self, force_full: bool = False) -> Dict:
+        with self._lock:
+            state = sync_state_get(self.provider_name)
+            cursor = state.get("cursor") if state else None
+            if force_full or not cursor:
+                return self._full_sync("forced" if force_full else "no_cursor")
+
+            result = self.provider.list_history(cursor)
+            if result is None:
+                return self._full_sync("history_expired")
+
+            stats = self._apply_history(result["records"])
+            sync_state_set(self.provider_name, cursor_value=result["history_id"],
+                           meta={"mode": "incremental"})
+            stats.update({
+                "mode": "incremental",
+                "history_id": result["history_id"],
+                "requests": result["requests"] + stats.pop("fetch_requests"),
+            })
+            return stats
+
+    def _apply_history(self, records: List[dict]) -> Dict:
+        # Collapse the event log to the last known state of each message.
+        labels: Dict[str, List[str]] = {}
+        deleted = set()
+        for record in records:
+            for entry in record.get("messagesAdded", []):
+                msg = entry.get("message", {})
+                if msg.get("id"):
+                    labels[msg["id"]] = msg.get("labelIds", [])
+                    deleted.discard(msg["id"])
+            for kind in ("labelsAdded", "labelsRemoved"):
+                for entry in record.get(kind, []):
+                    msg = entry.get("message", {})
+                    if msg.get("id"):
+                        labels[msg["id"]] = msg.get("labelIds", [])
+            for entry in record.get("messagesDeleted", []):
+                msg = entry.get("message", {})
+                if msg.get("id"):
+                    deleted.add(msg["id"])
+
+        live_ids = [mid for mid in labels if mid not in deleted]
+        known = existing_message_keys([make_key(self.provider_name, mid) for mid in live_ids])
+        # Headers are only fetched for messages the store has never seen.
+        new_ids = [mid for mid in live_ids if make_key(self.provider_name, mid) not in known]
+        fetched = self.provider._batch_get(new_ids, fmt='metadata', metadata_headers=GMAIL_SYNC_HEADERS) if new_ids else {}
+
+        rows = [self._row_from_message(m, known) for m in fetched.values()]
+        for msg_id in live_ids:
+            if msg_id in fetched or make_key(self.provider_name, msg_id) not in known:
+                continue
+            label_ids = labels[msg_id]
+            rows.append({
+                "key": make_key(self.provider_name, msg_id),
+                "provider": self.provider_name,
+                "msg_id": msg_id,
+                "folder": gmail_folder_for_labels(label_ids),
+                "unread": "UNREAD" in label_ids,
+                "status": None,
+            })
+
+        upsert_messages(rows)
+        mark_status_many([make_key(self.provider_name, mid) for mid in deleted], "deleted")
+        return {
+            "added": len(fetched),
+            "updated": len(rows) - len(fetched),
+            "deleted": len(deleted),
+            "fetch_requests": 1 if new_ids else 0,
+        }
+
+    def _row_from_message(self, message: dict, known: set = frozenset()) -> Dict:
+        email_msg = self.provider._parse_message(message)
+        label_ids = message.get("labelIds", [])
+        key = make_key(self.provider_name, email_msg.id)
+        return {
+            "key": key,
+            "provider": self.provider_name,
+            "msg_id": email_msg.id,
+            "folder": gmail_folder_for_labels(label_ids),
+            "from_addr": email_msg.from_addr,
+            "subject": email_msg.subject,
+            "date": email_msg.date,
+            "unread": "UNREAD" in label_ids,
+            "header_class": getattr(email_msg, "header_class", None),
+            "status": None if key in known else "new",
+        }
+
+    def _full_sync(self, reason: str) -> Dict:
+        logger.info(f"Gmail sync: full sync ({reason}), max {self.full_sync_max} messages")
+        # Take the history id first so changes made during the scan are replayed next time.
+        history_id = self.provider.get_history_id()
+        ids: List[str] = []
+        for query in ('in:inbox -in:trash', 'in:spam'):
+            ids.extend(self.provider.iter_message_ids(query, self.full_sync_max))
+
+        fetched = self.provider._batch_get(ids, fmt='metadata', metadata_headers=GMAIL_SYNC_HEADERS) if ids else {}
+        known = existing_message_keys([make_key(self.provider_name, mid) for mid in fetched])
+        upsert_messages([self._row_from_message(m, known) for m in fetched.values()])
+        sync_state_set(self.provider_name, cursor_value=history_id,
+                       meta={"mode": "full", "reason": reason})
+        return {
+            "mode": "full",
+            "reason": reason,
+            "history_id": history_id,
+            "added": len(fetched),
+            "updated": 0,
+            "deleted": 0,
+        }
+
+
+class GraphDeltaSync:
+    provider_name = "microsoft"
+
+    def __init__(self, provider, folders: List[str] = None):
+        self.provider = provider
+        self.folders = folders or ["inbox", "spam"]
+        self._lock = threading.Lock()
+
+    def sync(self, force_full: bool = False) -> Dict:
+        with self._lock:
+            return {"mode": "delta",
+                    "folders": _sync_folders(self.folders, lambda f: self._sync_folder(f, force_full))}
+
+    def _sync_folder(self, folder: str, force_full: bool) -> Dict:
+        state = sync_state_get(self.provider_name, folder)
+        delta_link = None if force_full or not state else state.get("cursor")
+        result = self.provider.delta_messages(folder, delta_link)
+        reset = result is None
+        if reset:
+            result = self.provider.delta_messages(folder, None)
+
+        keys = [make_key(self.provider_name, m.id) for m in result["changed"]]
+        known = existing_message_keys(keys)
+        rows = []
+        for email_msg, key in zip(result["changed"], keys):
+            rows.append({
+                "key": key,
+                "provider": self.provider_name,
+                "msg_id": email_msg.id,
+                "folder": folder,
+                "from_addr": email_msg.from_addr or None,
+                "subject": email_msg.subject or None,
+                "date": email_msg.date or None,
+                "unread": email_msg.unread,
+                "header_class": getattr(email_msg, "header_class", None),
+                "status": None if key in known else "new",
+            })
+        upsert_messages(rows)
+        mark_status_many([make_key(self.provider_name, mid) for mid in result["removed"]], "deleted")
+        sync_state_set(self.provider_name, folder, cursor_value=result["delta_link"],
+                       meta={"reset": reset or not delta_link})
+        return {
+            "initial": reset or not delta_link,
+            "changed": len(rows),
+            "removed": len(result["removed"]),
+            "requests": result["requests"],
+        }
+
+
+class ListSync:
+    """Re-list a recent window of each folder; for providers with no change feed."""
+
+    def __init__(self, provider, folders: List[str] = None,
+                 window_days: int = LIST_SYNC_WINDOW_DAYS, limit: int = LIST_SYNC_LIMIT):
+        self.provider = provider
+        self.provider_name = provider.provider_name
+        self.folders = folders or ["inbox", "spam"]
+        self.window_days = window_days
+        self.limit = limit
+        self._lock = threading.Lock()
+
+    def sync(self, force_full: bool = False) -> Dict:
+        with self._lock:
+            return {"mode": "list", "folders": _sync_folders(self.folders, self._sync_folder)}
+
+    def _sync_folder(self, folder: str) -> Dict:
+        since = datetime.now(timezone.utc) - timedelta(days=self.window_days)
+        emails = self.provider.list_emails(folder=folder, limit=self.limit, date_start=since)
+        keys = [make_key(self.provider_name, m.id, folder) for m in emails]
+        known = existing_message_keys(keys)
+        rows = []
+        for email_msg, key in zip(emails, keys):
+            rows.append({
+                "key": key,
+                "provider": self.provider_name,
+                "msg_id": email_msg.id,
+                "folder": folder,
+                "from_addr": email_msg.from_addr or None,
+                "subject": email_msg.subject or None,
+                "date": email_msg.date or None,
+                "unread": getattr(email_msg, "unread", None),
+                "header_class": getattr(email_msg, "header_class", None),
+                "status": None if key in known else "new",
+            })
+        upsert_messages(rows)
+        sync_state_set(self.provider_name, folder, cursor_value=None,
+                       meta={"mode": "list", "window_days": self.window_days})
+        return {"listed": len(rows), "added": len(rows) - len(known)}
+
+
+def local_emails(provider_name: str, folder: str = None, date_start: datetime = None, date_end: datetime = None,
+                 unread_only: bool = False, limit: int = 50, providers: Dict = None) -> List[EmailMessage]:
+    """
+    list_emails() served from the local store the sync keeps up to date.
+    Messages synced without a body come back with an empty body and
+    body_is_snippet; pass providers to have the ones their headers don't
+    already classify fetched in one fetch_many and persisted, so callers
+    classify them against the real body.
+    """
+    rows = list_local_messages(
+        provider_name, folder,
+        since_ts=int(date_start.timestamp()) if date_start else None,
+        until_ts=int(date_end.timestamp()) if date_end else None,
+        unread_only=unread_only, limit=limit,
+    )
+    emails = []
+    for row in rows:
+        email_msg = EmailMessage(
+            id=row["msg_id"],
+            provider=provider_name,
+            from_addr=row.get("from_addr") or "",
+            subject=row.get("subject") or "",
+            body=row.get("body_text") or "",
+            date=row.get("date") or "",
+            folder=row.get("folder") or folder or "inbox",
+        )
+        email_msg.unread = bool(row["unread"]) if row.get("unread") is not None else True
+        email_msg.body_is_snippet = not row.get("body_text")
+        email_msg.category = row.get("category")
+        email_msg.header_class = row.get("header_class")
+        emails.append(email_msg)
+    if providers and provider_name in providers:
+        _hydrate_local(providers[provider_name], emails, [row["key"] for row in rows])
+    return emails
+
+
+def _hydrate_local(provider, emails: List[EmailMessage], keys: List[str]):
+    """Bodies for local_emails() rows stored without one; failures stay snippets."""
+    missing = [(m, key) for m, key in zip(emails, keys) if m.body_is_snippet and not m.header_class]
+    if not missing:
+        return
+    try:
+        full = provider.fetch_many([m.id for m, _ in missing])
+    except Exception as e:
+        logger.warning(f"Body fetch failed for {len(missing)} {provider.provider_name} messages: {e}")
+        return
+    rows = []
+    for email_msg, key in missing:
+        fetched = full.get(email_msg.id)
+        if not fetched or not fetched.body:
+            continue
+        email_msg.body = fetched.body
+        email_msg.body_is_snippet = False
+        rows.append({"key": key, "provider": email_msg.provider, "msg_id": email_msg.id,
+                     "body": safe_extract_text(fetched.body), "status": None})
+    upsert_messages(rows)
+
+
+_gmail_sync: Optional[GmailHistorySync] = None
+_graph_sync: Optional[GraphDeltaSync] = None
+_list_syncs: Dict[str, ListSync] = {}
+
+
+def get_gmail_sync(provider) -> GmailHistorySync:
+    global _gmail_sync
+    if _gmail_sync is None or _gmail_sync.provider is not provider:
+        _gmail_sync = GmailHistorySync(provider)
+    return _gmail_sync
+
+
+def get_graph_sync(provider) -> GraphDeltaSync:
+    global _graph_sync
+    if _graph_sync is None or _graph_sync.provider is not provider:
+        _graph_sync = GraphDeltaSync(provider)
+    return _graph_sync
+
+
+def get_list_sync(provider) -> ListSync:
+    sync = _list_syncs.get(provider.provider_name)
+    if sync is None or sync.provider is not provider:
+        sync = _list_syncs[provider.provider_name] = ListSync(provider)
+    return sync
@@ -1,17 +1,19 @@
 # main.py
 import os
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, HTTPException, Header, Depends
 from fastapi.responses import RedirectResponse, JSONResponse, HTMLResponse
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
 from dotenv import load_dotenv
-import msal
 from typing import Optional
 
 from store import get_item, set_item
 from providers.apple import AppleMailProvider
 from providers.microsoft import MicrosoftProvider
 from providers.gmail import GmailProvider
+from mail_sync import get_gmail_sync, get_graph_sync, local_emails
+import ms_auth
 
 load_dotenv()
 
@@ -24,11 +26,17 @@ CLIENT_SECRET = os.environ["CLIENT_SECRET"]
 BASE_URL = os.environ.get("BASE_URL", "")
 
 AUTHORITY = f"https://login.microsoftonline.com/{TENANT}"
-SCOPES = ["User.Read", "Mail.Read", "Mail.Send"]
+SCOPES = ms_auth.SCOPES
 
 INBOXPILOT_API_KEY = os.getenv("INBOXPILOT_API_KEY")
 
-app = FastAPI(title="InboxPilot API", version="1.1.0")
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    yield
+    await async_providers.aclose()
+
+
+app = FastAPI(title="InboxPilot API", version="1.1.0", lifespan=lifespan)
 
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
@@ -57,14 +65,14 @@ def health():
 # Providers
 # =========================
 def _msal_app():
-    return msal.ConfidentialClientApplication(
-        client_id=CLIENT_ID,
-        client_credential=CLIENT_SECRET,
-        authority=AUTHORITY,
-    )
+    return ms_auth.get_app()
 
 
 def get_access_token() -> str:
+    token = ms_auth.get_access_token()
+    if token:
+        return token
+    # token saved by the pre-MSAL-cache callback, if any
     token = get_item("access_token")
     if token:
         return token
@@ -104,7 +112,8 @@ def auth_callback(code: str):
     if "access_token" not in result:
         raise HTTPException(400, f"Auth failed: {result.get('error_description', result)}")
 
-    set_item("access_token", result["access_token"])
+    ms_auth.on_login(result)
+    set_item("access_token", "")
     return JSONResponse({"ok": True, "message": "Authenticated. Call /queue/next"})
 
 
@@ -155,6 +164,17 @@ def delete_email(message_id: str):
         raise HTTPException(500, f"Delete failed: {str(e)}")
 
 
+@app.post("/microsoft/sync")
+def microsoft_sync(full: bool = False):
+    """Apply Outlook changes since the last sync (Graph delta) to the local message store."""
+    try:
+        return get_graph_sync(microsoft_provider).sync(force_full=full)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(500, f"Microsoft sync failed: {str(e)}")
+
+
 # =========================
 # Apple Mail Endpoints
 # =========================
@@ -251,6 +271,15 @@ def gmail_queue_next(folder: str = "inbox"):
         raise HTTPException(500, f"Failed to fetch next email: {str(e)}")
 
 
+@app.post("/gmail/sync")
+def gmail_sync(full: bool = False):
+    """Apply Gmail changes since the last sync (History API) to the local message store."""
+    try:
+        return get_gmail_sync(gmail_provider).sync(force_full=full)
+    except Exception as e:
+        raise HTTPException(500, f"Gmail sync failed: {str(e)}")
+
+
 @app.post("/gmail/emails/{message_id}/suggest-reply")
 def gmail_suggest_reply(message_id: str):
     try:
@@ -558,15 +587,18 @@ def unified_delete(
 # =========================
 from automation import AutomationEngine, load_policy as load_automation_policy
 from db import (
-    init_db, upsert_message, get_message, set_draft, get_draft,
-    log_action, list_logs, mark_status, make_key, get_pending_deletes
+    init_db, upsert_messages, get_message, set_draft, get_draft,
+    log_action, list_logs, mark_status, make_key, get_pending_deletes,
+    message_statuses, draft_keys, split_key,
 )
 from assistant_loop import (
-    load_policy, classify_email, should_send_auto,
+    load_policy, classify_batch, should_send_auto,
     safe_extract_text, sanitize_reply
 )
 from typing import List as TypingList
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
+import asyncio
+import async_providers
 
 init_db()
 
@@ -577,6 +609,7 @@ class AutomationRequest(BaseModel):
     max_per_provider: int = 10
     mode: str = "dry_run"
     since_hours: int = 72
+    source: str = "live"
 
 
 @app.post("/automation/run")
@@ -596,7 +629,8 @@ def automation_run(
             folders=request.folders,
             max_per_provider=request.max_per_provider,
             mode=request.mode,
-            since_hours=request.since_hours
+            since_hours=request.since_hours,
+            source=request.source
         )
         return result
     except HTTPException:
@@ -635,14 +669,94 @@ class DecisionRequest(BaseModel):
     edited_reply: Optional[str] = None
 
 
+def _brief_items(prov_name: str, folder: str, emails, policy: dict) -> TypingList[dict]:
+    """Classify listed messages and store them in one transaction; sent/deleted ones are dropped."""
+    keyed = [(make_key(prov_name, m.id, folder), m) for m in emails]
+    statuses = message_statuses([key for key, _ in keyed])
+    
+    kept = []
+    seen = set()
+    for key, email_msg in keyed:
+        if key in seen or statuses.get(key) in ("sent", "deleted"):
+            continue
+        seen.add(key)
+        email_dict = email_msg.to_dict()
+        kept.append((key, email_msg, email_dict, safe_extract_text(email_dict.get("body", ""))))
+    classifications = classify_batch(
+        [(d.get("from", ""), d.get("subject", ""), body_text) for _, _, d, body_text in kept], policy,
+        header_classes=[getattr(m, "header_class", None) for _, m, _, _ in kept],
+    )
+    
+    rows = []
+    items = []
+    for (key, email_msg, email_dict, body_text), classification in zip(kept, classifications):
+        from_addr = email_dict.get("from", "")
+        subject = email_dict.get("subject", "")
+        
+        rows.append({
+            "key": key,
+            "provider": prov_name,
+            "msg_id": email_msg.id,
+            "folder": folder,
+            "from_addr": from_addr,
+            "subject": subject,
+            "date": email_dict.get("date", ""),
+            "body": None if getattr(email_msg, "body_is_snippet", False) else body_text,
+            "status": "classified",
+            "category": classification["category"],
+            "priority": classification["priority"],
+            "header_class": getattr(email_msg, "header_class", None),
+        })
+        items.append({
+            "key": key,
+            "provider": prov_name,
+            "id": email_msg.id,
+            "from": from_addr,
+            "subject": subject,
+            "date": email_dict.get("date", ""),
+            "folder": folder,
+            "category": classification["category"],
+            "priority": classification["priority"],
+            "recommended_action": classification["recommended_action"],
+            "reason": classification["reason"],
+        })
+    
+    upsert_messages(rows)
+    drafts = draft_keys([item["key"] for item in items])
+    for item in items:
+        item["has_draft"] = item["key"] in drafts
+    return score_priority(items)
+
+
+def _brief_local(jobs, cutoff: datetime, limit: int, providers_map: dict) -> dict:
+    results = {}
+    for prov_name, folder in jobs:
+        try:
+            results[(prov_name, folder)] = local_emails(prov_name, folder, date_start=cutoff,
+                                                        unread_only=True, limit=limit, providers=providers_map)
+        except Exception as e:
+            results[(prov_name, folder)] = e
+    return results
+
+
 @app.get("/assistant/brief")
-def assistant_brief(
+async def assistant_brief(
     providers: str = "gmail,apple,microsoft",
     folders: str = "inbox",
     limit_per_provider: int = 5,
     since_hours: Optional[int] = None,
+    source: str = "live",
+    sort: str = "date",
     _: bool = Depends(check_api_key)
 ):
+    """
+    Unread mail per provider/folder, classified. One list_emails(unread_only=True)
+    per provider x folder, all running concurrently; source=local reads the store
+    the sync scheduler maintains instead. Every item carries the priority model's
+    priority_score; sort=priority_score puts the highest first.
+    """
+    if sort not in SORT_OPTIONS:
+        raise HTTPException(400, f"Invalid sort: {sort}. Use: {', '.join(SORT_OPTIONS)}")
     try:
         policy = load_policy()
         if since_hours is None:
@@ -657,71 +771,23 @@ def assistant_brief(
             "gmail": gmail_provider,
         }
         
-        items = []
-        cutoff = datetime.utcnow() - timedelta(hours=since_hours)
+        cutoff = datetime.now(timezone.utc) - timedelta(hours=since_hours)
+        jobs = [(p, f) for p in provider_list if p in providers_map for f in folder_list]
+        
+        if source == "local":
+            results = await asyncio.to_thread(_brief_local, jobs, cutoff, limit_per_provider, providers_map)
+        else:
+            results = await async_providers.fan_out(
+                providers_map, jobs, limit=limit_per_provider, date_start=cutoff, unread_only=True
+            )
         
-        for prov_name in provider_list:
-            if prov_name not in providers_map:
+        items = []
+        for (prov_name, folder), result in results.items():
+            if isinstance(result, Exception):
+                log_action("", prov_name, "", "brief_fetch", "error", str(result))
                 continue
-            
-            provider = providers_map[prov_name]
-            
-            for folder in folder_list:
-                for _ in range(limit_per_provider):
-                    try:
-                        email_msg = provider.queue_next(folder)
-                        if not email_msg:
-                            break
-                        
-                        email_dict = email_msg.to_dict()
-                        msg_id = email_dict.get("id", "")
-                        key = make_key(prov_name, msg_id)
-                        
-                        existing = get_message(key)
-                        if existing and existing.get("status") in ("sent", "deleted"):
-                            continue
-                        
-                        from_addr = email_dict.get("from", "")
-                        subject = email_dict.get("subject", "")
-                        body = email_dict.get("body", "")
-                        body_text = safe_extract_text(body)
-                        
-                        classification = classify_email(from_addr, subject, body_text, policy)
-                        
-                        upsert_message(
-                            key=key,
-                            provider=prov_name,
-                            msg_id=msg_id,
-                            folder=folder,
-                            from_addr=from_addr,
-                            subject=subject,
-                            date=email_dict.get("date", ""),
-                            body=body_text,
-                            status="classified",
-                            category=classification["category"],
-                            priority=classification["priority"]
-                        )
-                        
-                        has_draft = get_draft(key) is not None
-                        
-                        items.append({
-                            "key": key,
-                            "provider": prov_name,
-                            "id": msg_id,
-                            "from": from_addr,
-                            "subject": subject,
-                            "date": email_dict.get("date", ""),
-                            "folder": folder,
-                            "category": classification["category"],
-                            "priority": classification["priority"],
-                            "recommended_action": classification["recommended_action"],
-                            "reason": classification["reason"],
-                            "has_draft": has_draft
-                        })
-                        
-                    except Exception as e:
-                        log_action("", prov_name, "", "brief_fetch", "error", str(e))
-                        break
+            items.extend(await asyncio.to_thread(_brief_items, prov_name, folder, result, policy))
+        items = sort_priority(items, sort)
         
         summary = {
             "total": len(items),
@@ -751,7 +817,7 @@ def assistant_decision(
         if ":" not in key:
             raise HTTPException(400, "Invalid key format. Use provider:id")
         
-        provider_name, msg_id = key.split(":", 1)
+        provider_name, _folder, msg_id = split_key(key)
         
         providers_map = {
             "microsoft": microsoft_provider,
@@ -867,6 +933,9 @@ from session_api import router as session_router, set_providers as set_session_p
 from export_api import router as export_router, set_providers as set_export_providers
 from llm_api import router as llm_router, set_providers as set_llm_providers
 from llm_worker import start_worker as start_llm_worker
+from sync_scheduler import start_scheduler as start_sync_scheduler, get_sync_status, sync_provider, request_sync, is_running as sync_scheduler_running
+from message_cache import install as install_message_cache, get_stats as message_cache_stats
+from priority_model import SORT_OPTIONS, score_items as score_priority, sort_items as sort_priority, get_stats as priority_model_stats
 
 providers_map = {
     "microsoft": microsoft_provider,
@@ -874,6 +943,7 @@ providers_map = {
     "gmail": gmail_provider,
 }
 
+install_message_cache(providers_map)
 set_inbox_providers(providers_map)
 set_session_providers(providers_map)
 set_export_providers(providers_map)
@@ -886,7 +956,43 @@ app.include_router(export_router)
 app.include_router(llm_router)
 app.include_router(voice_router)
 
-start_llm_worker()
+start_llm_worker(providers_map)
+start_sync_scheduler(providers_map)
+
+
+@app.get("/sync/status")
+def sync_status(_: bool = Depends(check_api_key)):
+    """Scheduler state and per provider/folder lag of the local store."""
+    return get_sync_status()
+
+
+@app.post("/sync/run")
+def sync_run(provider: Optional[str] = None, _: bool = Depends(check_api_key)):
+    """Sync now: queued for the scheduler if it runs, otherwise done inline."""
+    if provider and provider not in providers_map:
+        raise HTTPException(400, f"Unknown provider: {provider}")
+    if sync_scheduler_running():
+        request_sync(provider)
+        return {"queued": [provider] if provider else list(providers_map)}
+    results = {}
+    for name in [provider] if provider else list(providers_map):
+        try:
+            results[name] = sync_provider(name)
+        except Exception as e:
+            results[name] = {"error": str(e)}
+    return {"results": results}
+
+
+@app.get("/cache/messages")
+def message_cache_status(_: bool = Depends(check_api_key)):
+    """Hit/miss counters and size of the get_message() cache."""
+    return message_cache_stats()
+
+
+@app.get("/priority/model")
+def priority_model_status(_: bool = Depends(check_api_key)):
+    """Training progress of the priority_score model."""
+    return priority_model_stats()
 
 
 @app.get("/ui", response_class=HTMLResponse)
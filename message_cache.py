@@ -0,0 +1,217 @@
+"""
+Read-through cache in front of provider get_message().
+
+install() wraps each provider instance: get_message/fetch_many go through
+one process-wide LRU keyed by the canonical key (provider:id), bounded by
+MESSAGE_CACHE_MAX_ITEMS and MESSAGE_CACHE_MAX_BYTES. Concurrent misses for
+the same key share one provider request (single-flight). Mutations
+(mark_read/unread, delete, move, send, send_reply and their *_many forms)
+drop the affected entries, including a fetch still in flight.
+"""
+import os
+import logging
+import threading
+from collections import OrderedDict
+from functools import wraps
+from typing import Callable, Dict, List, Optional
+
+from db import make_key
+
+logger = logging.getLogger(__name__)
+
+MESSAGE_CACHE_MAX_ITEMS = int(os.getenv("MESSAGE_CACHE_MAX_ITEMS", "256"))
+MESSAGE_CACHE_MAX_BYTES = int(os.getenv("MESSAGE_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+
+SINGLE_MUTATIONS = ("mark_read", "mark_unread", "delete", "move", "send", "send_reply")
+BULK_MUTATIONS = ("mark_read_many", "mark_unread_many", "delete_many", "move_many")
+
+
+def _size(email_msg) -> int:
+    return sum(len(getattr(email_msg, field, "") or "") for field in ("body", "subject", "from_addr")) + 200
+
+
+class _Flight:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+        self.stale = False
+
+
+class MessageCache:
+    def __init__(self, max_items: int = MESSAGE_CACHE_MAX_ITEMS, max_bytes: int = MESSAGE_CACHE_MAX_BYTES):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self._items: "OrderedDict[str, tuple]" = OrderedDict()
+        self._bytes = 0
+        self._inflight: Dict[str, _Flight] = {}
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "shared": 0, "evictions": 0, "invalidations": 0}
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._items.get(key)
+            if entry is None:
+                return None
+            self._items.move_to_end(key)
+            self._stats["hits"] += 1
+            return entry[0]
+
+    def put(self, key: str, email_msg):
+        if email_msg is None:
+            return
+        size = _size(email_msg)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._put_locked(key, email_msg, size)
+
+    def _put_locked(self, key: str, email_msg, size: int):
+        old = self._items.pop(key, None)
+        if old:
+            self._bytes -= old[1]
+        self._items[key] = (email_msg, size)
+        self._bytes += size
+        while self._items and (len(self._items) > self.max_items or self._bytes > self.max_bytes):
+            _evicted, (_msg, evicted_size) = self._items.popitem(last=False)
+            self._bytes -= evicted_size
+            self._stats["evictions"] += 1
+
+    def get_or_fetch(self, key: str, fetch: Callable):
+        """Cached message, or fetch() once for all concurrent callers of the same key."""
+        with self._lock:
+            entry = self._items.get(key)
+            if entry is not None:
+                self._items.move_to_end(key)
+                self._stats["hits"] += 1
+                return entry[0]
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = _Flight()
+                self._stats["misses"] += 1
+            else:
+                self._stats["shared"] += 1
+
+        if not leader:
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = fetch()
+            return flight.result
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+                if flight.result is not None and not flight.stale:
+                    size = _size(flight.result)
+                    if size <= self.max_bytes:
+                        self._put_locked(key, flight.result, size)
+            flight.event.set()
+
+    def invalidate(self, keys: List[str]):
+        with self._lock:
+            for key in keys:
+                entry = self._items.pop(key, None)
+                if entry:
+                    self._bytes -= entry[1]
+                    self._stats["invalidations"] += 1
+                flight = self._inflight.get(key)
+                if flight:
+                    flight.stale = True
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"] + self._stats["shared"]
+            return {
+                **self._stats,
+                "items": len(self._items),
+                "bytes": self._bytes,
+                "max_items": self.max_items,
+                "max_bytes": self.max_bytes,
+                "hit_rate": round((self._stats["hits"] + self._stats["shared"]) / lookups, 3) if lookups else None,
+            }
+
+
+_cache = MessageCache()
+
+
+def get_cache() -> MessageCache:
+    return _cache
+
+
+def get_stats() -> Dict:
+    return _cache.stats()
+
+
+def _wrap_get_message(provider, name: str, cache: MessageCache):
+    original = provider.get_message
+
+    @wraps(original)
+    def get_message(message_id: str):
+        return cache.get_or_fetch(make_key(name, message_id), lambda: original(message_id))
+    provider.get_message = get_message
+
+
+def _wrap_fetch_many(provider, name: str, cache: MessageCache):
+    original = provider.fetch_many
+
+    @wraps(original)
+    def fetch_many(message_ids: List[str]) -> Dict:
+        result = {}
+        missing = []
+        for msg_id in message_ids:
+            email_msg = cache.get(make_key(name, msg_id))
+            if email_msg is None:
+                missing.append(msg_id)
+            else:
+                result[msg_id] = email_msg
+        if missing:
+            fetched = original(missing)
+            for msg_id, email_msg in fetched.items():
+                cache.put(make_key(name, msg_id), email_msg)
+            result.update(fetched)
+        return result
+    provider.fetch_many = fetch_many
+
+
+def _wrap_mutation(provider, name: str, method: str, cache: MessageCache, bulk: bool):
+    original = getattr(provider, method)
+
+    @wraps(original)
+    def mutate(ids, *args, **kwargs):
+        try:
+            return original(ids, *args, **kwargs)
+        finally:
+            cache.invalidate([make_key(name, msg_id) for msg_id in (ids if bulk else [ids])])
+    setattr(provider, method, mutate)
+
+
+def install(providers: Dict, cache: Optional[MessageCache] = None):
+    """Put the cache in front of each provider instance (idempotent)."""
+    cache = cache or _cache
+    for name, provider in providers.items():
+        if isinstance(getattr(provider, "_message_cache", None), MessageCache):
+            continue
+        provider_name = getattr(provider, "provider_name", None) or name
+        if hasattr(provider, "get_message"):
+            _wrap_get_message(provider, provider_name, cache)
+        if hasattr(provider, "fetch_many"):
+            _wrap_fetch_many(provider, provider_name, cache)
+        for method in SINGLE_MUTATIONS:
+            if hasattr(provider, method):
+                _wrap_mutation(provider, provider_name, method, cache, bulk=False)
+        for method in BULK_MUTATIONS:
+            if hasattr(provider, method):
+                _wrap_mutation(provider, provider_name, method, cache, bulk=True)
+        provider._message_cache = cache
@@ -0,0 +1,138 @@
+"""
+Microsoft Graph auth: one MSAL app and token cache kept in memory.
+
+The serialized SerializableTokenCache is loaded from the store once and
+written back only when MSAL changes it. get_access_token() returns the
+in-memory token while it is fresh (no I/O); a background thread refreshes
+it MS_REFRESH_MARGIN_S before expiry so callers rarely wait on a refresh.
+"""
+import os
+import time
+import logging
+import threading
+from typing import Optional
+
+import msal
+
+from store import get_item, set_item
+
+logger = logging.getLogger(__name__)
+
+SCOPES = ["User.Read", "Mail.Read", "Mail.Send"]
+MSAL_CACHE_KEY = "msal_token_cache"
+MS_REFRESH_MARGIN_S = int(os.getenv("MS_REFRESH_MARGIN_S", "300"))
+MS_REFRESH_POLL_S = int(os.getenv("MS_REFRESH_POLL_S", "60"))
+
+_lock = threading.RLock()
+_app = None
+_cache: Optional[msal.SerializableTokenCache] = None
+_token: Optional[str] = None
+_expires_at = 0.0
+_refresh_thread = None
+
+
+def _load_cache() -> msal.SerializableTokenCache:
+    global _cache
+    if _cache is None:
+        cache = msal.SerializableTokenCache()
+        try:
+            serialized = get_item(MSAL_CACHE_KEY)
+            if serialized:
+                cache.deserialize(serialized)
+        except Exception as e:
+            logger.warning(f"MSAL cache load failed: {e}")
+        _cache = cache
+    return _cache
+
+
+def _persist_cache():
+    if _cache is not None and _cache.has_state_changed:
+        set_item(MSAL_CACHE_KEY, _cache.serialize())
+        _cache.has_state_changed = False
+
+
+def get_app() -> msal.ConfidentialClientApplication:
+    global _app
+    with _lock:
+        if _app is None:
+            _app = msal.ConfidentialClientApplication(
+                client_id=os.environ["CLIENT_ID"],
+                client_credential=os.environ["CLIENT_SECRET"],
+                authority=f"https://login.microsoftonline.com/{os.getenv('TENANT_ID', 'common')}",
+                token_cache=_load_cache(),
+            )
+        return _app
+
+
+def _remember(result: dict) -> Optional[str]:
+    global _token, _expires_at
+    if not result or "access_token" not in result:
+        return None
+    _token = result["access_token"]
+    _expires_at = time.time() + int(result.get("expires_in", 3600))
+    _persist_cache()
+    _ensure_refresh_thread()
+    return _token
+
+
+def on_login(result: dict) -> Optional[str]:
+    """Record the result of acquire_token_by_authorization_code (the app already cached it)."""
+    with _lock:
+        return _remember(result)
+
+
+def _refresh(lead_s: int = MS_REFRESH_MARGIN_S) -> Optional[str]:
+    global _token, _expires_at
+    with _lock:
+        # another thread may have refreshed while we waited for the lock
+        if _token and time.time() < _expires_at - lead_s:
+            return _token
+        # Not signed in: don't build the app (MSAL fetches authority metadata on init).
+        if not _load_cache().find(msal.TokenCache.CredentialType.ACCOUNT):
+            _token, _expires_at = None, 0.0
+            return None
+        app = get_app()
+        accounts = app.get_accounts()
+        if not accounts:
+            _token, _expires_at = None, 0.0
+            return None
+        # force_refresh: MSAL would otherwise hand back the cached token we consider stale
+        result = app.acquire_token_silent(SCOPES, account=accounts[0],
+                                          force_refresh=bool(_token))
+        if not result or "access_token" not in result:
+            logger.warning(f"MSAL silent refresh failed: {(result or {}).get('error_description')}")
+            # a transient failure keeps the current token until it expires; the loop retries
+            if (result or {}).get("error") == "invalid_grant" or time.time() >= _expires_at:
+                _token, _expires_at = None, 0.0
+            return _token
+        logger.info("Microsoft token refreshed")
+        return _remember(result)
+
+
+def is_signed_in() -> bool:
+    """True if the token cache holds an account; no network access."""
+    return bool(_token) or bool(_load_cache().find(msal.TokenCache.CredentialType.ACCOUNT))
+
+
+def get_access_token() -> Optional[str]:
+    token = _token
+    if token and time.time() < _expires_at - MS_REFRESH_MARGIN_S:
+        return token
+    return _refresh()
+
+
+def _refresh_loop():
+    while True:
+        time.sleep(MS_REFRESH_POLL_S)
+        try:
+            if _token:
+                _refresh(MS_REFRESH_MARGIN_S + MS_REFRESH_POLL_S)
+        except Exception as e:
+            logger.error(f"Microsoft background refresh error: {e}")
+
+
+def _ensure_refresh_thread():
+    global _refresh_thread
+    if _refresh_thread is None or not _refresh_thread.is_alive():
+        _refresh_thread = threading.Thread(target=_refresh_loop, daemon=True, name="ms-token-refresh")
+        _refresh_thread.start()
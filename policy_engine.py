@@ -0,0 +1,263 @@
+"""
+Compiled policy matcher shared by every classifier.
+
+The keyword lists of policy.json (never_reply_keywords, newsletter keywords,
+block_reply_domains) are compiled once per policy: lower-cased, de-duplicated,
+and pruned of keywords that contain a shorter keyword of the same list (a hit
+on "security code" is already a hit on "code"). Matching is then one C-level
+substring search per remaining keyword over text lower-cased once per field.
+A combined-regex automaton was tried and dropped: CPython's re engine steps
+through every position and came out about 5x slower than plain str searches
+on policy.json (see benchmarks/bench_policy_engine.py).
+
+classify_many() takes columns (from / subject / body / header_class lists)
+and returns one byte code per row instead of per-email strings and dicts.
+Whole-column sweeps (one find() pass per keyword over the joined column,
+per-rule bitmasks combined afterwards) measured slower than the per-row loop
+with early exit, so the rows are still evaluated one by one; see
+benchmarks/bench_classify_many.py.
+
+get_engine() returns the engine for the current policy.json and recompiles
+when the file changes; the file is stat()ed at most every POLICY_RELOAD_CHECK_S
+seconds instead of once per email.
+"""
+import os
+import json
+import time
+import threading
+from itertools import repeat
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # optional: classify_many() then returns plain bytes
+    np = None
+
+POLICY_PATH = "policy.json"
+POLICY_RELOAD_CHECK_S = float(os.getenv("POLICY_RELOAD_CHECK_S", "2"))
+
+OTP_LIST = "never_reply_keywords"
+NEWSLETTER_LIST = "newsletter_keywords"
+BLOCKED_LIST = "block_reply_domains"
+
+DEFAULT_POLICY = {
+    "allow_auto_reply_domains": [],
+    "block_reply_domains": ["no-reply", "noreply"],
+    "never_reply_keywords": ["código", "otp", "senha", "verification", "code"],
+    "newsletter_keywords": ["unsubscribe", "newsletter"],
+    "require_manual_categories": ["financeiro", "juridico"],
+    "max_send_per_run": 3,
+    "since_hours_default": 72,
+    "delete_strategy": "two_step",
+    "pending_delete_hours": 6,
+    "default_signature": "— Diego"
+}
+
+
+# classify_many() result codes: CATEGORY_NAMES[code], PRIORITY_NAMES[code]
+CATEGORY_NAMES = ("human", "otp", "automated", "newsletter")
+PRIORITY_NAMES = ("low", "medium", "high")
+HUMAN, OTP, AUTOMATED, NEWSLETTER = range(4)
+
+# Classes derived from the definitive list/automation headers, and the category
+# each implies. Anything else (hints such as List-Id, or classes stored by older
+# rules) falls through to the body classifier.
+HEADER_CATEGORIES = {
+    "auto_generated": "automated",
+    "bulk": "newsletter",
+    "list": "newsletter",
+}
+
+
+def _keyword_lists(policy: dict) -> Dict[str, List[str]]:
+    return {
+        OTP_LIST: policy.get(OTP_LIST) or [],
+        NEWSLETTER_LIST: policy.get(NEWSLETTER_LIST) or policy.get("safe_newsletter_keywords") or [],
+        BLOCKED_LIST: policy.get(BLOCKED_LIST) or [],
+    }
+
+
+def _compile_list(keywords: List[str]) -> Tuple[str, ...]:
+    lowered = sorted({kw.lower() for kw in keywords if kw}, key=len)
+    kept = []
+    for kw in lowered:
+        if not any(shorter in kw for shorter in kept):
+            kept.append(kw)
+    return tuple(kept)
+
+
+class PolicyEngine:
+    def __init__(self, policy: dict):
+        self.policy = policy
+        lists = {name: _compile_list(keywords) for name, keywords in _keyword_lists(policy).items()}
+        self.otp = lists[OTP_LIST]
+        self.newsletter = lists[NEWSLETTER_LIST]
+        self.blocked = lists[BLOCKED_LIST]
+
+    def categorize(self, from_addr: str, subject: str, body: str,
+                   otp_window: int = 1000, newsletter_window: int = 2000,
+                   header_class: Optional[str] = None) -> str:
+        """
+        otp / automated / newsletter / human for one email. OTP keywords count
+        in the subject and the first otp_window body chars, blocked domains in
+        the sender, newsletter keywords in the first newsletter_window body chars.
+        With a header_class from HEADER_CATEGORIES only the subject is checked
+        for OTP; otherwise the headers decide and the body is ignored.
+        """
+        header_category = HEADER_CATEGORIES.get(header_class)
+        if header_category:
+            if any(map((subject or "").lower().__contains__, self.otp)):
+                return "otp"
+            return header_category
+        body = body or ""
+        head = body[:otp_window].lower()
+        subject_lower = (subject or "").lower()
+        if any(map(subject_lower.__contains__, self.otp)) or any(map(head.__contains__, self.otp)):
+            return "otp"
+        from_lower = (from_addr or "").lower()
+        if any(map(from_lower.__contains__, self.blocked)):
+            return "automated"
+        if newsletter_window > otp_window:
+            text = head + body[otp_window:newsletter_window].lower()
+        else:
+            text = head[:newsletter_window]
+        if any(map(text.__contains__, self.newsletter)):
+            return "newsletter"
+        return "human"
+
+    def classify_batch(self, emails: Iterable[Tuple[str, str, str]],
+                       otp_window: int = 1000, newsletter_window: int = 2000,
+                       header_classes: Iterable[Optional[str]] = None) -> List[str]:
+        """categorize() for many (from, subject, body) tuples, in order."""
+        emails = list(emails)
+        categories, _ = self.classify_columns(
+            [e[0] for e in emails], [e[1] for e in emails], [e[2] for e in emails],
+            header_classes=header_classes, otp_window=otp_window, newsletter_window=newsletter_window,
+        )
+        return [CATEGORY_NAMES[code] for code in categories]
+
+    def classify_columns(self, froms: Sequence[str], subjects: Sequence[str], bodies: Sequence[str],
+                         header_classes: Sequence[Optional[str]] = None,
+                         otp_window: int = 1000, newsletter_window: int = 2000) -> Tuple[bytes, bytes]:
+        """
+        categorize() over columns: (category codes, priority codes), one byte
+        per row. Same rules and precedence, evaluated in one loop with the
+        keyword tuples bound locally and no per-row result objects.
+        """
+        otp, blocked, newsletter = self.otp, self.blocked, self.newsletter
+        header_codes = {hc: CATEGORY_NAMES.index(cat) for hc, cat in HEADER_CATEGORIES.items()}
+        if header_classes is None:
+            header_classes = repeat(None)
+        news_extra = newsletter_window > otp_window
+        codes = bytearray(len(froms))
+        for i, (from_addr, subject, body, hc) in enumerate(zip(froms, subjects, bodies, header_classes)):
+            subject_lower = (subject or "").lower()
+            if any(map(subject_lower.__contains__, otp)):
+                codes[i] = OTP
+                continue
+            if hc in header_codes:
+                codes[i] = header_codes[hc]
+                continue
+            body = body or ""
+            head = body[:otp_window].lower()
+            if any(map(head.__contains__, otp)):
+                codes[i] = OTP
+                continue
+            from_lower = (from_addr or "").lower()
+            if any(map(from_lower.__contains__, blocked)):
+                codes[i] = AUTOMATED
+                continue
+            text = head + body[otp_window:newsletter_window].lower() if news_extra else head[:newsletter_window]
+            if any(map(text.__contains__, newsletter)):
+                codes[i] = NEWSLETTER
+        categories = bytes(codes)
+        return categories, categories.translate(_PRIORITY_TABLE)
+
+
+_PRIORITY_TABLE = bytes(1 if v == HUMAN else 0 for v in range(256))
+
+
+def classify_many(records: Dict[str, Sequence], policy: dict = None,
+                  otp_window: int = 1000, newsletter_window: int = 2000):
+    """
+    Bulk classification over columnar records: {"from": [...], "subject": [...],
+    "body": [...], "header_class": [...] (optional)}. Returns
+    {"category": codes, "priority": codes} indexing CATEGORY_NAMES /
+    PRIORITY_NAMES; uint8 NumPy arrays when NumPy is installed, else bytes.
+    """
+    categories, priorities = get_engine(policy).classify_columns(
+        records["from"], records["subject"], records["body"], records.get("header_class"),
+        otp_window=otp_window, newsletter_window=newsletter_window,
+    )
+    if np is not None:
+        return {"category": np.frombuffer(categories, dtype=np.uint8),
+                "priority": np.frombuffer(priorities, dtype=np.uint8)}
+    return {"category": categories, "priority": priorities}
+
+
+_lock = threading.Lock()
+_policy: Optional[dict] = None
+_policy_mtime: Optional[float] = None
+_next_check = 0.0
+_engine: Optional[PolicyEngine] = None
+_adhoc: Optional[PolicyEngine] = None
+
+
+def load_policy() -> dict:
+    """policy.json, re-read when its mtime changes (checked every POLICY_RELOAD_CHECK_S)."""
+    global _policy, _policy_mtime, _next_check, _engine
+    now = time.monotonic()
+    if _policy is not None and now < _next_check:
+        return _policy
+    with _lock:
+        _next_check = now + POLICY_RELOAD_CHECK_S
+        mtime = os.path.getmtime(POLICY_PATH) if os.path.exists(POLICY_PATH) else None
+        if _policy is not None and mtime == _policy_mtime:
+            return _policy
+        if mtime is None:
+            _policy = DEFAULT_POLICY
+        else:
+            with open(POLICY_PATH, "r", encoding="utf-8") as f:
+                _policy = json.load(f)
+        _policy_mtime = mtime
+        _engine = None
+        return _policy
+
+
+def get_engine(policy: dict = None) -> PolicyEngine:
+    """Compiled engine for policy (default: current policy.json); compiled once per policy object."""
+    global _engine, _adhoc
+    if policy is None:
+        policy = load_policy()
+    engine = _engine
+    if engine is not None and engine.policy is policy:
+        return engine
+    engine = _adhoc
+    if engine is not None and engine.policy is policy:
+        return engine
+    engine = PolicyEngine(policy)
+    if policy is _policy:
+        _engine = engine
+    else:
+        _adhoc = engine
+    return engine
+
+
+def header_class(headers: Dict[str, str]) -> Optional[str]:
+    """
+    auto_generated / bulk / list from the definitive list-view headers
+    (lower-cased names): Auto-Submitted other than "no", Precedence bulk/junk
+    or list. List-Id, List-Unsubscribe, X-Auto-Response-Suppress and no-reply
+    senders are only hints (mailing-list posts and replies from real people
+    carry them too), so they return None and the body classifier decides.
+    """
+    headers = headers or {}
+    auto = (headers.get("auto-submitted") or "").strip().lower()
+    if auto and auto != "no":
+        return "auto_generated"
+    precedence = (headers.get("precedence") or "").strip().lower()
+    if precedence in ("bulk", "junk"):
+        return "bulk"
+    if precedence == "list":
+        return "list"
+    return None
@@ -0,0 +1,230 @@
+"""
+On-box priority ranking learned from what we actually do with mail.
+
+Each message is reduced to hashed features: the sender address, its domain
+and the subject words, hashed into 2**PRIORITY_MODEL_BITS weights. A
+logistic regression over them predicts whether a message from that sender
+and subject gets a reply or is kept unread (positive) or gets deleted, marked
+read or skipped (negative). Labels come from the actions table joined to the
+stored message; training is incremental (plain SGD) from the last action id
+learned, and the weights are kept in sync_state so they survive restarts.
+
+get_model() never trains on the caller's thread: at most every
+PRIORITY_MODEL_TRAIN_S seconds it starts a background thread that trains a
+copy and swaps it in, so request handlers (and the event loop) only score.
+Actions logged by the automation engine (source="automation") are left out
+of training; they follow the policy rules, not what the user wants.
+score_items() scores a whole listing in one pass (vectorized when NumPy is
+installed) and sets item["priority_score"], the probability that the message
+needs us; sort_items() orders a listing by it. An untrained model scores
+everything 0.5, so the listing keeps its date order.
+"""
+import os
+import re
+import math
+import time
+import zlib
+import logging
+import threading
+from email.utils import parseaddr
+from typing import Dict, List, Optional, Sequence
+
+from db import sync_state_get, sync_state_set, training_actions
+
+try:
+    import numpy as np
+except ImportError:  # optional: pure-Python scoring
+    np = None
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_MODEL_BITS = int(os.getenv("PRIORITY_MODEL_BITS", "16"))
+PRIORITY_MODEL_LR = float(os.getenv("PRIORITY_MODEL_LR", "0.2"))
+PRIORITY_MODEL_L2 = float(os.getenv("PRIORITY_MODEL_L2", "0.0001"))
+PRIORITY_MODEL_TRAIN_S = float(os.getenv("PRIORITY_MODEL_TRAIN_S", "60"))
+PRIORITY_MODEL_TRAIN_BATCH = int(os.getenv("PRIORITY_MODEL_TRAIN_BATCH", "2000"))
+
+# actions.action -> label (1 = needed us)
+ACTION_LABELS = {
+    "send": 1,
+    "send_with_edits": 1,
+    "suggest_reply": 1,
+    "mark_unread": 1,
+    "delete": 0,
+    "pending_delete": 0,
+    "mark_read": 0,
+    "skip": 0,
+}
+
+SORT_OPTIONS = ("date", "priority_score")
+# actions.source values that say nothing about what the user wants
+EXCLUDED_SOURCES = ("automation",)
+
+STATE_PROVIDER = "priority_model"
+STATE_SCOPE = "actions"
+
+_WORD_RE = re.compile(r"\w{2,}")
+MAX_SUBJECT_WORDS = 20
+
+
+def features(from_addr: str, subject: str, bits: int = PRIORITY_MODEL_BITS) -> List[int]:
+    """Hashed feature indices for one message (never empty)."""
+    addr = parseaddr(from_addr or "")[1].lower() or (from_addr or "").strip().lower()
+    tokens = ["from:" + addr, "domain:" + addr.rpartition("@")[2]]
+    tokens += ["subj:" + word for word in _WORD_RE.findall((subject or "").lower())[:MAX_SUBJECT_WORDS]]
+    mask = (1 << bits) - 1
+    return [zlib.crc32(token.encode("utf-8")) & mask for token in tokens]
+
+
+def _sigmoid(z: float) -> float:
+    if z < -35:
+        return 0.0
+    return 1.0 / (1.0 + math.exp(-z))
+
+
+class PriorityModel:
+    def __init__(self, bits: int = PRIORITY_MODEL_BITS):
+        self.bits = bits
+        size = 1 << bits
+        self.weights = np.zeros(size) if np is not None else [0.0] * size
+        self.bias = 0.0
+        self.examples = 0
+        self.cursor = 0  # last actions.id learned from
+
+    def learn(self, rows: Sequence[Dict], lr: float = PRIORITY_MODEL_LR, l2: float = PRIORITY_MODEL_L2):
+        """One SGD step per {"from_addr", "subject", "label"} row, in order."""
+        w = self.weights
+        for row in rows:
+            idx = features(row.get("from_addr"), row.get("subject"), self.bits)
+            z = self.bias
+            for i in idx:
+                z += w[i]
+            g = _sigmoid(z) - row["label"]
+            self.bias -= lr * g
+            for i in idx:
+                w[i] -= lr * (g + l2 * w[i])
+        self.examples += len(rows)
+
+    def score_many(self, froms: Sequence[str], subjects: Sequence[str]) -> List[float]:
+        """Probability that each message needs us, in order."""
+        rows = [features(f, s, self.bits) for f, s in zip(froms, subjects)]
+        if not rows:
+            return []
+        if np is not None:
+            flat = np.fromiter((i for idx in rows for i in idx), dtype=np.int64)
+            starts = np.cumsum([0] + [len(idx) for idx in rows[:-1]])
+            z = np.add.reduceat(self.weights[flat], starts) + self.bias
+            return (1.0 / (1.0 + np.exp(-np.clip(z, -35, 35)))).tolist()
+        w = self.weights
+        return [_sigmoid(self.bias + sum(w[i] for i in idx)) for idx in rows]
+
+    def copy(self) -> "PriorityModel":
+        model = PriorityModel(self.bits)
+        model.weights = self.weights.copy() if np is not None else list(self.weights)
+        model.bias, model.examples, model.cursor = self.bias, self.examples, self.cursor
+        return model
+
+    def to_state(self) -> Dict:
+        nonzero = {str(i): round(float(v), 6) for i, v in enumerate(self.weights) if v}
+        return {"bits": self.bits, "bias": self.bias, "examples": self.examples, "weights": nonzero}
+
+    @classmethod
+    def from_state(cls, state: Optional[Dict]) -> "PriorityModel":
+        meta = (state or {}).get("meta") or {}
+        model = cls()
+        if meta.get("bits", PRIORITY_MODEL_BITS) != PRIORITY_MODEL_BITS:
+            # hash width changed: start over from the whole history
+            return model
+        for i, v in (meta.get("weights") or {}).items():
+            model.weights[int(i)] = v
+        model.bias = meta.get("bias", 0.0)
+        model.examples = meta.get("examples", 0)
+        model.cursor = int((state or {}).get("cursor") or 0)
+        return model
+
+
+def load_model() -> PriorityModel:
+    return PriorityModel.from_state(sync_state_get(STATE_PROVIDER, STATE_SCOPE))
+
+
+def save_model(model: PriorityModel):
+    sync_state_set(STATE_PROVIDER, STATE_SCOPE, cursor_value=str(model.cursor), meta=model.to_state())
+
+
+def train(model: PriorityModel, limit: int = PRIORITY_MODEL_TRAIN_BATCH) -> int:
+    """Learn from actions recorded since model.cursor; returns how many were used."""
+    rows = training_actions(model.cursor, list(ACTION_LABELS), limit, exclude_sources=EXCLUDED_SOURCES)
+    if not rows:
+        return 0
+    for row in rows:
+        row["label"] = ACTION_LABELS[row["action"]]
+    model.learn(rows)
+    model.cursor = rows[-1]["id"]
+    save_model(model)
+    return len(rows)
+
+
+_lock = threading.Lock()
+_model: Optional[PriorityModel] = None
+_next_train = 0.0
+_training = False
+
+
+def _train_in_background():
+    global _model, _training
+    try:
+        model = _model.copy()
+        learned = train(model)
+        if learned:
+            _model = model
+            logger.info(f"Priority model learned {learned} actions (cursor {model.cursor})")
+    except Exception as e:
+        logger.warning(f"Priority model training failed: {e}")
+    finally:
+        _training = False
+
+
+def get_model() -> PriorityModel:
+    """The shared model; catching up with the actions history happens on a background thread."""
+    global _model, _next_train, _training
+    now = time.monotonic()
+    if _model is not None and (now < _next_train or _training):
+        return _model
+    with _lock:
+        if _model is None:
+            _model = load_model()
+        if now >= _next_train and not _training:
+            _next_train = now + PRIORITY_MODEL_TRAIN_S
+            _training = True
+            threading.Thread(target=_train_in_background, daemon=True, name="priority-model-train").start()
+        return _model
+
+
+def score_items(items: List[Dict], model: PriorityModel = None) -> List[Dict]:
+    """Set priority_score on listing items ({"from", "subject", ...}) that do not have one yet."""
+    todo = [it for it in items if "priority_score" not in it]
+    if todo:
+        model = model or get_model()
+        scores = model.score_many([it.get("from") or "" for it in todo], [it.get("subject") or "" for it in todo])
+        for it, score in zip(todo, scores):
+            it["priority_score"] = round(score, 4)
+    return items
+
+
+def sort_items(items: List[Dict], sort: str = "date", model: PriorityModel = None) -> List[Dict]:
+    """items in the requested order; "date" keeps the given (newest-first) order."""
+    if sort != "priority_score":
+        return items
+    score_items(items, model)
+    return sorted(items, key=lambda it: it["priority_score"], reverse=True)
+
+
+def get_stats() -> Dict:
+    model = get_model()
+    return {
+        "examples": model.examples,
+        "cursor": model.cursor,
+        "bits": model.bits,
+        "nonzero_weights": sum(1 for v in model.weights if v),
+        "numpy": np is not None,
+    }
@@ -1,11 +1,13 @@
 import os
+import re
+import logging
 import imaplib
 import smtplib
 import email as email_lib
 import html
 from email.mime.text import MIMEText
 from email.header import decode_header
-from typing import Optional, List
+from typing import Optional, List, Dict, Iterator
 from datetime import datetime, timezone
 from email.utils import parsedate_to_datetime
 
@@ -20,10 +22,40 @@ from time_filters import period_to_range
 IMAP_SERVER = "imap.mail.me.com"
 SMTP_SERVER = "smtp.mail.me.com"
 SMTP_PORT = 587
+# UIDs per UID FETCH/STORE/COPY command; keeps command lines a sane length.
+APPLE_UID_CHUNK = int(os.getenv("APPLE_UID_CHUNK", "500"))
 
 OTP_SUBJECT_PATTERNS = ["código", "codigo", "confirm", "verification", "otp", "one-time", "2fa", "two-factor", "security code"]
 OTP_FROM_PATTERNS = ["no-reply", "noreply", "donotreply", "do-not-reply"]
 
+_UID_RE = re.compile(rb"UID (\d+)")
+
+
+def _uid_chunks(message_ids: List[str]):
+    for i in range(0, len(message_ids), APPLE_UID_CHUNK):
+        chunk = [str(m) for m in message_ids[i:i + APPLE_UID_CHUNK]]
+        yield chunk, ",".join(chunk)
+
+
+def _parse_uid_fetch(msg_data) -> Dict[str, bytes]:
+    """{uid: literal} from a multi-message UID FETCH response; UID may come before or after the literal."""
+    result = {}
+    pending = None
+    for part in msg_data or []:
+        if isinstance(part, tuple) and len(part) > 1:
+            m = _UID_RE.search(part[0])
+            if m:
+                result[m.group(1).decode()] = part[1]
+                pending = None
+            else:
+                pending = part[1]
+        elif isinstance(part, bytes) and pending is not None:
+            m = _UID_RE.search(part)
+            if m:
+                result[m.group(1).decode()] = pending
+            pending = None
+    return result
+
 
 class AppleMailProvider(EmailProvider):
     provider_name = "apple"
@@ -229,6 +261,16 @@ class AppleMailProvider(EmailProvider):
         date_end: datetime = None,
         unread_only: bool = False
     ) -> List[EmailMessage]:
+        return list(self.iter_emails(folder, limit, date_start, date_end, unread_only))
+
+    def iter_emails(
+        self,
+        folder: str = "inbox",
+        limit: int = 50,
+        date_start: datetime = None,
+        date_end: datetime = None,
+        unread_only: bool = False
+    ) -> Iterator[EmailMessage]:
         """
         Robust email listing using UID-based pagination with INTERNALDATE filtering.
         Uses AppleIMAPClient for reliable iCloud sync with unseen boost.
@@ -252,16 +294,13 @@ class AppleMailProvider(EmailProvider):
                 limit=limit,
                 buffer_days=2,
                 unseen_boost=True,
-                batch_size=150
+                batch_size=150,
+                unseen_only=unread_only
             )
             
-            emails = []
             for msg_data in messages:
                 uid = msg_data.get("id", "")
                 
-                if unread_only and not msg_data.get("unseen", False):
-                    continue
-                
                 email_msg = EmailMessage(
                     id=uid,
                     provider=self.provider_name,
@@ -272,9 +311,8 @@ class AppleMailProvider(EmailProvider):
                 )
                 email_msg.folder = folder
                 email_msg.unread = msg_data.get("unseen", False)
-                emails.append(email_msg)
-            
-            return emails
+                email_msg.header_class = msg_data.get("header_class")
+                yield email_msg
             
         finally:
             client.close()
@@ -383,25 +421,7 @@ class AppleMailProvider(EmailProvider):
         mail = self._connect("INBOX", readonly=False)
         
         # iCloud uses Trash folder - try to move there first
-        trash_folders = ["Trash", "Deleted Messages", "INBOX.Trash", "[Gmail]/Trash"]
-        trash_folder = None
-        
-        # Find the trash folder
-        try:
-            status, folders_raw = mail.list()
-            if status == "OK":
-                for f in folders_raw:
-                    if isinstance(f, bytes):
-                        decoded = f.decode(errors="ignore").lower()
-                        if "trash" in decoded or "deleted" in decoded or "lixeira" in decoded:
-                            # Extract folder name
-                            parts = f.decode(errors="ignore").split('"')
-                            if len(parts) >= 2:
-                                trash_folder = parts[-2]
-                                logging.info(f"[APPLE DELETE] Found trash folder: {trash_folder}")
-                                break
-        except Exception as e:
-            logging.warning(f"[APPLE DELETE] Could not list folders: {e}")
+        trash_folder = self._find_trash_folder(mail)
         
         # Method 1: Try to COPY to Trash then delete from INBOX
         if trash_folder:
@@ -433,6 +453,119 @@ class AppleMailProvider(EmailProvider):
         
         return {"ok": True, "uid": message_id, "method": "direct_delete"}
 
+    def _find_trash_folder(self, mail) -> Optional[str]:
+        try:
+            status, folders_raw = mail.list()
+            if status == "OK":
+                for f in folders_raw:
+                    if isinstance(f, bytes):
+                        decoded = f.decode(errors="ignore").lower()
+                        if "trash" in decoded or "deleted" in decoded or "lixeira" in decoded:
+                            # Extract folder name
+                            parts = f.decode(errors="ignore").split('"')
+                            if len(parts) >= 2:
+                                logging.info(f"[APPLE DELETE] Found trash folder: {parts[-2]}")
+                                return parts[-2]
+        except Exception as e:
+            logging.warning(f"[APPLE DELETE] Could not list folders: {e}")
+        return None
+
+    # Bulk operations: one IMAP session, UID sets of APPLE_UID_CHUNK per command.
+
+    def fetch_many(self, message_ids: List[str]) -> Dict[str, EmailMessage]:
+        result = {}
+        if not message_ids:
+            return result
+        mail = self._connect("INBOX", readonly=True)
+        try:
+            for _, uid_set in _uid_chunks(message_ids):
+                status, msg_data = mail.uid("fetch", uid_set, "(UID BODY.PEEK[])")
+                if status != "OK":
+                    continue
+                for uid, raw in _parse_uid_fetch(msg_data).items():
+                    if isinstance(raw, str):
+                        raw = raw.encode()
+                    result[uid] = self._parse_message(email_lib.message_from_bytes(raw), uid)
+        finally:
+            mail.logout()
+        return result
+
+    def _store_many(self, message_ids: List[str], op: str, flags: str) -> dict:
+        results = {}
+        if not message_ids:
+            return results
+        mail = self._connect("INBOX", readonly=False)
+        try:
+            for chunk, uid_set in _uid_chunks(message_ids):
+                status, _ = mail.uid("store", uid_set, op, flags)
+                for uid in chunk:
+                    results[uid] = {"ok": True, "uid": uid} if status == "OK" else \
+                        Exception(f"Failed to store {flags} on UID {uid}")
+        finally:
+            mail.logout()
+        return results
+
+    def mark_read_many(self, message_ids: List[str]) -> dict:
+        return self._store_many(message_ids, "+FLAGS", "(\\Seen)")
+
+    def mark_unread_many(self, message_ids: List[str]) -> dict:
+        return self._store_many(message_ids, "-FLAGS", "(\\Seen)")
+
+    def _move_uids(self, mail, message_ids: List[str], mailbox: str, method: str) -> dict:
+        """COPY + \\Deleted per UID set and a single EXPUNGE (UID MOVE when the server has it)."""
+        results = {}
+        use_move = "MOVE" in getattr(mail, "capabilities", ())
+        for chunk, uid_set in _uid_chunks(message_ids):
+            if use_move:
+                status, _ = mail.uid("move", uid_set, mailbox)
+            else:
+                status, _ = mail.uid("copy", uid_set, mailbox)
+                if status == "OK":
+                    status, _ = mail.uid("store", uid_set, "+FLAGS", "(\\Deleted)")
+            for uid in chunk:
+                results[uid] = {"ok": True, "uid": uid, "method": method} if status == "OK" else \
+                    Exception(f"Failed to move UID {uid} to {mailbox}")
+        if not use_move:
+            mail.expunge()
+        return results
+
+    def move(self, message_id: str, folder: str) -> dict:
+        result = self.move_many([message_id], folder)[str(message_id)]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def move_many(self, message_ids: List[str], folder: str) -> dict:
+        if not message_ids:
+            return {}
+        mailbox = self._resolve_folder(folder)
+        mail = self._connect("INBOX", readonly=False)
+        try:
+            return self._move_uids(mail, message_ids, f'"{mailbox}"', "move")
+        finally:
+            mail.logout()
+
+    def delete_many(self, message_ids: List[str]) -> dict:
+        """Like delete(): move to the trash folder, or flag \\Deleted + expunge if there is none."""
+        if not message_ids:
+            return {}
+        logging.info(f"[APPLE DELETE] bulk request count={len(message_ids)}")
+        mail = self._connect("INBOX", readonly=False)
+        try:
+            trash_folder = self._find_trash_folder(mail)
+            if trash_folder:
+                return self._move_uids(mail, message_ids, trash_folder, "move_to_trash")
+            results = {}
+            for chunk, uid_set in _uid_chunks(message_ids):
+                status, _ = mail.uid("store", uid_set, "+FLAGS", "(\\Deleted)")
+                for uid in chunk:
+                    results[uid] = {"ok": True, "uid": uid, "method": "direct_delete"} if status == "OK" else \
+                        Exception(f"Failed to mark UID {uid} as deleted")
+            mail.expunge()
+            return results
+        finally:
+            mail.logout()
+
     def list_folders(self) -> List[str]:
         self._require_creds()
         mail = imaplib.IMAP4_SSL(IMAP_SERVER)
@@ -450,8 +583,8 @@ class AppleMailProvider(EmailProvider):
         mail.logout()
         return folders
 
-    def send_reply(self, message_id: str, body: str) -> dict:
-        email_msg = self.get_message(message_id)
+    def send_reply(self, message_id: str, body: str, original: Optional[EmailMessage] = None) -> dict:
+        email_msg = original or self.get_message(message_id)
         if not email_msg:
             raise Exception(f"Original email UID {message_id} not found")
 
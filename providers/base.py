@@ -1,5 +1,5 @@
 from abc import ABC, abstractmethod
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Iterator
 from dataclasses import dataclass, field
 from datetime import datetime
 
@@ -95,3 +95,55 @@ class EmailProvider(ABC):
         unread_only: bool = False
     ) -> List[EmailMessage]:
         return []
+
+    def iter_emails(
+        self,
+        folder: str = "inbox",
+        limit: int = 50,
+        date_start: datetime = None,
+        date_end: datetime = None,
+        unread_only: bool = False
+    ) -> Iterator[EmailMessage]:
+        """Yield messages newest first. Providers that page natively override this."""
+        yield from self.list_emails(folder=folder, limit=limit, date_start=date_start,
+                                    date_end=date_end, unread_only=unread_only)
+
+    # Bulk operations. Mutations return {id: result or Exception} so one bad id
+    # doesn't fail the rest; the defaults loop over the single-message calls.
+
+    def _apply_each(self, action: str, message_ids: List[str], *args) -> dict:
+        method = getattr(self, action, None)
+        results = {}
+        for msg_id in message_ids:
+            if method is None:
+                results[msg_id] = Exception(f"{self.provider_name} does not support {action}")
+                continue
+            try:
+                results[msg_id] = method(msg_id, *args)
+            except Exception as e:
+                results[msg_id] = e
+        return results
+
+    def fetch_many(self, message_ids: List[str]) -> Dict[str, EmailMessage]:
+        """Fetch several full messages; missing/failed ids are left out."""
+        result = {}
+        for msg_id in message_ids:
+            try:
+                email_msg = self.get_message(msg_id)
+            except Exception:
+                email_msg = None
+            if email_msg:
+                result[msg_id] = email_msg
+        return result
+
+    def mark_read_many(self, message_ids: List[str]) -> dict:
+        return self._apply_each("mark_read", message_ids)
+
+    def mark_unread_many(self, message_ids: List[str]) -> dict:
+        return self._apply_each("mark_unread", message_ids)
+
+    def delete_many(self, message_ids: List[str]) -> dict:
+        return self._apply_each("delete", message_ids)
+
+    def move_many(self, message_ids: List[str], folder: str) -> dict:
+        return self._apply_each("move", message_ids, folder)
@@ -3,24 +3,66 @@ import base64
 import json
 import time
 import logging
+import random
+import threading
 from email.mime.text import MIMEText
 from typing import Optional, List
-from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from html import unescape
+from datetime import datetime, timedelta, timezone
 
 from google.oauth2.credentials import Credentials
 from google.auth.transport.requests import Request
 from google_auth_oauthlib.flow import Flow
 from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
+from googleapiclient.http import HttpRequest
+import google_auth_httplib2
+import httplib2
 
 from providers.base import EmailProvider, EmailMessage, DebugStatus
 from utils.text import html_to_text, parse_email_address, normalize_email_text
 from store import get_item, set_item, get_gmail_token, set_gmail_token
 from llm import draft_reply
+from policy_engine import header_class
 
 logger = logging.getLogger(__name__)
 
 SCOPES = ['https://www.googleapis.com/auth/gmail.modify', 'https://www.googleapis.com/auth/gmail.send']
 
+# Refresh the access token this many seconds before it expires.
+GMAIL_REFRESH_MARGIN_S = int(os.getenv("GMAIL_REFRESH_MARGIN_S", "300"))
+GMAIL_HTTP_TIMEOUT_S = int(os.getenv("GMAIL_HTTP_TIMEOUT_S", "30"))
+# Optional API root override (e.g. a local stand-in for benchmarks).
+GMAIL_API_ENDPOINT = os.getenv("GMAIL_API_ENDPOINT")
+# messages.get batches are capped at 100 sub-requests by the API.
+GMAIL_BATCH_SIZE = min(int(os.getenv("GMAIL_BATCH_SIZE", "100")), 100)
+GMAIL_BATCH_CONCURRENCY = int(os.getenv("GMAIL_BATCH_CONCURRENCY", "4"))
+GMAIL_BATCH_RETRIES = int(os.getenv("GMAIL_BATCH_RETRIES", "3"))
+GMAIL_RETRY_BASE_S = float(os.getenv("GMAIL_RETRY_BASE_MS", "500")) / 1000.0
+
+# List views only need headers + snippet; full bodies are fetched on open.
+LIST_METADATA_HEADERS = [
+    'From', 'Subject', 'Date',
+    'List-Id', 'List-Unsubscribe', 'Auto-Submitted', 'Precedence', 'X-Auto-Response-Suppress',
+]
+LIST_FIELDS = "id,threadId,labelIds,snippet,internalDate,payload/headers"
+
+
+def _folder_labels(folder: str) -> tuple:
+    """(add, remove) label ids that move a message into folder."""
+    key = (folder or "").lower()
+    if key in ("spam", "junk"):
+        return ['SPAM'], ['INBOX']
+    if key == "trash":
+        return ['TRASH'], ['INBOX']
+    if key == "archive":
+        return [], ['INBOX']
+    if key == "inbox":
+        return ['INBOX'], ['SPAM', 'TRASH']
+    # anything else is taken as a user label id
+    return [folder], ['INBOX']
+
 
 class GmailProvider(EmailProvider):
     provider_name = "gmail"
@@ -29,6 +71,11 @@ class GmailProvider(EmailProvider):
         self.base_url = base_url
         self.client_id = os.environ.get("GMAIL_CLIENT_ID") or os.environ.get("CLIENT_ID")
         self.client_secret = os.environ.get("GMAIL_CLIENT_SECRET") or os.environ.get("CLIENT_SECRET")
+        self._service_lock = threading.RLock()
+        self._creds: Optional[Credentials] = None
+        self._service = None
+        self._service_creds: Optional[Credentials] = None
+        self._http_local = threading.local()
 
     def _require_creds(self):
         if not self.client_id or not self.client_secret:
@@ -84,6 +131,7 @@ class GmailProvider(EmailProvider):
 
         scope_str = ' '.join(list(creds.scopes)) if creds.scopes else ' '.join(SCOPES)
         
+        self.invalidate_service()
         set_gmail_token(
             access_token=creds.token,
             refresh_token=creds.refresh_token if creds.refresh_token else None,
@@ -104,7 +152,14 @@ class GmailProvider(EmailProvider):
         logger.info(f"Gmail OAuth: Token saved to SQLite. Has refresh_token: {has_refresh}")
         return {"ok": True, "message": "Gmail authenticated successfully.", "has_refresh_token": has_refresh}
 
-    def _get_service(self):
+    def invalidate_service(self):
+        """Drop the cached credentials/service (re-auth, revoked token)."""
+        with self._service_lock:
+            self._creds = None
+            self._service = None
+            self._service_creds = None
+
+    def _load_credentials(self) -> Credentials:
         token_data = get_gmail_token()
         if not token_data:
             raise Exception("Not authenticated. Go to /gmail/login")
@@ -127,39 +182,89 @@ class GmailProvider(EmailProvider):
             client_secret=token_data.get("client_secret") or self.client_secret,
             scopes=scopes,
         )
-
-        now = int(time.time())
         expiry_ts = token_data.get("expiry_ts") or 0
-        token_expired = (not creds.token) or (now >= expiry_ts - 60)
-        
-        if token_expired or creds.expired:
-            logger.info("Gmail: Access token expired, attempting refresh...")
-            try:
-                creds.refresh(Request())
-                
-                new_expiry = int(time.time()) + 3600
-                if creds.expiry:
-                    new_expiry = int(creds.expiry.timestamp())
-                
-                set_gmail_token(
-                    access_token=creds.token,
-                    expiry_ts=new_expiry,
-                    refresh_token=creds.refresh_token if creds.refresh_token else None,
-                    needs_reauth=False,
-                    preserve_refresh_token=True
-                )
-                logger.info("Gmail: Token refreshed successfully")
-            except Exception as e:
-                error_str = str(e).lower()
-                if "invalid_grant" in error_str or "token has been expired or revoked" in error_str:
-                    set_gmail_token(needs_reauth=True, last_refresh_error=str(e))
-                    raise Exception("Gmail token revoked or expired. Go to /gmail/login to re-authenticate.")
-                else:
-                    set_gmail_token(last_refresh_error=str(e))
-                    logger.error(f"Gmail: Token refresh failed: {e}")
-                    raise Exception(f"Token refresh failed: {e}. Try /gmail/login")
+        if expiry_ts:
+            # google-auth compares against naive UTC datetimes
+            creds.expiry = datetime.utcfromtimestamp(expiry_ts)
+        return creds
+
+    def _needs_refresh(self, creds: Credentials) -> bool:
+        if not creds.token or not creds.expiry:
+            return True
+        return datetime.utcnow() >= creds.expiry - timedelta(seconds=GMAIL_REFRESH_MARGIN_S)
+
+    def _refresh_credentials(self, creds: Credentials):
+        logger.info("Gmail: Access token expiring, attempting refresh...")
+        try:
+            creds.refresh(Request())
+            
+            new_expiry = int(time.time()) + 3600
+            if creds.expiry:
+                new_expiry = int(creds.expiry.replace(tzinfo=timezone.utc).timestamp())
+            
+            set_gmail_token(
+                access_token=creds.token,
+                expiry_ts=new_expiry,
+                refresh_token=creds.refresh_token if creds.refresh_token else None,
+                needs_reauth=False,
+                preserve_refresh_token=True
+            )
+            logger.info("Gmail: Token refreshed successfully")
+        except Exception as e:
+            self._creds = None
+            error_str = str(e).lower()
+            if "invalid_grant" in error_str or "token has been expired or revoked" in error_str:
+                set_gmail_token(needs_reauth=True, last_refresh_error=str(e))
+                raise Exception("Gmail token revoked or expired. Go to /gmail/login to re-authenticate.")
+            else:
+                set_gmail_token(last_refresh_error=str(e))
+                logger.error(f"Gmail: Token refresh failed: {e}")
+                raise Exception(f"Token refresh failed: {e}. Try /gmail/login")
+
+    def _get_credentials(self) -> Credentials:
+        """
+        Credentials held in memory; the token store is only read on first use
+        (or after invalidate_service) and only written when a refresh happens.
+        """
+        with self._service_lock:
+            creds = self._creds
+            if creds is None:
+                creds = self._load_credentials()
+            if self._needs_refresh(creds):
+                self._refresh_credentials(creds)
+            self._creds = creds
+            return creds
+
+    def _thread_http(self, creds: Credentials):
+        # httplib2.Http is not thread-safe: one authorized, keep-alive
+        # connection per thread, reused for every call made on that thread.
+        http = getattr(self._http_local, "http", None)
+        if http is None or http.credentials is not creds:
+            http = google_auth_httplib2.AuthorizedHttp(
+                creds, http=httplib2.Http(timeout=GMAIL_HTTP_TIMEOUT_S)
+            )
+            self._http_local.http = http
+        return http
 
-        return build('gmail', 'v1', credentials=creds)
+    def _get_service(self):
+        creds = self._get_credentials()
+        with self._service_lock:
+            if self._service is not None and self._service_creds is creds:
+                return self._service
+
+            def _request_builder(_http, *args, **kwargs):
+                return HttpRequest(self._thread_http(creds), *args, **kwargs)
+
+            options = {"api_endpoint": GMAIL_API_ENDPOINT} if GMAIL_API_ENDPOINT else None
+            self._service = build(
+                'gmail', 'v1',
+                credentials=creds,
+                requestBuilder=_request_builder,
+                cache_discovery=False,
+                client_options=options,
+            )
+            self._service_creds = creds
+            return self._service
 
     def _parse_message(self, message: dict) -> EmailMessage:
         payload = message.get('payload', {})
@@ -198,7 +303,7 @@ class GmailProvider(EmailProvider):
         clean_body = normalize_email_text(body)
         clean_subject = normalize_email_text(subject)
 
-        return EmailMessage(
+        email_msg = EmailMessage(
             id=message['id'],
             provider=self.provider_name,
             from_addr=from_addr,
@@ -206,6 +311,30 @@ class GmailProvider(EmailProvider):
             body=clean_body[:4000] if clean_body else '',
             date=date,
         )
+        email_msg.header_class = header_class({h['name'].lower(): h['value'] for h in headers})
+        return email_msg
+
+    def _parse_metadata(self, message: dict) -> EmailMessage:
+        """List-view message from a format='metadata' response; body is Gmail's snippet."""
+        headers = {
+            h['name'].lower(): h['value']
+            for h in message.get('payload', {}).get('headers', [])
+        }
+        snippet = unescape(message.get('snippet', '') or '')
+        email_msg = EmailMessage(
+            id=message['id'],
+            provider=self.provider_name,
+            from_addr=parse_email_address(headers.get('from', '')),
+            subject=normalize_email_text(headers.get('subject', '')),
+            body=snippet,
+            date=headers.get('date', ''),
+        )
+        email_msg.snippet = snippet
+        email_msg.unread = 'UNREAD' in message.get('labelIds', [])
+        email_msg.headers = headers
+        email_msg.header_class = header_class(headers)
+        email_msg.body_is_snippet = True
+        return email_msg
 
     def debug_status(self) -> DebugStatus:
         from datetime import datetime as dt
@@ -360,16 +489,8 @@ class GmailProvider(EmailProvider):
 
         return self._parse_message(full_message)
 
-    def list_emails(
-        self, 
-        folder: str = "inbox", 
-        limit: int = 50, 
-        date_start: datetime = None, 
-        date_end: datetime = None,
-        unread_only: bool = False
-    ) -> List[EmailMessage]:
-        service = self._get_service()
-        
+    def _list_query(self, folder: str, date_start: datetime = None, date_end: datetime = None,
+                    unread_only: bool = False) -> str:
         query_parts = []
         if unread_only:
             query_parts.append('is:unread')
@@ -388,68 +509,202 @@ class GmailProvider(EmailProvider):
             adjusted_end = date_end + timedelta(days=1)
             query_parts.append(f'before:{adjusted_end.strftime("%Y/%m/%d")}')
         
-        query = ' '.join(query_parts)
-        
-        results = service.users().messages().list(
-            userId='me',
-            q=query,
-            maxResults=limit
-        ).execute()
-        
-        messages = results.get('messages', [])
-        if not messages:
-            return []
-        
-        emails = []
-        fetched = {}
+        return ' '.join(query_parts)
 
-        def _on_msg(request_id, response, exception):
-            if exception is not None:
-                logging.warning(f"Gmail batch item {request_id} error: {exception}")
-            elif response:
-                fetched[request_id] = response
+    def list_emails(
+        self, 
+        folder: str = "inbox", 
+        limit: int = 50, 
+        date_start: datetime = None, 
+        date_end: datetime = None,
+        unread_only: bool = False
+    ) -> List[EmailMessage]:
+        return list(self.iter_emails(folder, limit, date_start, date_end, unread_only))
 
-        try:
-            batch = service.new_batch_http_request(callback=_on_msg)
-            for msg_ref in messages:
-                batch.add(
-                    service.users().messages().get(
-                        userId='me',
-                        id=msg_ref['id'],
-                        format='full'
-                    ),
-                    request_id=msg_ref['id']
-                )
-            batch.execute()
-            logging.info(f"Gmail batch: {len(fetched)}/{len(messages)} fetched")
-        except Exception as e:
-            logging.warning(f"Gmail batch failed ({e}), falling back to individual fetch")
-            fetched = {}
-            for msg_ref in messages:
-                try:
-                    full_message = service.users().messages().get(
-                        userId='me',
-                        id=msg_ref['id'],
-                        format='full'
-                    ).execute()
-                    if full_message:
-                        fetched[msg_ref['id']] = full_message
-                except:
-                    continue
-
-        for msg_ref in messages:
-            full_message = fetched.get(msg_ref['id'])
-            if not full_message:
+    def iter_emails(
+        self,
+        folder: str = "inbox",
+        limit: int = 50,
+        date_start: datetime = None,
+        date_end: datetime = None,
+        unread_only: bool = False
+    ):
+        """
+        Yield metadata-only messages as ids come in: every GMAIL_BATCH_SIZE *
+        GMAIL_BATCH_CONCURRENCY ids are fetched in one _batch_get round.
+        """
+        query = self._list_query(folder, date_start, date_end, unread_only)
+        round_size = GMAIL_BATCH_SIZE * max(GMAIL_BATCH_CONCURRENCY, 1)
+
+        ids = []
+        for msg_id in self.iter_message_ids(query, limit):
+            ids.append(msg_id)
+            if len(ids) >= round_size:
+                yield from self._iter_metadata(ids, folder)
+                ids = []
+        if ids:
+            yield from self._iter_metadata(ids, folder)
+
+    def _iter_metadata(self, ids: List[str], folder: str):
+        fetched = self._batch_get(
+            ids, fmt='metadata',
+            metadata_headers=LIST_METADATA_HEADERS, fields=LIST_FIELDS
+        )
+        for msg_id in ids:
+            meta_message = fetched.get(msg_id)
+            if not meta_message:
                 continue
             try:
-                email_msg = self._parse_message(full_message)
-                if email_msg:
-                    email_msg.folder = folder
-                    emails.append(email_msg)
+                email_msg = self._parse_metadata(meta_message)
             except:
                 continue
-        
-        return emails
+            if email_msg:
+                email_msg.folder = folder
+                yield email_msg
+
+    def iter_message_ids(self, query: str, limit: int = None):
+        """Yield message ids matching query, following nextPageToken until limit is reached."""
+        service = self._get_service()
+        page_token = None
+        yielded = 0
+        while True:
+            page_size = 500 if limit is None else min(500, limit - yielded)
+            if page_size <= 0:
+                return
+            kwargs = {'userId': 'me', 'q': query, 'maxResults': page_size}
+            if page_token:
+                kwargs['pageToken'] = page_token
+            results = service.users().messages().list(**kwargs).execute()
+            for msg_ref in results.get('messages', []):
+                yield msg_ref['id']
+                yielded += 1
+            page_token = results.get('nextPageToken')
+            if not page_token:
+                return
+
+    @staticmethod
+    def _is_retryable(exception) -> bool:
+        status = getattr(getattr(exception, 'resp', None), 'status', None)
+        try:
+            status = int(status)
+        except (TypeError, ValueError):
+            return False
+        return status == 429 or status >= 500
+
+    def _batch_get(self, ids: List[str], fmt: str = 'full', metadata_headers: List[str] = None,
+                   fields: str = None) -> dict:
+        """
+        Fetch messages by id; returns {id: message}. Ids are split into batches of
+        GMAIL_BATCH_SIZE run GMAIL_BATCH_CONCURRENCY at a time, and only sub-requests
+        that failed with 429/5xx are retried, with exponential backoff.
+        """
+        service = self._get_service()
+        if not ids:
+            return {}
+
+        def _request(msg_id):
+            kwargs = {'userId': 'me', 'id': msg_id, 'format': fmt}
+            if metadata_headers:
+                kwargs['metadataHeaders'] = metadata_headers
+            if fields:
+                kwargs['fields'] = fields
+            return service.users().messages().get(**kwargs)
+
+        def _fetch_chunk(chunk):
+            fetched = {}
+            pending = list(chunk)
+            for attempt in range(GMAIL_BATCH_RETRIES + 1):
+                if attempt:
+                    delay = GMAIL_RETRY_BASE_S * (2 ** (attempt - 1))
+                    time.sleep(delay + random.uniform(0, delay / 2))
+                retry = []
+
+                def _on_msg(request_id, response, exception):
+                    if exception is not None:
+                        if self._is_retryable(exception):
+                            retry.append(request_id)
+                        else:
+                            logging.warning(f"Gmail batch item {request_id} error: {exception}")
+                    elif response:
+                        fetched[request_id] = response
+
+                try:
+                    batch = service.new_batch_http_request(callback=_on_msg)
+                    for msg_id in pending:
+                        batch.add(_request(msg_id), request_id=msg_id)
+                    batch.execute()
+                except Exception as e:
+                    logging.warning(f"Gmail batch of {len(pending)} failed ({e}), attempt {attempt + 1}")
+                    retry = [m for m in pending if m not in fetched]
+                pending = retry
+                if not pending:
+                    break
+
+            if pending:
+                logging.warning(f"Gmail batch: {len(pending)} items still failing, fetching individually")
+                for msg_id in pending:
+                    try:
+                        message = _request(msg_id).execute()
+                        if message:
+                            fetched[msg_id] = message
+                    except:
+                        continue
+            return fetched
+
+        chunks = [ids[i:i + GMAIL_BATCH_SIZE] for i in range(0, len(ids), GMAIL_BATCH_SIZE)]
+        fetched = {}
+        if len(chunks) == 1:
+            fetched.update(_fetch_chunk(chunks[0]))
+        else:
+            with ThreadPoolExecutor(max_workers=min(GMAIL_BATCH_CONCURRENCY, len(chunks))) as pool:
+                for result in pool.map(_fetch_chunk, chunks):
+                    fetched.update(result)
+        logging.info(f"Gmail batch: {len(fetched)}/{len(ids)} fetched in {len(chunks)} batch(es)")
+        return fetched
+
+    def get_history_id(self) -> str:
+        """Current mailbox historyId (starting point for incremental sync)."""
+        service = self._get_service()
+        profile = service.users().getProfile(userId='me').execute()
+        return str(profile.get('historyId', ''))
+
+    def list_history(self, start_history_id: str, max_pages: int = 20) -> Optional[dict]:
+        """
+        Changes since start_history_id via users.history.list.
+        Returns None when a full sync is needed: the history id is too old (HTTP 404)
+        or the backlog is longer than max_pages.
+        """
+        service = self._get_service()
+        records = []
+        history_id = start_history_id
+        page_token = None
+        requests_made = 0
+        for _ in range(max_pages):
+            kwargs = {
+                'userId': 'me',
+                'startHistoryId': start_history_id,
+                'historyTypes': ['messageAdded', 'messageDeleted', 'labelAdded', 'labelRemoved'],
+                'maxResults': 500,
+            }
+            if page_token:
+                kwargs['pageToken'] = page_token
+            try:
+                result = service.users().history().list(**kwargs).execute()
+            except HttpError as e:
+                if getattr(e, 'resp', None) is not None and e.resp.status == 404:
+                    logger.info(f"Gmail: historyId {start_history_id} expired, full sync required")
+                    return None
+                raise
+            requests_made += 1
+            records.extend(result.get('history', []))
+            history_id = str(result.get('historyId') or history_id)
+            page_token = result.get('nextPageToken')
+            if not page_token:
+                break
+        if page_token:
+            logger.info("Gmail: history backlog exceeds page budget, full sync required")
+            return None
+        return {"history_id": history_id, "records": records, "requests": requests_made}
 
     def get_message(self, message_id: str) -> Optional[EmailMessage]:
         service = self._get_service()
@@ -464,6 +719,16 @@ class GmailProvider(EmailProvider):
         except:
             return None
 
+    def fetch_many(self, message_ids: List[str]) -> dict:
+        """Full messages for several ids through batched messages.get; failed ids are left out."""
+        result = {}
+        for msg_id, message in self._batch_get(message_ids, fmt='full').items():
+            try:
+                result[msg_id] = self._parse_message(message)
+            except Exception as e:
+                logger.warning(f"[GMAIL] could not parse {msg_id}: {e}")
+        return result
+
     def suggest_reply(self, message_id: str) -> dict:
         email_msg = self.get_message(message_id)
         if not email_msg:
@@ -486,17 +751,20 @@ class GmailProvider(EmailProvider):
         }
 
     def send(self, message_id: str) -> dict:
-        service = self._get_service()
-
         draft = get_item(f"gmail_draft:{message_id}")
         if not draft:
             raise Exception(f"No draft found for message {message_id}")
+        return self.send_reply(message_id, draft)
 
-        email_msg = self.get_message(message_id)
+    def send_reply(self, message_id: str, body: str, original: Optional[EmailMessage] = None) -> dict:
+        """Reply to the sender; pass original when the message is already fetched."""
+        service = self._get_service()
+
+        email_msg = original or self.get_message(message_id)
         if not email_msg:
             raise Exception(f"Original email {message_id} not found")
 
-        message = MIMEText(draft, 'plain', 'utf-8')
+        message = MIMEText(body, 'plain', 'utf-8')
         message['to'] = email_msg.from_addr
         message['subject'] = f"Re: {email_msg.subject}"
 
@@ -556,6 +824,51 @@ class GmailProvider(EmailProvider):
         ).execute()
         return {"ok": True, "id": message_id}
 
+    def _batch_modify(self, message_ids: List[str], add_labels: List[str] = None,
+                      remove_labels: List[str] = None, result_extra: dict = None) -> dict:
+        """users.messages.batchModify in chunks of 1,000 ids; returns {id: result or Exception}."""
+        service = self._get_service()
+        results = {}
+        for i in range(0, len(message_ids), 1000):
+            chunk = message_ids[i:i + 1000]
+            body = {'ids': chunk}
+            if add_labels:
+                body['addLabelIds'] = add_labels
+            if remove_labels:
+                body['removeLabelIds'] = remove_labels
+            try:
+                service.users().messages().batchModify(userId='me', body=body).execute()
+                for msg_id in chunk:
+                    results[msg_id] = {"ok": True, "id": msg_id, **(result_extra or {})}
+            except Exception as e:
+                logger.error(f"[GMAIL][BATCH_MODIFY] {len(chunk)} ids failed: {e}")
+                for msg_id in chunk:
+                    results[msg_id] = e
+        return results
+
+    def mark_read_many(self, message_ids: List[str]) -> dict:
+        return self._batch_modify(message_ids, remove_labels=['UNREAD'])
+
+    def mark_unread_many(self, message_ids: List[str]) -> dict:
+        return self._batch_modify(message_ids, add_labels=['UNREAD'])
+
+    def delete_many(self, message_ids: List[str]) -> dict:
+        """Move messages to Trash (TRASH label), like delete()."""
+        logger.info(f"[GMAIL][DELETE] bulk request count={len(message_ids)}")
+        return self._batch_modify(message_ids, add_labels=['TRASH'],
+                                  result_extra={"gmail_result": "trashed"})
+
+    def move(self, message_id: str, folder: str) -> dict:
+        result = self.move_many([message_id], folder)[message_id]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def move_many(self, message_ids: List[str], folder: str) -> dict:
+        add_labels, remove_labels = _folder_labels(folder)
+        return self._batch_modify(message_ids, add_labels=add_labels, remove_labels=remove_labels,
+                                  result_extra={"folder": folder})
+
     def get_message_labels(self, message_id: str) -> dict:
         """Get labels for a specific message (for debug purposes)"""
         service = self._get_service()
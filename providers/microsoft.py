@@ -1,11 +1,46 @@
 import os
-from typing import Optional
+import logging
+from datetime import datetime, timezone
+from typing import Optional, List, Dict, Iterator
+
+import requests
 
 from providers.base import EmailProvider, EmailMessage, DebugStatus
 from utils.text import html_to_text
-from graph import graph_get, graph_post, graph_patch, graph_delete
+from graph import graph_get, graph_post, graph_patch, graph_delete, graph_batch, batch_error
 from store import get_item, set_item
 from llm import draft_reply
+from policy_engine import header_class
+
+logger = logging.getLogger(__name__)
+
+# Ask Graph for plain-text bodies so we don't run html_to_text locally.
+PREFER_TEXT = {"Prefer": 'outlook.body-content-type="text"'}
+LIST_SELECT = "id,subject,from,receivedDateTime,bodyPreview,isRead"
+# List views also pull the message headers so header_class needs no body fetch (not used for delta).
+LIST_SELECT_HEADERS = LIST_SELECT + ",internetMessageHeaders"
+MS_PAGE_SIZE = int(os.getenv("MS_PAGE_SIZE", "100"))
+MS_DELTA_INITIAL_DAYS = int(os.getenv("MS_DELTA_INITIAL_DAYS", "30"))
+MS_DELTA_MAX_PAGES = int(os.getenv("MS_DELTA_MAX_PAGES", "50"))
+
+# Well-known folder names accepted as destinationId by /move.
+MOVE_DESTINATIONS = {
+    "inbox": "inbox",
+    "spam": "junkemail",
+    "junk": "junkemail",
+    "trash": "deleteditems",
+    "archive": "archive",
+}
+
+
+def _folder_path(folder: str) -> str:
+    return "junkemail" if (folder or "").lower() in ["spam", "junk"] else "inbox"
+
+
+def _graph_time(dt: datetime) -> str:
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc)
+    return dt.strftime("%Y-%m-%dT%H:%M:%SZ")
 
 
 class MicrosoftProvider(EmailProvider):
@@ -17,27 +52,25 @@ class MicrosoftProvider(EmailProvider):
     def debug_status(self) -> DebugStatus:
         token = self.get_token()
         
-        user = graph_get(token, "/me", params={"$select": "mail,displayName"})
-        email = user.get("mail", user.get("userPrincipalName", "unknown"))
-
-        folders_data = graph_get(token, "/me/mailFolders", params={"$top": "50"})
-        folders = [f.get("displayName", "") for f in folders_data.get("value", [])]
+        me, folders_res, inbox_res, junk_res = graph_batch(token, [
+            {"method": "GET", "url": "/me?$select=mail,displayName,userPrincipalName"},
+            {"method": "GET", "url": "/me/mailFolders?$top=50"},
+            {"method": "GET", "url": "/me/mailFolders/inbox?$select=totalItemCount,unreadItemCount"},
+            {"method": "GET", "url": "/me/mailFolders/junkemail?$select=totalItemCount,unreadItemCount"},
+        ])
+        for res in (me, folders_res, inbox_res):
+            err = batch_error(res)
+            if err:
+                raise err
 
-        inbox_data = graph_get(
-            token,
-            "/me/mailFolders/inbox",
-            params={"$select": "totalItemCount,unreadItemCount"}
-        )
+        user = me["body"]
+        email = user.get("mail", user.get("userPrincipalName", "unknown"))
+        folders = [f.get("displayName", "") for f in folders_res["body"].get("value", [])]
+        inbox_data = inbox_res["body"]
 
         junk_data = {"totalItemCount": 0, "unreadItemCount": 0}
-        try:
-            junk_data = graph_get(
-                token,
-                "/me/mailFolders/junkemail",
-                params={"$select": "totalItemCount,unreadItemCount"}
-            )
-        except:
-            pass
+        if batch_error(junk_res) is None:
+            junk_data = junk_res["body"]
 
         return DebugStatus(
             connection="OK",
@@ -51,7 +84,7 @@ class MicrosoftProvider(EmailProvider):
 
     def queue_next(self, folder: str = "inbox") -> Optional[EmailMessage]:
         token = self.get_token()
-        folder_path = "junkemail" if folder.lower() in ["spam", "junk"] else "inbox"
+        folder_path = _folder_path(folder)
 
         data = graph_get(
             token,
@@ -62,13 +95,16 @@ class MicrosoftProvider(EmailProvider):
                 "$filter": "isRead eq false",
                 "$select": "id,subject,from,receivedDateTime,body",
             },
+            headers=PREFER_TEXT,
         )
 
         items = data.get("value", [])
         if not items:
             return None
 
-        m = items[0]
+        return self._to_email(items[0])
+
+    def _to_email(self, m: dict) -> EmailMessage:
         body_content = (m.get("body") or {}).get("content", "")
         body_type = (m.get("body") or {}).get("contentType", "text")
 
@@ -91,25 +127,192 @@ class MicrosoftProvider(EmailProvider):
             m = graph_get(
                 token,
                 f"/me/messages/{message_id}",
-                params={"$select": "id,subject,from,receivedDateTime,body"}
+                params={"$select": "id,subject,from,receivedDateTime,body"},
+                headers=PREFER_TEXT,
             )
         except:
             return None
 
-        body_content = (m.get("body") or {}).get("content", "")
-        body_type = (m.get("body") or {}).get("contentType", "text")
-
-        if body_type.lower() == "html":
-            body_content = html_to_text(body_content)
+        return self._to_email(m)
 
-        return EmailMessage(
+    def _list_item(self, m: dict, folder: str) -> EmailMessage:
+        preview = m.get("bodyPreview", "") or ""
+        email_msg = EmailMessage(
             id=m["id"],
             provider=self.provider_name,
             from_addr=(m.get("from") or {}).get("emailAddress", {}).get("address", ""),
-            subject=m.get("subject", ""),
-            body=body_content[:4000] if body_content else "",
+            subject=m.get("subject", "") or "",
+            body=preview,
             date=m.get("receivedDateTime", ""),
+            folder=folder,
         )
+        email_msg.snippet = preview
+        email_msg.unread = not m.get("isRead", False)
+        email_msg.header_class = header_class(
+            {h.get("name", "").lower(): h.get("value", "") for h in m.get("internetMessageHeaders") or []}
+        )
+        email_msg.body_is_snippet = True
+        return email_msg
+
+    def list_emails(
+        self,
+        folder: str = "inbox",
+        limit: int = 50,
+        date_start: datetime = None,
+        date_end: datetime = None,
+        unread_only: bool = False
+    ) -> List[EmailMessage]:
+        return list(self.iter_emails(folder, limit, date_start, date_end, unread_only))
+
+    def iter_emails(
+        self,
+        folder: str = "inbox",
+        limit: int = 50,
+        date_start: datetime = None,
+        date_end: datetime = None,
+        unread_only: bool = False
+    ) -> Iterator[EmailMessage]:
+        """Newest first, one page at a time following @odata.nextLink; bodies come from bodyPreview."""
+        token = self.get_token()
+
+        filters = []
+        if date_start:
+            filters.append(f"receivedDateTime ge {_graph_time(date_start)}")
+        if date_end:
+            filters.append(f"receivedDateTime le {_graph_time(date_end)}")
+        if unread_only:
+            filters.append("isRead eq false")
+
+        params = {
+            "$select": LIST_SELECT_HEADERS,
+            "$top": str(min(limit, MS_PAGE_SIZE)),
+            "$orderby": "receivedDateTime desc",
+        }
+        if filters:
+            params["$filter"] = " and ".join(filters)
+
+        yielded = 0
+        path = f"/me/mailFolders/{_folder_path(folder)}/messages"
+        while path and yielded < limit:
+            data = graph_get(token, path, params=params, headers=PREFER_TEXT)
+            for m in data.get("value", []):
+                if yielded >= limit:
+                    return
+                yield self._list_item(m, folder)
+                yielded += 1
+            path = data.get("@odata.nextLink")
+            params = None  # nextLink already carries the query
+
+    def delta_messages(self, folder: str = "inbox", delta_link: str = None) -> Optional[dict]:
+        """
+        Changes in a folder via /messages/delta. Without a delta_link this is the
+        initial round (last MS_DELTA_INITIAL_DAYS). Returns None if the delta
+        token expired (410) and the caller must start over.
+        """
+        token = self.get_token()
+        headers = {"Prefer": f"odata.maxpagesize={MS_PAGE_SIZE}"}
+        if delta_link:
+            path, params = delta_link, None
+        else:
+            since = datetime.now(timezone.utc).timestamp() - MS_DELTA_INITIAL_DAYS * 86400
+            path = f"/me/mailFolders/{_folder_path(folder)}/messages/delta"
+            params = {
+                "$select": LIST_SELECT,
+                "$filter": f"receivedDateTime ge {_graph_time(datetime.fromtimestamp(since, timezone.utc))}",
+            }
+
+        changed, removed = [], []
+        requests_made = 0
+        new_delta_link = None
+        try:
+            for _ in range(MS_DELTA_MAX_PAGES):
+                data = graph_get(token, path, params=params, headers=headers)
+                requests_made += 1
+                for m in data.get("value", []):
+                    if "@removed" in m:
+                        removed.append(m["id"])
+                    else:
+                        changed.append(m)
+                new_delta_link = data.get("@odata.deltaLink")
+                path, params = data.get("@odata.nextLink"), None
+                if not path:
+                    break
+        except requests.HTTPError as e:
+            if e.response is not None and e.response.status_code == 410:
+                logger.info(f"Graph delta token expired for {folder}, restarting")
+                return None
+            raise
+
+        return {
+            "changed": [self._list_item(m, folder) for m in changed],
+            "removed": removed,
+            # nextLink when the page budget ran out; the next sync resumes from there
+            "delta_link": new_delta_link or path,
+            "requests": requests_made,
+        }
+
+    def fetch_many(self, message_ids: List[str]) -> Dict[str, EmailMessage]:
+        """Fetch several messages through $batch; missing/failed ids are left out."""
+        token = self.get_token()
+        responses = graph_batch(token, [
+            {"method": "GET", "url": f"/me/messages/{mid}?$select=id,subject,from,receivedDateTime,body",
+             "headers": PREFER_TEXT}
+            for mid in message_ids
+        ])
+        result = {}
+        for mid, res in zip(message_ids, responses):
+            if batch_error(res) is None:
+                result[mid] = self._to_email(res["body"])
+        return result
+
+    def _batch_results(self, message_ids: List[str], responses: list) -> dict:
+        results = {}
+        for mid, res in zip(message_ids, responses):
+            err = batch_error(res)
+            results[mid] = err if err else {"ok": True, "id": mid}
+        return results
+
+    def _patch_many(self, message_ids: List[str], body: dict) -> dict:
+        token = self.get_token()
+        responses = graph_batch(token, [
+            {"method": "PATCH", "url": f"/me/messages/{mid}", "body": body}
+            for mid in message_ids
+        ])
+        return self._batch_results(message_ids, responses)
+
+    def mark_read_many(self, message_ids: List[str]) -> dict:
+        return self._patch_many(message_ids, {"isRead": True})
+
+    def mark_unread_many(self, message_ids: List[str]) -> dict:
+        return self._patch_many(message_ids, {"isRead": False})
+
+    def delete_many(self, message_ids: List[str]) -> dict:
+        token = self.get_token()
+        responses = graph_batch(token, [
+            {"method": "DELETE", "url": f"/me/messages/{mid}"} for mid in message_ids
+        ])
+        return self._batch_results(message_ids, responses)
+
+    def move(self, message_id: str, folder: str) -> dict:
+        result = self.move_many([message_id], folder)[message_id]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def move_many(self, message_ids: List[str], folder: str) -> dict:
+        """POST /messages/{id}/move through $batch; Graph gives moved messages a new id."""
+        token = self.get_token()
+        destination = MOVE_DESTINATIONS.get((folder or "").lower(), folder)
+        responses = graph_batch(token, [
+            {"method": "POST", "url": f"/me/messages/{mid}/move", "body": {"destinationId": destination}}
+            for mid in message_ids
+        ])
+        results = {}
+        for mid, res in zip(message_ids, responses):
+            err = batch_error(res)
+            results[mid] = err if err else {"ok": True, "id": mid, "new_id": res["body"].get("id"),
+                                            "folder": folder}
+        return results
 
     def suggest_reply(self, message_id: str) -> dict:
         email_msg = self.get_message(message_id)
@@ -133,19 +336,23 @@ class MicrosoftProvider(EmailProvider):
         }
 
     def send(self, message_id: str) -> dict:
-        token = self.get_token()
         raw = get_item(f"draft:{message_id}")
         if not raw:
             raise Exception("No draft found")
+        return self.send_reply(message_id, raw)
 
-        email_msg = self.get_message(message_id)
+    def send_reply(self, message_id: str, body: str, original: Optional[EmailMessage] = None) -> dict:
+        """Reply to the sender; pass original when the message is already fetched."""
+        token = self.get_token()
+
+        email_msg = original or self.get_message(message_id)
         if not email_msg:
             raise Exception(f"Original email {message_id} not found")
 
         payload = {
             "message": {
                 "subject": f"RE: {email_msg.subject}",
-                "body": {"contentType": "Text", "content": raw},
+                "body": {"contentType": "Text", "content": body},
                 "toRecipients": [{"emailAddress": {"address": email_msg.from_addr}}],
             },
             "saveToSentItems": True,
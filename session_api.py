@@ -1,19 +1,29 @@
 import os
 import json
+import asyncio
 from datetime import datetime, timedelta, timezone
+from functools import partial
 from typing import Optional, List, Dict, Any
 from fastapi import APIRouter, HTTPException, Header, Depends, Query, Request
+from fastapi.responses import StreamingResponse, JSONResponse, Response
 from pydantic import BaseModel
 
 from db import (
     init_db, get_message, get_draft, make_key,
     create_session, get_session, get_open_session, close_session,
-    add_session_item, get_session_items, get_session_item_count,
+    add_session_items, get_session_items, get_session_item_count,
     add_queued_action, get_queued_actions, update_action_status,
-    link_message_to_session, mark_status, log_action,
-    snapshot_save, snapshot_get_latest, snapshot_cleanup,
+    mark_status, log_action, upsert_messages, split_key,
+    register_aliases, existing_message_keys,
+    snapshot_save, snapshot_get_latest, snapshot_get_by_filter, snapshot_cleanup,
 )
-from assistant_loop import load_policy, classify_email, safe_extract_text
+from assistant_loop import load_policy, classify_batch, safe_extract_text
+from mail_sync import hydrate_message_body, local_emails
+import bulk_actions
+import async_providers
+from listing import Listing, TopK, listing_counts, merge_top_k, message_ts, newest_first
+from policy_engine import CATEGORY_NAMES, classify_many
+from priority_model import SORT_OPTIONS, score_items, sort_items
 from time_filters import period_to_range, get_date_range_info
 
 router = APIRouter()
@@ -57,6 +67,8 @@ class SessionStartRequest(BaseModel):
     from_date: Optional[str] = None
     to_date: Optional[str] = None
     max_per_provider: int = 50
+    source: str = "live"
+    wait: bool = False
 
 
 class PlanAction(BaseModel):
@@ -85,8 +97,137 @@ def _get_date_range(date_mode: str, rolling_days: int = 7, from_date: str = None
     return (info["start_utc"], info["end_utc"])
 
 
+SESSION_START_WORKERS = int(os.getenv("SESSION_START_WORKERS", "6"))
+SESSION_JOB_TTL_S = int(os.getenv("SESSION_JOB_TTL_S", "3600"))
+
+# job_id -> progress dict (see _session_progress)
+_session_jobs: Dict[str, Dict] = {}
+
+
+def _session_progress(job: Dict) -> Dict:
+    import time as _time
+    end = job["finished"] or _time.time()
+    return {
+        "job_id": job["job_id"],
+        "session_id": job["session_id"],
+        "status": job["status"],
+        "done_jobs": job["done_jobs"],
+        "total_jobs": job["total_jobs"],
+        "counts": dict(job["counts"]),
+        "errors": list(job["errors"]),
+        "elapsed_s": round(end - job["started"], 3),
+    }
+
+
+def _ingest_folder(job: Dict, request: SessionStartRequest, prov_name: str, folder: str,
+                   date_start, date_end, policy: dict):
+    """List one provider/folder, classify, and write it to the session in two transactions."""
+    if request.source == "local":
+        emails = local_emails(prov_name, folder, date_start, date_end, limit=request.max_per_provider,
+                              providers=_providers_map)
+    else:
+        emails = _providers_map[prov_name].list_emails(
+            folder=folder,
+            limit=request.max_per_provider,
+            date_start=date_start,
+            date_end=date_end,
+            unread_only=False
+        )
+
+    dicts = [email_msg.to_dict() for email_msg in emails]
+    bodies = [safe_extract_text(d.get("body", "")) for d in dicts]
+    header_classes = [getattr(m, "header_class", None) for m in emails]
+    classifications = classify_batch(
+        [(d.get("from", ""), d.get("subject", ""), body_text) for d, body_text in zip(dicts, bodies)], policy,
+        header_classes=header_classes,
+    )
+
+    rows = []
+    items = []
+    for email_msg, email_dict, body_text, classification, hc in zip(emails, dicts, bodies, classifications,
+                                                                    header_classes):
+        msg_id = email_dict.get("id", "")
+        key = make_key(prov_name, msg_id, folder)
+
+        from_addr = email_dict.get("from", "")
+        subject = email_dict.get("subject", "")
+        date_str = email_dict.get("date", "")
+
+        category = classification.get("category", "UNKNOWN")
+
+        rows.append({
+            "key": key,
+            "provider": prov_name,
+            "msg_id": msg_id,
+            "folder": folder,
+            "from_addr": from_addr,
+            "subject": subject,
+            "date": date_str,
+            "body": None if getattr(email_msg, "body_is_snippet", False) else body_text,
+            "status": "classified",
+            "category": category,
+            "priority": classification.get("priority", "normal"),
+            "header_class": hc,
+        })
+        items.append({
+            "key": key,
+            "provider": prov_name,
+            "message_id": msg_id,
+            "date": date_str,
+            "classification": category,
+            "subject": subject,
+            "sender": from_addr,
+        })
+
+    upsert_messages(rows)
+    add_session_items(job["session_id"], items)
+    return len(items)
+
+
+def _run_session_ingest(job: Dict, request: SessionStartRequest, date_start, date_end):
+    """Every provider x folder at once (bounded by SESSION_START_WORKERS); progress lands in job."""
+    import logging
+    import time as _time
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+
+    policy = load_policy()
+    pairs = [(p, f) for p in request.providers if p in _providers_map for f in request.folders]
+    try:
+        with ThreadPoolExecutor(max_workers=max(min(len(pairs), SESSION_START_WORKERS), 1)) as pool:
+            futures = {
+                pool.submit(_ingest_folder, job, request, prov_name, folder, date_start, date_end, policy):
+                    (prov_name, folder)
+                for prov_name, folder in pairs
+            }
+            for future in as_completed(futures):
+                prov_name, folder = futures[future]
+                try:
+                    added = future.result()
+                    job["counts"][prov_name] += added
+                    job["counts"]["total"] += added
+                except Exception as e:
+                    logging.warning(f"Session {job['session_id']}: {prov_name}/{folder} failed: {e}")
+                    job["errors"].append({"provider": prov_name, "folder": folder, "error": str(e)})
+                job["done_jobs"] += 1
+        job["status"] = "done"
+    except Exception as e:
+        job["errors"].append({"provider": None, "folder": None, "error": str(e)})
+        job["status"] = "error"
+    finally:
+        job["finished"] = _time.time()
+
+
 @router.post("/session/start")
 def session_start(request: SessionStartRequest, _: bool = Depends(check_api_key)):
+    """
+    Open a session and ingest its messages. All provider/folder listings run
+    concurrently in a background thread and the call returns the job_id at
+    once; follow it with GET /session/start/{job_id}. wait=true blocks until
+    the ingest is done instead. Jobs live in this process's _session_jobs only:
+    another worker (or a restart) doesn't know them.
+    """
+    import threading
+    import time as _time
     init_db()
     
     now = datetime.now(timezone.utc)
@@ -103,75 +244,41 @@ def session_start(request: SessionStartRequest, _: bool = Depends(check_api_key)
     import logging
     logging.info(f"Session {session_id} filters: date_mode={request.date_mode}, rolling_days={request.rolling_days}, from={request.from_date}, to={request.to_date}")
     logging.info(f"Session {session_id} date range: {date_start.isoformat()} to {date_end.isoformat()}")
-    
-    policy = load_policy()
-    counts = {}
-    total = 0
-    
-    for prov_name in request.providers:
-        if prov_name not in _providers_map:
-            continue
-        
-        provider = _providers_map[prov_name]
-        prov_count = 0
-        
-        for folder in request.folders:
-            try:
-                emails = provider.list_emails(
-                    folder=folder,
-                    limit=request.max_per_provider,
-                    date_start=date_start,
-                    date_end=date_end,
-                    unread_only=False
-                )
-                
-                for email_msg in emails:
-                    email_dict = email_msg.to_dict()
-                    msg_id = email_dict.get("id", "")
-                    key = make_key(prov_name, msg_id)
-                    
-                    from_addr = email_dict.get("from", "")
-                    subject = email_dict.get("subject", "")
-                    body = email_dict.get("body", "")
-                    body_text = safe_extract_text(body)
-                    date_str = email_dict.get("date", "")
-                    
-                    classification = classify_email(from_addr, subject, body_text, policy)
-                    category = classification.get("category", "UNKNOWN")
-                    
-                    from db import upsert_message
-                    upsert_message(
-                        key=key,
-                        provider=prov_name,
-                        msg_id=msg_id,
-                        folder=folder,
-                        from_addr=from_addr,
-                        subject=subject,
-                        date=date_str,
-                        body=body_text,
-                        status="classified",
-                        category=category,
-                        priority=classification.get("priority", "normal")
-                    )
-                    
-                    link_message_to_session(key, session_id)
-                    add_session_item(session_id, key, prov_name, msg_id, date_str, category, subject, from_addr)
-                    
-                    prov_count += 1
-                    total += 1
-                    
-            except Exception as e:
-                continue
-        
-        counts[prov_name] = prov_count
-    
-    counts["total"] = total
-    
-    return {
+
+    started = _time.time()
+    for job_id, old in list(_session_jobs.items()):
+        if old["finished"] and started - old["finished"] > SESSION_JOB_TTL_S:
+            _session_jobs.pop(job_id, None)
+
+    providers = [p for p in request.providers if p in _providers_map]
+    job = {
+        "job_id": f"ingest_{session_id}",
         "session_id": session_id,
-        "reused": False,
-        "counts": counts
+        "status": "running",
+        "started": started,
+        "finished": None,
+        "done_jobs": 0,
+        "total_jobs": len(providers) * len(request.folders),
+        "counts": {**{p: 0 for p in providers}, "total": 0},
+        "errors": [],
     }
+    _session_jobs[job["job_id"]] = job
+
+    if request.wait:
+        _run_session_ingest(job, request, date_start, date_end)
+    else:
+        threading.Thread(target=_run_session_ingest, args=(job, request, date_start, date_end),
+                         daemon=True, name=f"session-ingest-{session_id}").start()
+    return {"session_id": session_id, "reused": False, **_session_progress(job)}
+
+
+@router.get("/session/start/{job_id}")
+def session_start_progress(job_id: str, _: bool = Depends(check_api_key)):
+    """Progress of a session ingest: per-provider counts, errors, elapsed time."""
+    job = _session_jobs.get(job_id)
+    if not job:
+        raise HTTPException(404, f"Unknown ingest job: {job_id}")
+    return _session_progress(job)
 
 
 @router.get("/session/{session_id}/items")
@@ -382,6 +489,7 @@ def assistant_email(key: str, _: bool = Depends(check_api_key)):
     msg = get_message(key)
     if not msg:
         raise HTTPException(404, f"Email not found: {key}")
+    msg = hydrate_message_body(msg, _providers_map)
     
     draft = get_draft(key)
     
@@ -452,66 +560,57 @@ def automation_execute(request: ExecuteRequest, _: bool = Depends(check_api_key)
     
     actions = get_queued_actions(session_id, request.max_actions)
     
-    executed = 0
-    failed = 0
-    details = []
-    
     send_actions = [a for a in actions if a["action"] == "send"]
     mark_read_actions = [a for a in actions if a["action"] == "mark_read"]
     delete_actions = [a for a in actions if a["action"] == "delete"]
     skip_actions = [a for a in actions if a["action"] == "skip"]
     
-    for action in send_actions:
-        result = _execute_action(action, request.dry_run)
-        details.append(result)
-        if result["status"] == "success":
-            executed += 1
-        else:
-            failed += 1
-    
-    for action in mark_read_actions:
-        result = _execute_action(action, request.dry_run)
-        details.append(result)
-        if result["status"] == "success":
-            executed += 1
-        else:
-            failed += 1
-    
-    for action in delete_actions:
-        result = _execute_action(action, request.dry_run)
-        details.append(result)
-        if result["status"] == "success":
-            executed += 1
-        else:
-            failed += 1
-    
-    for action in skip_actions:
-        result = _execute_action(action, request.dry_run)
-        details.append(result)
-        if result["status"] == "success":
-            executed += 1
-        else:
-            failed += 1
+    # mark_read/delete provider calls are collected while validating and run grouped afterwards
+    grouped = bulk_actions.GroupedActions(_providers_map)
+    details = [
+        _execute_action(action, request.dry_run, grouped)
+        for action in send_actions + mark_read_actions + delete_actions + skip_actions
+    ]
+    grouped.execute()
+    executed = sum(1 for d in details if d["status"] == "success")
     
     return {
         "ok": True,
         "dry_run": request.dry_run,
         "session_id": session_id,
         "executed": executed,
-        "failed": failed,
+        "failed": len(details) - executed,
         "details": details
     }
 
 
-def _execute_action(action: Dict, dry_run: bool) -> Dict:
+def _execute_done(result: Dict, key: str, provider_name: str, msg_id: str, status: str, message: str,
+                  _provider_result=None):
+    mark_status(key, status)
+    log_action(key, provider_name, msg_id, result["action"], "success", message)
+    result["status"] = "success"
+    result["message"] = message
+    update_action_status(result["action_id"], "done", message)
+
+
+def _execute_failed(result: Dict, key: str, provider_name: str, msg_id: str, error: Exception):
+    result["status"] = "failed"
+    result["message"] = str(error)
+    update_action_status(result["action_id"], "failed", str(error))
+    log_action(key, provider_name, msg_id, result["action"], "error", str(error))
+
+
+def _execute_action(action: Dict, dry_run: bool, grouped: "bulk_actions.GroupedActions" = None) -> Dict:
+    """
+    Validate and run one queued action. mark_read and confirmed deletes are added
+    to grouped (result filled in by grouped.execute()); without one they run now.
+    """
     action_id = action["id"]
     key = action["key"]
     action_type = action["action"]
     meta = json.loads(action.get("meta_json") or "{}")
     
-    parts = key.split(":", 1)
-    provider_name = parts[0] if len(parts) > 1 else ""
-    msg_id = parts[1] if len(parts) > 1 else key
+    provider_name, _folder, msg_id = split_key(key)
     
     result = {
         "action_id": action_id,
@@ -526,11 +625,16 @@ def _execute_action(action: Dict, dry_run: bool) -> Dict:
         update_action_status(action_id, "dry_run", result["message"])
         return result
     
+    run_now = grouped is None
+    if run_now:
+        grouped = bulk_actions.GroupedActions(_providers_map)
+    
     try:
         if provider_name not in _providers_map:
             raise Exception(f"Provider not available: {provider_name}")
         
         provider = _providers_map[provider_name]
+        deferred = None
         
         if action_type == "send":
             body = meta.get("body")
@@ -547,20 +651,14 @@ def _execute_action(action: Dict, dry_run: bool) -> Dict:
                 raise Exception("No body or draft available")
         
         elif action_type == "mark_read":
-            provider.mark_read(msg_id)
-            mark_status(key, "read")
-            log_action(key, provider_name, msg_id, "mark_read", "success", "Marked as read")
-            result["message"] = "Marked as read"
+            deferred = ("read", "Marked as read")
         
         elif action_type == "delete":
             msg = get_message(key)
             current_status = msg.get("status") if msg else None
             
             if current_status == "pending_delete":
-                provider.delete(msg_id)
-                mark_status(key, "deleted")
-                log_action(key, provider_name, msg_id, "delete", "success", "Email deleted")
-                result["message"] = "Email deleted"
+                deferred = ("deleted", "Email deleted")
             else:
                 mark_status(key, "pending_delete")
                 log_action(key, provider_name, msg_id, "delete", "pending", "Marked for deletion (two-step)")
@@ -571,7 +669,13 @@ def _execute_action(action: Dict, dry_run: bool) -> Dict:
             log_action(key, provider_name, msg_id, "skip", "success", "Skipped")
             result["message"] = "Skipped"
         
-        update_action_status(action_id, "done", result["message"])
+        if deferred:
+            result["status"] = "pending"
+            grouped.add(provider_name, action_type, msg_id,
+                        partial(_execute_done, result, key, provider_name, msg_id, *deferred),
+                        partial(_execute_failed, result, key, provider_name, msg_id))
+        else:
+            update_action_status(action_id, "done", result["message"])
         
     except Exception as e:
         result["status"] = "failed"
@@ -579,6 +683,8 @@ def _execute_action(action: Dict, dry_run: bool) -> Dict:
         update_action_status(action_id, "failed", str(e))
         log_action(key, provider_name, msg_id, action_type, "error", str(e))
     
+    if run_now:
+        grouped.execute()
     return result
 
 
@@ -745,8 +851,154 @@ def gmail_token_export(_: bool = Depends(check_api_key)):
     return {"ok": True, "token": safe_token}
 
 
+def _ui_item(prov_name: str, folder: str, msg, category: str = "human") -> Dict:
+    return {
+        "key": f"{prov_name}:{folder}:{msg.id}",
+        "id": msg.id,
+        "provider": prov_name,
+        "folder": folder,
+        "from": msg.from_addr,
+        "subject": msg.subject,
+        "date": msg.date.isoformat() if hasattr(msg.date, 'isoformat') else str(msg.date),
+        "snippet": (getattr(msg, 'snippet', '') or (msg.body[:200] if msg.body else '') or msg.subject)[:200],
+        "unread": getattr(msg, 'unread', True),
+        "classification": category,
+        "header_class": getattr(msg, 'header_class', None),
+        "ts": message_ts(msg),
+    }
+
+
+def _ui_job_messages(job, result, unread_only, provider_status: Dict) -> List:
+    """Newest-first messages for one (provider, folder) fetch; errors are logged and flag reauth when they look like auth."""
+    import logging
+    prov_name, folder = job
+    if isinstance(result, Exception):
+        logging.error(f"Error fetching {prov_name}/{folder}: {result}")
+        err = str(result).lower()
+        if "login" in err or "authenticat" in err or "reauth" in err:
+            provider_status.setdefault(prov_name, {})["connected"] = False
+            provider_status[prov_name]["needs_reauth"] = True
+        return []
+    msgs = newest_first(msg for msg in result if not (unread_only and not getattr(msg, 'unread', True)))
+    if isinstance(result, Listing):
+        return Listing(msgs, total=result.total, unread=result.unread)
+    return msgs
+
+
+def _ui_items(entries: List) -> List[Dict]:
+    """_ui_item for (job, msg) pairs, classified in one classify_many() pass."""
+    codes = classify_many({
+        "from": [msg.from_addr or '' for _, msg in entries],
+        "subject": [msg.subject or '' for _, msg in entries],
+        "body": [msg.body[:2000] if msg.body else '' for _, msg in entries],
+        "header_class": [getattr(msg, 'header_class', None) for _, msg in entries],
+    })["category"]
+    return [_ui_item(job[0], job[1], msg, CATEGORY_NAMES[code]) for (job, msg), code in zip(entries, codes)]
+
+
+def _ui_job_items(job, result, unread_only, provider_status: Dict) -> List[Dict]:
+    return _ui_items([(job, msg) for msg in _ui_job_messages(job, result, unread_only, provider_status)])
+
+
+def _ui_cached_items(built: Dict, entries: List) -> List[Dict]:
+    """_ui_items for (job, msg) pairs, each built and classified at most once per fetch."""
+    missing = [(job, msg) for job, msg in entries if (job[0], job[1], msg.id) not in built]
+    for (job, msg), item in zip(missing, _ui_items(missing)):
+        built[(job[0], job[1], msg.id)] = item
+    return [built[(job[0], job[1], msg.id)] for job, msg in entries]
+
+
+def _ui_top_items(per_job: Dict, counts: Dict, limit: int, built: Dict = None) -> List[Dict]:
+    """
+    k-way merge of the per-job newest-first lists; only the `limit` survivors are
+    built, classified (one classify_many pass) and scored (one priority model pass). counts cover everything
+    listed (a source that stopped paging early brings its own), by_category the loaded items.
+    """
+    built = {} if built is None else built
+    sources = [[(job, msg) for msg in msgs] for job, msgs in per_job.items()]
+    top = merge_top_k(sources, limit, key=lambda entry: message_ts(entry[1]))
+    items = score_items(_ui_cached_items(built, top))
+
+    counts["total_available"] = counts["unread"] = 0
+    for (prov_name, _folder), msgs in per_job.items():
+        total, unread = listing_counts(msgs)
+        counts["total_available"] += total
+        counts["unread"] += unread
+        counts["by_provider"][prov_name] = counts["by_provider"].get(prov_name, 0) + total
+    counts["read"] = counts["total_available"] - counts["unread"]
+
+    by_category = {}
+    for it in items:
+        cat = it.get("classification", "human")
+        by_category[cat] = by_category.get(cat, 0) + 1
+    counts["by_category"] = by_category
+    counts["loaded"] = len(items)
+    return items
+
+
+UI_MESSAGES_DEADLINE_S = float(os.getenv("UI_MESSAGES_DEADLINE_S", "3"))
+UI_PENDING_TTL_S = int(os.getenv("UI_PENDING_TTL_S", "120"))
+
+# pending_id -> {"created", "tasks": {(provider, folder): task}, "unread_only"}
+_pending_fetches: Dict[str, Dict] = {}
+
+
+def _register_pending(tasks: Dict, unread_only) -> str:
+    import uuid as _uuid
+    now = datetime.utcnow().timestamp()
+    for pid, entry in list(_pending_fetches.items()):
+        if now - entry["created"] > UI_PENDING_TTL_S:
+            for task in entry["tasks"].values():
+                task.cancel()
+            _pending_fetches.pop(pid, None)
+    pending_id = f"pend_{_uuid.uuid4().hex[:12]}"
+    _pending_fetches[pending_id] = {"created": now, "tasks": dict(tasks), "unread_only": unread_only}
+    return pending_id
+
+
+@router.get("/ui/messages/pending/{pending_id}")
+async def ui_messages_pending(
+    pending_id: str,
+    wait: float = Query(None, description="Seconds to wait for late fetches (default: deadline)"),
+    _: bool = Depends(check_api_key)
+):
+    """
+    Results of fetches that missed the /ui/messages deadline. Each finished
+    provider/folder is returned once; poll until done is true.
+    """
+    entry = _pending_fetches.get(pending_id)
+    if not entry:
+        raise HTTPException(404, "Unknown or expired pending_id")
+
+    tasks = entry["tasks"]
+    timeout = UI_MESSAGES_DEADLINE_S if wait is None else max(0.0, min(wait, UI_PENDING_TTL_S))
+    if tasks and timeout:
+        await asyncio.wait(tasks.values(), timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+    items = []
+    provider_status = {}
+    for job, task in list(tasks.items()):
+        if not task.done():
+            provider_status.setdefault(job[0], {})["pending"] = True
+            continue
+        items.extend(_ui_job_items(job, async_providers.task_result(task), entry["unread_only"], provider_status))
+        provider_status.setdefault(job[0], {}).setdefault("pending", False)
+        tasks.pop(job)
+
+    if not tasks:
+        _pending_fetches.pop(pending_id, None)
+    items.sort(key=lambda x: x["ts"], reverse=True)
+    return {
+        "items": items,
+        "provider_status": provider_status,
+        "pending": [f"{p}:{f}" for p, f in tasks],
+        "done": not tasks,
+    }
+
+
 @router.get("/ui/messages")
-def ui_messages(
+async def ui_messages(
+    request: Request,
     providers: str = Query("apple,gmail", description="Comma-separated provider names"),
     folders: str = Query("inbox", description="Comma-separated folder names"),
     range: str = Query("today", description="today|current_week|last_n_days|custom"),
@@ -756,11 +1008,29 @@ def ui_messages(
     unread_only: int = Query(0, description="1=only unread, 0=all"),
     limit: int = Query(50, description="Max emails per provider"),
     session_id: str = Query("global", description="Session ID for snapshot"),
+    stream: int = Query(0, description="1=NDJSON stream, one frame per provider/folder"),
+    refresh: int = Query(0, description="1=skip the cache and wait for (or join) a provider fetch"),
+    source: str = Query("live", description="live=providers, local=the store kept by the sync scheduler"),
+    sort: str = Query("date", description="date=newest first, priority_score=highest score first"),
     _: bool = Depends(check_api_key)
 ):
     """
     Unified messages endpoint for dashboard, PDF export, and GPT text.
     Uses consistent timezone-aware date filtering (America/Sao_Paulo).
+    With stream=1 the response is NDJSON (see _ui_stream).
+
+    Responses are cached per normalized filter set (ui_snapshots.filter_key):
+    younger than UI_CACHE_MAX_AGE_S they are served as is, up to
+    UI_CACHE_STALE_S they are served stale while a background fetch
+    revalidates. ETag / If-None-Match give 304s for unchanged results, and
+    identical fetches in flight are shared.
+
+    source=local skips the providers entirely and reads the messages table
+    the sync scheduler keeps current; provider_status carries the sync lag.
+
+    Items carry priority_score (see priority_model). sort=priority_score orders
+    the loaded items by it; which items are loaded is still decided by date.
+    Streamed batches are scored but left in arrival order.
     
     Range options:
     - today: 00:00-23:59 local time
@@ -768,8 +1038,9 @@ def ui_messages(
     - last_n_days: now - n days (use n parameter)
     - custom: start to end dates (use start/end parameters)
     """
+    if sort not in SORT_OPTIONS:
+        raise HTTPException(400, f"Invalid sort: {sort}. Use: {', '.join(SORT_OPTIONS)}")
     init_db()
-    from assistant_loop import classify_email as _classify
     
     date_mode = range
     if range == "last_n_days":
@@ -788,9 +1059,164 @@ def ui_messages(
     logging.info(f"UI Messages: range={range}, n={n}, date_mode={date_mode}")
     logging.info(f"UI Messages: {info['description']}")
     logging.info(f"UI Messages: UTC range {date_start.isoformat()} to {date_end.isoformat()}")
-    
-    items = []
-    counts = {"total_available": 0, "loaded": 0, "unread": 0, "by_provider": {}}
+
+    snap_filters = {
+        "range": range,
+        "n": n,
+        "start": start,
+        "end": end,
+        "unread_only": unread_only,
+    }
+    base = {
+        "filter_key": _ui_filter_key(provider_list, folder_list, snap_filters, info, limit),
+        "provider_list": provider_list,
+        "folder_list": folder_list,
+        "date_start": date_start,
+        "date_end": date_end,
+        "limit": limit,
+        "unread_only": unread_only,
+        "session_id": session_id,
+        "snap_filters": snap_filters,
+        "range_info": {
+            "filter_type": info["filter_type"],
+            "description": info["description"],
+            "tz_name": info["tz_name"],
+            "start_local": info["start_local_iso"],
+            "end_local": info["end_local_iso"],
+            "start_utc": date_start.isoformat(),
+            "end_utc": date_end.isoformat()
+        },
+    }
+
+    if source == "local":
+        response, etag = _ui_sorted(*await asyncio.to_thread(_ui_local, base), sort)
+        if stream:
+            return StreamingResponse(_ui_stream_cached(response, etag, "local", 0),
+                                     media_type="application/x-ndjson",
+                                     headers=_ui_cache_headers(etag, "local", 0))
+        return _ui_response(request, response, etag, "local", 0)
+
+    if not refresh:
+        cached = await asyncio.to_thread(snapshot_get_by_filter, base["filter_key"])
+        if cached and cached.get("response") and cached.get("etag"):
+            age = _snapshot_age(cached)
+            if age <= UI_CACHE_STALE_S:
+                state = "fresh" if age <= UI_CACHE_MAX_AGE_S else "stale"
+                if state == "stale":
+                    _ui_background(_ui_revalidate(base))
+                logging.info(f"UI Messages: cache {state} ({age:.0f}s) for {base['filter_key']}")
+                response, etag = _ui_sorted(cached["response"], cached["etag"], sort)
+                if stream:
+                    return StreamingResponse(
+                        _ui_stream_cached(response, etag, state, age),
+                        media_type="application/x-ndjson",
+                        headers=_ui_cache_headers(etag, state, age),
+                    )
+                return _ui_response(request, response, etag, state, age)
+
+    ctx = await _ui_context(base)
+    fetch = _ui_start_fetch(ctx)
+
+    if stream:
+        return StreamingResponse(_ui_stream(fetch), media_type="application/x-ndjson")
+
+    # Every provider x folder fetch runs concurrently on the event loop; whatever
+    # is not back by the deadline is handed to /ui/messages/pending/{id}.
+    await asyncio.wait([fetch["final"]], timeout=UI_MESSAGES_DEADLINE_S)
+    if fetch["final"].done():
+        response, etag = _ui_sorted(*fetch["final"].result(), sort)
+        return _ui_response(request, response, etag, "miss", 0)
+
+    tasks = fetch["tasks"]
+    provider_status = {k: dict(v) for k, v in ctx["provider_status"].items()}
+    counts = {"total_available": 0, "loaded": 0, "unread": 0, "by_provider": dict(ctx["by_provider"])}
+    late = {job: task for job, task in tasks.items() if not task.done()}
+    per_job = {job: _ui_fetch_messages(fetch, job, provider_status) for job in tasks if job not in late}
+    items = sort_items(_ui_top_items(per_job, counts, limit, fetch["built"]), sort)
+
+    pending_id = None
+    if late:
+        pending_id = _register_pending(late, unread_only)
+        for prov_name, _folder in late:
+            provider_status.setdefault(prov_name, {})["pending"] = True
+        logging.info(f"UI Messages: {len(late)} fetches past {UI_MESSAGES_DEADLINE_S}s deadline -> {pending_id}")
+
+    return {
+        "items": items,
+        "counts": counts,
+        "provider_status": provider_status,
+        "snapshot_id": None,
+        "pending_id": pending_id,
+        "pending": [f"{p}:{f}" for p, f in late],
+        "range_info": ctx["range_info"],
+    }
+
+
+UI_CACHE_MAX_AGE_S = int(os.getenv("UI_CACHE_MAX_AGE_S", "30"))
+UI_CACHE_STALE_S = int(os.getenv("UI_CACHE_STALE_S", "900"))
+
+# filter_key -> {"ctx", "tasks": {(provider, folder): task}, "messages": {...}, "built": {...}, "final": task}
+_ui_inflight: Dict[str, Dict] = {}
+_ui_background_tasks = set()
+
+
+def _ui_filter_key(provider_list: List[str], folder_list: List[str], snap_filters: Dict, info: Dict,
+                   limit: int) -> str:
+    """Same providers/folders/filters on the same local day(s) -> same key, whatever the order or case."""
+    import hashlib
+    normalized = {
+        "providers": sorted({p.lower() for p in provider_list}),
+        "folders": sorted({f.lower() for f in folder_list}),
+        "range": snap_filters["range"],
+        "days": [info["start_local_iso"][:10], info["end_local_iso"][:10]],
+        "unread_only": int(bool(snap_filters["unread_only"])),
+        "limit": limit,
+    }
+    return hashlib.sha1(json.dumps(normalized, sort_keys=True).encode()).hexdigest()[:20]
+
+
+def _ui_etag(items: List[Dict], counts: Dict) -> str:
+    import hashlib
+    body = json.dumps({"items": items, "counts": counts}, sort_keys=True, default=str)
+    return '"' + hashlib.sha1(body.encode()).hexdigest()[:24] + '"'
+
+
+def _ui_sorted(response: Dict, etag: str, sort: str):
+    """response with its items in the requested order; a non-date order gets its own ETag."""
+    if sort != "priority_score":
+        return response, etag
+    items = sort_items([dict(it) for it in response["items"]], sort)
+    return {**response, "items": items}, etag[:-1] + '-' + sort + '"'
+
+
+def _snapshot_age(snapshot: Dict) -> float:
+    try:
+        return max(0.0, (datetime.utcnow() - datetime.fromisoformat(snapshot["created_at"])).total_seconds())
+    except (KeyError, TypeError, ValueError):
+        return float("inf")
+
+
+def _ui_cache_headers(etag: str, state: str, age: float) -> Dict[str, str]:
+    return {"ETag": etag, "Age": str(int(age)), "X-Cache": state, "Cache-Control": "private, no-cache"}
+
+
+def _ui_response(request: Request, response: Dict, etag: str, state: str, age: float):
+    headers = _ui_cache_headers(etag, state, age)
+    if_none_match = request.headers.get("if-none-match") or ""
+    if etag in [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+    return JSONResponse({**response, "cache": {"state": state, "age": int(age), "etag": etag}}, headers=headers)
+
+
+def _ui_background(coro):
+    task = asyncio.ensure_future(coro)
+    _ui_background_tasks.add(task)
+    task.add_done_callback(_ui_background_tasks.discard)
+
+
+async def _ui_context(base: Dict) -> Dict:
+    """Provider status and the provider x folder jobs for a fetch."""
+    import logging
     provider_status = {}
     
     apple_email = os.getenv("APPLE_EMAIL")
@@ -802,7 +1228,7 @@ def ui_messages(
     }
     
     from store import get_gmail_token
-    gmail_token = get_gmail_token()
+    gmail_token = await asyncio.to_thread(get_gmail_token)
     gmail_connected = bool(gmail_token and gmail_token.get("refresh_token") and not gmail_token.get("needs_reauth"))
     provider_status["gmail"] = {
         "configured": bool(os.getenv("GMAIL_CLIENT_ID") or os.getenv("CLIENT_ID")),
@@ -811,132 +1237,266 @@ def ui_messages(
         "has_refresh_token": bool(gmail_token and gmail_token.get("refresh_token")) if gmail_token else False,
     }
     
-    def _fetch_provider(prov_name):
-        ps = provider_status.get(prov_name, {})
-        if not ps.get("connected", True):
+    eligible_providers = []
+    by_provider = {}
+    for prov_name in base["provider_list"]:
+        if prov_name not in _providers_map:
+            continue
+        by_provider[prov_name] = 0
+        if not provider_status.get(prov_name, {}).get("connected", True):
             logging.info(f"Skipping {prov_name}: not connected")
-            return prov_name, [], False
-        
-        provider = _providers_map[prov_name]
-        prov_items = []
-        auth_error = False
-        
-        for folder in folder_list:
-            try:
-                messages = provider.list_emails(
-                    folder=folder,
-                    date_start=date_start,
-                    date_end=date_end,
-                    limit=limit
-                )
-                
-                for msg in messages:
-                    if unread_only and not getattr(msg, 'unread', True):
-                        continue
-                    
-                    body_text = msg.body[:2000] if msg.body else ''
-                    cls = _classify(msg.from_addr or '', msg.subject or '', body_text)
-                    cat = cls.get("category", "human")
-                    
-                    item = {
-                        "key": f"{prov_name}:{folder}:{msg.id}",
-                        "id": msg.id,
-                        "provider": prov_name,
-                        "folder": folder,
-                        "from": msg.from_addr,
-                        "subject": msg.subject,
-                        "date": msg.date.isoformat() if hasattr(msg.date, 'isoformat') else str(msg.date),
-                        "snippet": (getattr(msg, 'snippet', '') or (msg.body[:200] if msg.body else '') or msg.subject)[:200],
-                        "unread": getattr(msg, 'unread', True),
-                        "classification": cat
-                    }
-                    prov_items.append(item)
-            except Exception as e:
-                logging.error(f"Error fetching {prov_name}/{folder}: {e}")
-                if "login" in str(e).lower() or "authenticat" in str(e).lower() or "reauth" in str(e).lower():
-                    auth_error = True
-        
-        return prov_name, prov_items, auth_error
+            continue
+        eligible_providers.append(prov_name)
 
-    eligible_providers = [p for p in provider_list if p in _providers_map]
-    
-    from concurrent.futures import ThreadPoolExecutor, as_completed
-    with ThreadPoolExecutor(max_workers=len(eligible_providers) or 1) as executor:
-        futures = {executor.submit(_fetch_provider, pn): pn for pn in eligible_providers}
-        for future in as_completed(futures):
-            try:
-                prov_name, prov_items, auth_error = future.result()
-                if auth_error:
-                    provider_status[prov_name]["connected"] = False
-                    provider_status[prov_name]["needs_reauth"] = True
-                counts["by_provider"][prov_name] = len(prov_items)
-                items.extend(prov_items)
-            except Exception as exc:
-                failed_prov = futures[future]
-                logging.error(f"Provider {failed_prov} thread failed: {exc}")
-                counts["by_provider"][failed_prov] = 0
-    
-    items.sort(key=lambda x: x["date"], reverse=True)
-    
-    counts["total_available"] = len(items)
-    counts["unread"] = sum(1 for it in items if it.get("unread", True))
-    counts["read"] = counts["total_available"] - counts["unread"]
-    
-    by_category = {}
-    for it in items:
-        cat = it.get("classification", "human")
-        by_category[cat] = by_category.get(cat, 0) + 1
-    counts["by_category"] = by_category
-    
-    if len(items) > limit:
-        items = items[:limit]
-    counts["loaded"] = len(items)
+    return {
+        **base,
+        "provider_status": provider_status,
+        "by_provider": by_provider,
+        "jobs": [(pn, folder) for pn in eligible_providers for folder in base["folder_list"]],
+    }
 
-    if items:
-        try:
-            import uuid as _uuid
-            snap_id = f"snap_{datetime.utcnow().strftime('%Y%m%d%H%M%S')}_{_uuid.uuid4().hex[:6]}"
-            snap_keys = [it["key"] for it in items]
-            snap_payload = []
-            for it in items:
-                snap_payload.append({
-                    "key": it["key"],
-                    "provider": it.get("provider", ""),
-                    "folder": it.get("folder", "inbox"),
-                    "from": it.get("from", ""),
-                    "subject": it.get("subject", ""),
-                    "date": it.get("date", ""),
-                    "snippet": it.get("snippet", "")[:200],
-                    "classification": it.get("classification", ""),
-                    "unread": it.get("unread", True),
-                })
-            snap_filters = {
-                "range": range,
-                "n": n,
-                "start": start,
-                "end": end,
-                "unread_only": unread_only,
-            }
-            snapshot_save(snap_id, session_id, provider_list, folder_list, snap_filters, snap_keys, snap_payload)
-            snapshot_cleanup(10)
-            logging.info(f"Snapshot saved: {snap_id} with {len(items)} items")
-        except Exception as snap_err:
-            logging.warning(f"Snapshot save failed: {snap_err}")
 
-    return {
+def _ui_start_fetch(ctx: Dict) -> Dict:
+    """Start the provider fan-out for ctx, or join the one already running for the same filter_key."""
+    import logging
+    key = ctx["filter_key"]
+    fetch = _ui_inflight.get(key)
+    if fetch and not fetch["final"].done():
+        logging.info(f"UI Messages: joining in-flight fetch for {key}")
+        return fetch
+
+    # one cut-off shared by every job, so paging providers stop once they can't reach the top `limit`
+    tasks = async_providers.start_fan_out(
+        _providers_map, ctx["jobs"],
+        date_start=ctx["date_start"], date_end=ctx["date_end"], limit=ctx["limit"],
+        unread_only=bool(ctx["unread_only"]), topk=TopK(ctx["limit"]),
+    )
+    fetch = {"ctx": ctx, "tasks": tasks, "messages": {}, "built": {}}
+    fetch["final"] = asyncio.ensure_future(_ui_build(fetch))
+    _ui_inflight[key] = fetch
+
+    def _done(_task):
+        if _ui_inflight.get(key) is fetch:
+            _ui_inflight.pop(key, None)
+    fetch["final"].add_done_callback(_done)
+    return fetch
+
+
+def _ui_fetch_messages(fetch: Dict, job, provider_status: Dict) -> List:
+    """Newest-first messages for a finished job, computed once per fetch."""
+    result = async_providers.task_result(fetch["tasks"][job])
+    if isinstance(result, Exception) or job not in fetch["messages"]:
+        fetch["messages"][job] = _ui_job_messages(job, result, fetch["ctx"]["unread_only"], provider_status)
+    return fetch["messages"][job]
+
+
+async def _ui_build(fetch: Dict):
+    """Wait for every job, then build, snapshot and cache the full response. Returns (response, etag)."""
+    ctx = fetch["ctx"]
+    tasks = fetch["tasks"]
+    if tasks:
+        await asyncio.wait(tasks.values())
+
+    provider_status = {k: dict(v) for k, v in ctx["provider_status"].items()}
+    counts = {"total_available": 0, "loaded": 0, "unread": 0, "by_provider": dict(ctx["by_provider"])}
+    per_job = {job: _ui_fetch_messages(fetch, job, provider_status) for job in tasks}
+    items = _ui_top_items(per_job, counts, ctx["limit"], fetch["built"])
+
+    etag = _ui_etag(items, counts)
+    response = {
         "items": items,
         "counts": counts,
         "provider_status": provider_status,
-        "range_info": {
-            "filter_type": info["filter_type"],
-            "description": info["description"],
-            "tz_name": info["tz_name"],
-            "start_local": info["start_local_iso"],
-            "end_local": info["end_local_iso"],
-            "start_utc": date_start.isoformat(),
-            "end_utc": date_end.isoformat()
+        "snapshot_id": None,
+        "pending_id": None,
+        "pending": [],
+        "range_info": ctx["range_info"],
+    }
+    response["snapshot_id"] = await asyncio.to_thread(
+        _ui_save_snapshot, items, ctx["session_id"], ctx["provider_list"], ctx["folder_list"],
+        ctx["snap_filters"], ctx["filter_key"], etag, response,
+    )
+    return response, etag
+
+
+def _ui_local(base: Dict):
+    """The /ui/messages response built from the local store (source=local). Returns (response, etag)."""
+    import sync_scheduler
+    sync_status = sync_scheduler.get_sync_status()["providers"]
+
+    provider_status = {}
+    counts = {"total_available": 0, "loaded": 0, "unread": 0, "by_provider": {}}
+    per_job = {}
+    for prov_name in base["provider_list"]:
+        if prov_name not in _providers_map:
+            continue
+        status = sync_status.get(prov_name, {})
+        provider_status[prov_name] = {
+            "source": "local",
+            "lag_s": status.get("lag_s"),
+            "last_error": status.get("last_error"),
         }
+        counts["by_provider"][prov_name] = 0
+        for folder in base["folder_list"]:
+            # already newest first (ORDER BY received_ts)
+            per_job[(prov_name, folder)] = local_emails(
+                prov_name, folder, base["date_start"], base["date_end"],
+                unread_only=bool(base["unread_only"]), limit=base["limit"],
+            )
+    items = _ui_top_items(per_job, counts, base["limit"])
+
+    response = {
+        "items": items,
+        "counts": counts,
+        "provider_status": provider_status,
+        "snapshot_id": None,
+        "pending_id": None,
+        "pending": [],
+        "range_info": base["range_info"],
+        "source": "local",
     }
+    return response, _ui_etag(items, counts)
+
+
+async def _ui_revalidate(base: Dict):
+    import logging
+    try:
+        fetch = _ui_start_fetch(await _ui_context(base))
+        await fetch["final"]
+    except Exception as e:
+        logging.warning(f"UI Messages: background revalidation failed: {e}")
+
+
+def _ui_remember(items: List[Dict]):
+    """
+    Map dashboard keys (provider:folder:id) to the canonical provider:id and keep
+    the listed metadata in messages, so opening or acting on an item reads locally.
+    """
+    keys = [make_key(it["provider"], it["id"], it.get("folder")) for it in items]
+    known = existing_message_keys(keys)
+    rows = []
+    for it, key in zip(items, keys):
+        rows.append({
+            "key": key,
+            "provider": it["provider"],
+            "msg_id": it["id"],
+            "folder": it.get("folder"),
+            "from_addr": it.get("from") or None,
+            "subject": it.get("subject") or None,
+            "date": it.get("date") or None,
+            "unread": it.get("unread"),
+            "header_class": it.get("header_class"),
+            "status": None if key in known else "new",
+        })
+    upsert_messages(rows)
+    register_aliases({it["key"]: key for it, key in zip(items, keys)})
+
+
+def _ui_save_snapshot(items: List[Dict], session_id: str, provider_list: List[str], folder_list: List[str],
+                      snap_filters: Dict, filter_key: str = None, etag: str = None,
+                      response: Dict = None) -> Optional[str]:
+    """
+    Save items as a snapshot and cache the response under filter_key. An empty
+    result is cached all the same (so it gets an ETag and 304s) but is not a
+    snapshot: no snapshot_id, and snapshot_get_latest() skips it.
+    """
+    import logging
+    if not items and not filter_key:
+        return None
+    try:
+        import uuid as _uuid
+        snap_id = f"snap_{datetime.utcnow().strftime('%Y%m%d%H%M%S')}_{_uuid.uuid4().hex[:6]}"
+        snap_keys = [it["key"] for it in items]
+        snap_payload = []
+        for it in items:
+            snap_payload.append({
+                "key": it["key"],
+                "provider": it.get("provider", ""),
+                "folder": it.get("folder", "inbox"),
+                "from": it.get("from", ""),
+                "subject": it.get("subject", ""),
+                "date": it.get("date", ""),
+                "snippet": it.get("snippet", "")[:200],
+                "classification": it.get("classification", ""),
+                "unread": it.get("unread", True),
+            })
+        _ui_remember(items)
+        if response is not None:
+            response = {**response, "snapshot_id": snap_id if items else None}
+        snapshot_save(snap_id, session_id, provider_list, folder_list, snap_filters, snap_keys, snap_payload,
+                      filter_key=filter_key, etag=etag, response=response)
+        snapshot_cleanup(10)
+        if not items:
+            logging.info(f"Empty result cached for {filter_key}")
+            return None
+        logging.info(f"Snapshot saved: {snap_id} with {len(items)} items")
+        return snap_id
+    except Exception as snap_err:
+        logging.warning(f"Snapshot save failed: {snap_err}")
+        return None
+
+
+def _ndjson(frame: Dict) -> bytes:
+    return (json.dumps(frame, default=str) + "\n").encode()
+
+
+async def _ui_stream(fetch: Dict):
+    """
+    NDJSON frames for /ui/messages?stream=1: a "start" frame, one "batch" frame per
+    provider/folder as soon as it is fetched, then a "summary" frame with counts,
+    provider_status and snapshot_id (items beyond counts.loaded are not in the snapshot).
+    """
+    ctx = fetch["ctx"]
+    tasks = fetch["tasks"]
+    yield _ndjson({
+        "type": "start",
+        "provider_status": ctx["provider_status"],
+        "range_info": ctx["range_info"],
+        "jobs": [f"{p}:{f}" for p, f in tasks],
+    })
+
+    provider_status = {k: dict(v) for k, v in ctx["provider_status"].items()}
+    job_of = {task: job for job, task in tasks.items()}
+    top = TopK(ctx["limit"])
+    waiting = set(tasks.values())
+    while waiting:
+        done, waiting = await asyncio.wait(waiting, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            job = job_of[task]
+            entries = []
+            for msg in _ui_fetch_messages(fetch, job, provider_status):
+                # newest first: once one misses the running top-k, the rest of this source does too
+                if not top.offer(message_ts(msg)):
+                    break
+                entries.append((job, msg))
+            job_items = score_items(_ui_cached_items(fetch["built"], entries))
+            yield _ndjson({"type": "batch", "provider": job[0], "folder": job[1], "items": job_items})
+
+    response, etag = await fetch["final"]
+    yield _ndjson({
+        "type": "summary",
+        "counts": response["counts"],
+        "provider_status": response["provider_status"],
+        "snapshot_id": response["snapshot_id"],
+        "loaded_keys": [it["key"] for it in response["items"]],
+        "cache": {"state": "miss", "age": 0, "etag": etag},
+    })
+
+
+async def _ui_stream_cached(response: Dict, etag: str, state: str, age: float):
+    """A cached response in the same frame layout as _ui_stream, as one batch."""
+    cache = {"state": state, "age": int(age), "etag": etag}
+    yield _ndjson({"type": "start", "provider_status": response["provider_status"],
+                   "range_info": response["range_info"], "jobs": [], "cache": cache})
+    yield _ndjson({"type": "batch", "provider": None, "folder": None, "items": response["items"]})
+    yield _ndjson({
+        "type": "summary",
+        "counts": response["counts"],
+        "provider_status": response["provider_status"],
+        "snapshot_id": response.get("snapshot_id"),
+        "loaded_keys": [it["key"] for it in response["items"]],
+        "cache": cache,
+    })
 
 
 @router.get("/handsfree/context")
@@ -181,8 +181,156 @@ async function fetchEmailsIsolated() {
 }
 window.fetchEmailsIsolated = fetchEmailsIsolated;
 
+let loadGeneration = 0;
+
+function recountEmails() {
+    const unread = emails.filter(e => e.unread !== false).length;
+    emailCounts.total = Math.max(emailCounts.total || 0, emails.length);
+    emailCounts.loaded = emails.length;
+    emailCounts.unread = unread;
+    emailCounts.read = emails.length - unread;
+    emailCounts.by_category = {};
+    emailCounts.by_provider = {};
+    emails.forEach(e => {
+        const cat = e.classification || 'human';
+        emailCounts.by_category[cat] = (emailCounts.by_category[cat] || 0) + 1;
+        const p = e.provider || 'unknown';
+        emailCounts.by_provider[p] = (emailCounts.by_provider[p] || 0) + 1;
+    });
+    totalAvailableEmails = emailCounts.total;
+}
+
+// items carry ts (epoch seconds); date strings from different providers don't compare
+function newestFirst(a, b) {
+    return (b.ts || 0) - (a.ts || 0);
+}
+
+function listSort() {
+    return document.getElementById('sortSelect')?.value || 'date';
+}
+
+function listOrder(a, b) {
+    // priority_score comes from the server-side priority model; ties stay newest first
+    if (listSort() === 'priority_score') {
+        const diff = (b.priority_score ?? 0.5) - (a.priority_score ?? 0.5);
+        if (diff) return diff;
+    }
+    return newestFirst(a, b);
+}
+
+async function pollPendingMessages(pendingId, generation) {
+    // Providers that missed the server deadline; merge their mail in as it arrives.
+    while (generation === loadGeneration) {
+        let data;
+        try {
+            data = await apiCall(`/ui/messages/pending/${encodeURIComponent(pendingId)}?wait=5`);
+        } catch (err) {
+            console.warn('[pending] poll failed:', err);
+            return;
+        }
+        if (generation !== loadGeneration) return;
+        for (const [prov, ps] of Object.entries(data.provider_status || {})) {
+            providerStatus[prov] = { ...(providerStatus[prov] || {}), ...ps };
+        }
+        if (data.items && data.items.length) {
+            const seen = new Set(emails.map(e => e.key));
+            emails = emails.concat(data.items.filter(e => !seen.has(e.key)));
+            emails.sort(listOrder);
+            recountEmails();
+            renderEmailList();
+            syncGlobalEmails();
+            updateStatus(`${emailCounts.loaded} e-mails (${emailCounts.unread} não lidos)`);
+        }
+        updateProviderBanners();
+        updateConnectionsPanel();
+        if (data.done) return;
+    }
+}
+
+async function streamMessages(endpoint, generation) {
+    // /ui/messages?stream=1 sends NDJSON frames: start, one batch per provider/folder, summary.
+    const response = await fetch(API_BASE + endpoint + '&stream=1', { headers: getHeaders() });
+    if (response.status === 401) {
+        showApiKeyModal();
+        throw new Error('API Key required');
+    }
+    if (!response.ok) {
+        const text = await response.text();
+        throw new Error(text || response.statusText);
+    }
+    const result = { items: [], counts: {}, provider_status: {}, range_info: null };
+    const handleFrame = (frame) => {
+        if (frame.type === 'start') {
+            result.provider_status = frame.provider_status || {};
+            result.range_info = frame.range_info;
+        } else if (frame.type === 'batch') {
+            result.items = result.items.concat(frame.items || []);
+            result.items.sort(listOrder);
+            if (generation !== loadGeneration || !frame.items || !frame.items.length) return;
+            emails = result.items;
+            emailCounts = {};
+            recountEmails();
+            renderEmailList();
+            syncGlobalEmails();
+            updateStatus(`${emails.length} e-mails (${emailCounts.unread} não lidos) — carregando...`);
+        } else if (frame.type === 'summary') {
+            result.counts = frame.counts || {};
+            result.provider_status = frame.provider_status || result.provider_status;
+            result.snapshot_id = frame.snapshot_id;
+            result.cache = frame.cache;
+            const keep = new Set(frame.loaded_keys || []);
+            result.items = result.items.filter(e => keep.has(e.key));
+        }
+    };
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        let nl;
+        while ((nl = buffer.indexOf('\n')) >= 0) {
+            const line = buffer.slice(0, nl).trim();
+            buffer = buffer.slice(nl + 1);
+            if (line) handleFrame(JSON.parse(line));
+        }
+    }
+    if (buffer.trim()) handleFrame(JSON.parse(buffer));
+    return result;
+}
+
+async function revalidateMessages(endpoint, etag, generation) {
+    // The server answered from a stale cache entry and is already refetching;
+    // refresh=1 joins that fetch, and 304 means nothing changed.
+    const headers = getHeaders();
+    if (etag) headers['If-None-Match'] = etag;
+    let response;
+    try {
+        response = await fetch(API_BASE + endpoint + '&refresh=1', { headers });
+    } catch (err) {
+        console.warn('[revalidate] failed:', err);
+        return;
+    }
+    if (generation !== loadGeneration || response.status === 304 || !response.ok) return;
+    const data = await response.json();
+    if (generation !== loadGeneration) return;
+    emails = data.items || [];
+    providerStatus = data.provider_status || providerStatus;
+    emailCounts = {};
+    recountEmails();
+    emailCounts.total = totalAvailableEmails = (data.counts && data.counts.total_available) || emails.length;
+    renderEmailList();
+    syncGlobalEmails();
+    updateProviderBanners();
+    updateConnectionsPanel();
+    updateStatus(`${emailCounts.loaded} e-mails (${emailCounts.unread} não lidos)`);
+    if (data.pending_id) pollPendingMessages(data.pending_id, generation);
+}
+
 async function loadEmails() {
     const listEl = document.getElementById('emailList');
+    const generation = ++loadGeneration;
     emails = [];
     currentEmail = null;
     renderEmailList();
@@ -199,7 +347,10 @@ async function loadEmails() {
 
     try {
         const sid = ensureSession();
-        const data = await apiCall(`/ui/messages?${rangeParams}&providers=${providers}&folders=${folders}&limit=${currentLoadLimit}&session_id=${encodeURIComponent(sid)}`);
+        const endpoint = `/ui/messages?${rangeParams}&providers=${providers}&folders=${folders}&limit=${currentLoadLimit}&session_id=${encodeURIComponent(sid)}&sort=${listSort()}`;
+        const canStream = typeof ReadableStream !== 'undefined' && typeof TextDecoder !== 'undefined';
+        const data = canStream ? await streamMessages(endpoint, generation) : await apiCall(endpoint);
+        if (generation !== loadGeneration) return;
         emails = data.items || [];
         rangeInfo = data.range_info;
         providerStatus = data.provider_status || {};
@@ -233,6 +384,13 @@ async function loadEmails() {
         } else {
             updateStatus(`${loaded} e-mails (${unread} não lidos)`);
         }
+        if (data.pending_id) {
+            updateStatus(`${loaded} e-mails — aguardando ${data.pending.join(', ')}...`);
+            pollPendingMessages(data.pending_id, generation);
+        }
+        if (data.cache && data.cache.state === 'stale') {
+            revalidateMessages(endpoint, data.cache.etag, generation);
+        }
 
         try {
             const filters = getCurrentFilters();
@@ -1452,6 +1610,9 @@ document.addEventListener('DOMContentLoaded', () => {
 
     document.getElementById('rangeSelect').addEventListener('change', handleRangeChange);
 
+    const sortSelect = document.getElementById('sortSelect');
+    if (sortSelect) sortSelect.addEventListener('change', () => { emails.sort(listOrder); renderEmailList(); });
+
     const nDaysInput = document.getElementById('nDaysInput');
     if (nDaysInput) nDaysInput.addEventListener('change', loadEmails);
 
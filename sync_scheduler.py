@@ -0,0 +1,254 @@
+"""
+Background mailbox sync into the local store.
+
+Each configured provider is synced every SYNC_INTERVAL_<PROVIDER>_S seconds
+(+/- SYNC_JITTER), with exponential backoff after errors (capped at
+SYNC_MAX_BACKOFF_S) and at most SYNC_MAX_CONCURRENT syncs running at once.
+Gmail uses history sync, Microsoft delta sync, everything else ListSync
+(see mail_sync). With the store kept warm, read endpoints can serve
+source=local straight from SQLite.
+
+Off unless SYNC_SCHEDULER_ENABLED=1.
+"""
+import os
+import time
+import random
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+
+from db import sync_state_get, sync_state_set
+from mail_sync import get_gmail_sync, get_graph_sync, get_list_sync
+
+logger = logging.getLogger("sync_scheduler")
+
+SYNC_SCHEDULER_ENABLED = os.getenv("SYNC_SCHEDULER_ENABLED", "0") == "1"
+SYNC_INTERVALS_S = {
+    "gmail": int(os.getenv("SYNC_INTERVAL_GMAIL_S", "120")),
+    "microsoft": int(os.getenv("SYNC_INTERVAL_MICROSOFT_S", "120")),
+    "apple": int(os.getenv("SYNC_INTERVAL_APPLE_S", "300")),
+}
+SYNC_DEFAULT_INTERVAL_S = int(os.getenv("SYNC_INTERVAL_S", "300"))
+SYNC_JITTER = float(os.getenv("SYNC_JITTER", "0.1"))
+SYNC_MAX_BACKOFF_S = int(os.getenv("SYNC_MAX_BACKOFF_S", "1800"))
+SYNC_MAX_CONCURRENT = int(os.getenv("SYNC_MAX_CONCURRENT", "2"))
+SYNC_TICK_S = float(os.getenv("SYNC_TICK_S", "1"))
+GMAIL_SYNC_FOLDERS = ["inbox", "spam"]
+
+_providers: Dict = {}
+_state: Dict[str, Dict] = {}
+_lock = threading.Lock()
+_scheduler_thread = None
+_scheduler_running = False
+
+
+def _interval(name: str) -> int:
+    return SYNC_INTERVALS_S.get(name, SYNC_DEFAULT_INTERVAL_S)
+
+
+def _jittered(seconds: float) -> float:
+    return seconds * (1 + random.uniform(-SYNC_JITTER, SYNC_JITTER))
+
+
+def _is_configured(name: str) -> bool:
+    if name == "apple":
+        return bool(os.getenv("APPLE_EMAIL") and os.getenv("APPLE_APP_PASSWORD"))
+    if name == "gmail":
+        from store import get_gmail_token
+        token = get_gmail_token()
+        return bool(token and token.get("refresh_token") and not token.get("needs_reauth"))
+    if name == "microsoft":
+        import ms_auth
+        return ms_auth.is_signed_in()
+    return True
+
+
+def _syncer(name: str, provider):
+    if name == "gmail":
+        return get_gmail_sync(provider)
+    if name == "microsoft":
+        return get_graph_sync(provider)
+    return get_list_sync(provider)
+
+
+def _folders(name: str, syncer) -> list:
+    return GMAIL_SYNC_FOLDERS if name == "gmail" else list(syncer.folders)
+
+
+def _new_state(name: str) -> Dict:
+    persisted = sync_state_get(name, "scheduler") or {}
+    meta = persisted.get("meta") or {}
+    folders = {}
+    for folder in meta.get("folders", []):
+        folder_meta = (sync_state_get(name, f"scheduler:{folder}") or {}).get("meta") or {}
+        folders[folder] = {"last_success": folder_meta.get("last_success", meta.get("last_success")),
+                           "last_error": None}
+    return {
+        "next_run": 0.0,
+        "failures": 0,
+        "running": False,
+        "last_attempt": None,
+        "last_success": meta.get("last_success"),
+        "last_error": None,
+        "last_duration_s": None,
+        "folders": folders,
+    }
+
+
+def _folder_errors(name: str, syncer, result) -> Dict[str, Optional[str]]:
+    """{folder: error or None} for one sync; Gmail syncs all its folders in one pass."""
+    per_folder = result.get("folders") if isinstance(result, dict) else None
+    if not isinstance(per_folder, dict):
+        return {folder: None for folder in _folders(name, syncer)}
+    return {folder: (r or {}).get("error") for folder, r in per_folder.items()}
+
+
+def _record_folders(name: str, st: Dict, errors: Dict[str, Optional[str]], now: float):
+    for folder, error in errors.items():
+        folder_st = st["folders"].setdefault(folder, {"last_success": None, "last_error": None})
+        folder_st["last_error"] = error
+        if error is None:
+            folder_st["last_success"] = now
+            sync_state_set(name, f"scheduler:{folder}", cursor_value=None, meta={"last_success": now})
+    sync_state_set(name, "scheduler", cursor_value=None,
+                   meta={"last_success": st["last_success"], "folders": list(st["folders"])})
+
+
+def register_providers(providers: Dict):
+    with _lock:
+        _providers.clear()
+        _providers.update(providers)
+        for name in providers:
+            if name not in _state:
+                _state[name] = _new_state(name)
+
+
+def sync_provider(name: str) -> Dict:
+    """
+    Run one sync for a provider now and record the outcome (also used by the
+    loop). Folders that synced get their own last_success; any failed folder
+    counts as a failed run for the backoff.
+    """
+    provider = _providers[name]
+    st = _state[name]
+    started = time.time()
+    st["last_attempt"] = started
+    try:
+        syncer = _syncer(name, provider)
+        try:
+            result = syncer.sync()
+        except Exception as e:
+            _record_folders(name, st, {folder: str(e) for folder in _folders(name, syncer)}, time.time())
+            raise
+        errors = _folder_errors(name, syncer, result)
+        _record_folders(name, st, errors, time.time())
+        failed = {folder: error for folder, error in errors.items() if error}
+        if failed:
+            raise Exception("; ".join(f"{folder}: {error}" for folder, error in failed.items()))
+    except Exception as e:
+        st["failures"] += 1
+        delay = min(_interval(name) * (2 ** st["failures"]), SYNC_MAX_BACKOFF_S)
+        st["next_run"] = time.time() + _jittered(delay)
+        st["last_error"] = str(e)
+        logger.warning(f"Sync {name} failed ({st['failures']}x), retrying in {delay}s: {e}")
+        raise
+    finally:
+        st["last_duration_s"] = round(time.time() - started, 3)
+
+    st["failures"] = 0
+    st["last_error"] = None
+    st["last_success"] = time.time()
+    st["next_run"] = st["last_success"] + _jittered(_interval(name))
+    sync_state_set(name, "scheduler", cursor_value=None,
+                   meta={"last_success": st["last_success"], "folders": list(st["folders"])})
+    return result
+
+
+def _run_one(name: str):
+    try:
+        sync_provider(name)
+    except Exception:
+        pass
+    finally:
+        _state[name]["running"] = False
+
+
+def _scheduler_loop():
+    executor = ThreadPoolExecutor(max_workers=max(SYNC_MAX_CONCURRENT, 1), thread_name_prefix="mail-sync")
+    while _scheduler_running:
+        try:
+            now = time.time()
+            running = sum(1 for st in _state.values() if st["running"])
+            for name in list(_providers):
+                st = _state[name]
+                if running >= SYNC_MAX_CONCURRENT:
+                    break
+                if st["running"] or now < st["next_run"]:
+                    continue
+                if not _is_configured(name):
+                    st["next_run"] = now + _interval(name)
+                    continue
+                st["running"] = True
+                running += 1
+                executor.submit(_run_one, name)
+        except Exception as e:
+            logger.error(f"Scheduler error: {e}")
+        time.sleep(SYNC_TICK_S)
+    executor.shutdown(wait=False)
+
+
+def start_scheduler(providers: Dict):
+    global _scheduler_thread, _scheduler_running
+    register_providers(providers)
+    if not SYNC_SCHEDULER_ENABLED or _scheduler_running:
+        return
+    _scheduler_running = True
+    _scheduler_thread = threading.Thread(target=_scheduler_loop, daemon=True, name="sync-scheduler")
+    _scheduler_thread.start()
+    logger.info(f"Sync scheduler started for {', '.join(providers)}")
+
+
+def stop_scheduler():
+    global _scheduler_running
+    _scheduler_running = False
+
+
+def is_running() -> bool:
+    return _scheduler_running
+
+
+def request_sync(name: Optional[str] = None):
+    """Make one provider (or all) due on the next tick."""
+    for provider_name, st in _state.items():
+        if name is None or provider_name == name:
+            st["next_run"] = 0.0
+
+
+def get_sync_status() -> Dict:
+    now = time.time()
+    providers = {}
+    for name, st in _state.items():
+        lag = round(now - st["last_success"], 1) if st["last_success"] else None
+        providers[name] = {
+            "interval_s": _interval(name),
+            "running": st["running"],
+            "failures": st["failures"],
+            "last_error": st["last_error"],
+            "last_duration_s": st["last_duration_s"],
+            "next_run_in_s": max(0.0, round(st["next_run"] - now, 1)) if _scheduler_running else None,
+            "lag_s": lag,
+            "folders": {
+                folder: {
+                    "lag_s": round(now - f["last_success"], 1) if f["last_success"] else None,
+                    "last_error": f["last_error"],
+                }
+                for folder, f in st["folders"].items()
+            },
+        }
+    return {
+        "enabled": SYNC_SCHEDULER_ENABLED,
+        "running": _scheduler_running,
+        "max_concurrent": SYNC_MAX_CONCURRENT,
+        "providers": providers,
+    }
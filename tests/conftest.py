@@ -49,11 +49,16 @@ def mock_smtp():
 
 @pytest.fixture
 def mock_graph_requests():
-    with patch('graph.requests') as mock:
+    with patch('graph._get_session') as get_session:
+        mock = MagicMock()
+        get_session.return_value = mock
         response = MagicMock()
+        response.status_code = 200
+        response.headers = {}
         response.json.return_value = {}
         response.text = '{}'
         response.raise_for_status = MagicMock()
+        mock.request.return_value = response
         mock.get.return_value = response
         mock.post.return_value = response
         mock.patch.return_value = response
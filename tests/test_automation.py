@@ -2,6 +2,7 @@ import pytest
 from unittest.mock import patch, MagicMock
 import os
 import json
+from datetime import datetime, timezone
 
 
 class TestPolicy:
@@ -18,6 +19,50 @@ class TestPolicy:
         assert "delete_strategy" in policy
         assert policy["delete_strategy"] == "two_step"
 
+    def test_policy_engine_matches_substring_rules(self):
+        from policy_engine import PolicyEngine
+        engine = PolicyEngine({
+            "never_reply_keywords": ["security code", "otp"],
+            "newsletter_keywords": ["code", "unsubscribe"],
+            "block_reply_domains": ["noreply"],
+        })
+        emails = [
+            ("bank@x.com", "Your security code", ""),
+            ("a@x.com", "Hi", "promo code inside"),
+            ("noreply@x.com", "Receipt", "unsubscribe"),
+            ("a@x.com", "Hi", "x" * 1500 + " otp"),
+            ("a@x.com", "Lunch?", "see you"),
+        ]
+        assert engine.classify_batch(emails) == ["otp", "newsletter", "automated", "human", "human"]
+        assert [engine.categorize(*e) for e in emails] == engine.classify_batch(emails)
+
+    def test_policy_reloads_when_file_changes(self, tmp_path):
+        import policy_engine
+        path = tmp_path / "policy.json"
+        path.write_text(json.dumps({"never_reply_keywords": ["otp"]}))
+        with patch.object(policy_engine, "POLICY_PATH", str(path)), \
+                patch.object(policy_engine, "POLICY_RELOAD_CHECK_S", 0), \
+                patch.object(policy_engine, "_policy", None):
+            assert policy_engine.get_engine().categorize("a@x.com", "pin", "") == "human"
+            path.write_text(json.dumps({"never_reply_keywords": ["otp", "pin"]}))
+            os.utime(path, (1, 1))
+            assert policy_engine.get_engine().categorize("a@x.com", "pin", "") == "otp"
+
+    def test_classify_many_matches_per_email(self):
+        from policy_engine import CATEGORY_NAMES, PRIORITY_NAMES, classify_many
+        from assistant_loop import classify_email
+        records = {
+            "from": ["ana@cliente.com", "noreply@github.com", "news@x.com", "bank@x.com", "digest@x.com"],
+            "subject": ["Reunião", "PR", "Weekly", "Seu código", "Digest"],
+            "body": ["podemos conversar?", "opened", "click to unsubscribe", "", None],
+            "header_class": [None, None, None, "list", "list"],
+        }
+        result = classify_many(records)
+        expected = [classify_email(f, s, b, header_class=hc) for f, s, b, hc in zip(*records.values())]
+        assert [CATEGORY_NAMES[c] for c in result["category"]] == [e["category"] for e in expected]
+        assert [PRIORITY_NAMES[p] for p in result["priority"]] == [e["priority"] for e in expected]
+        assert [CATEGORY_NAMES[c] for c in result["category"]] == ["human", "automated", "newsletter", "otp", "newsletter"]
+
 
 class TestAutomationEngine:
     @patch.dict(os.environ, {
@@ -105,6 +150,188 @@ class TestAutomationEngine:
         assert action == "suggest_reply"
 
 
+class TestAutomationPipeline:
+    def _provider(self, emails):
+        provider = MagicMock(provider_name="apple")
+        provider.list_emails.return_value = emails
+        provider.fetch_many.return_value = {}
+        provider.mark_read_many.side_effect = lambda ids: {i: {"ok": True} for i in ids}
+        return provider
+
+    def test_full_run_batches_actions_and_caps_sends(self, tmp_path):
+        import db
+        from automation import AutomationEngine
+        from providers.base import EmailMessage
+
+        def msg(i, from_addr, subject, body):
+            return EmailMessage(id=str(i), provider="apple", from_addr=from_addr, subject=subject,
+                                body=body, date="2026-01-18T10:00:00Z")
+
+        emails = [msg(i, f"p{i}@client.com", "Meeting", "Can we talk?") for i in range(5)]
+        emails += [msg(10, "no-reply@shop.com", "Shipped", "On its way"),
+                   msg(11, "news@shop.com", "Weekly", "unsubscribe here")]
+        provider = self._provider(emails)
+
+        with patch.object(db, "DB_PATH", str(tmp_path / "auto.db")), \
+                patch("automation.draft_reply", return_value={"raw": "Sure."}) as drafts:
+            engine = AutomationEngine({"apple": provider})
+            engine.policy["max_send_per_run"] = 2
+            result = engine.run(["apple"], ["inbox"], 10, "full", 24)
+
+            assert drafts.call_count == 2
+            assert provider.send_reply.call_count == 2
+            provider.list_emails.assert_called_once()
+            provider.mark_read_many.assert_called_once()
+            assert sorted(provider.mark_read_many.call_args.args[0]) == ["0", "1", "10", "11"]
+            assert db.get_message("apple:11")["status"] == "pending_delete"
+            assert db.get_message("apple:10")["status"] == "read"
+            assert db.get_message("apple:0")["status"] == "sent"
+            assert set(result["timings"]) == {"fetch_ms", "classify_ms", "draft_ms", "act_ms"}
+
+            # already-sent messages are skipped on the next run
+            again = engine.run(["apple"], ["inbox"], 10, "dry_run", 24)
+            assert {s["id"] for s in again["skipped"]} == {"0", "1"}
+
+    def test_failed_drafts_and_sends_are_made_up_in_waves(self, tmp_path):
+        import db
+        from automation import AutomationEngine
+        from providers.base import EmailMessage
+
+        emails = [EmailMessage(id=str(i), provider="apple", from_addr=f"p{i}@client.com", subject="Meeting",
+                               body=f"Can we talk? {i}", date="2026-01-18T10:00:00Z") for i in range(6)]
+        provider = self._provider(emails)
+
+        def send_reply(msg_id, body, original=None):
+            if msg_id == "1":
+                raise Exception("SMTP down")
+
+        def draft(from_addr, subject, body):
+            return {"raw": "" if body.endswith("0") else "Sure."}
+
+        provider.send_reply.side_effect = send_reply
+        with patch.object(db, "DB_PATH", str(tmp_path / "auto.db")), \
+                patch("automation.draft_reply", side_effect=draft) as drafts:
+            engine = AutomationEngine({"apple": provider})
+            engine.policy["max_send_per_run"] = 2
+            result = engine.run(["apple"], ["inbox"], 10, "full", 24)
+
+        # wave 1 drafts 0 (empty) and 1 (send fails), wave 2 drafts 2 and 3, both sent
+        assert drafts.call_count == 4
+        assert [c.args[0] for c in provider.send_reply.call_args_list] == ["1", "2", "3"]
+        sends = [(e["id"], e["status"]) for e in result["executed"] if e["action"] == "send"]
+        assert sends == [("1", "error"), ("2", "success"), ("3", "success")]
+
+    def test_local_rows_without_body_are_fetched_before_sending(self, tmp_path):
+        import db
+        from automation import AutomationEngine
+        from providers.base import EmailMessage
+
+        provider = self._provider([])
+        provider.provider_name = "gmail"
+        full = EmailMessage(id="a", provider="gmail", from_addr="a@client.com", subject="Meeting",
+                            body="Can we talk tomorrow?", date="2026-01-18T10:00:00Z")
+        provider.fetch_many.return_value = {"a": full}
+        with patch.object(db, "DB_PATH", str(tmp_path / "auto.db")), \
+                patch("automation.draft_reply", return_value={"raw": "Sure."}) as drafts:
+            now = datetime.now(timezone.utc).strftime("%a, %d %b %Y %H:%M:%S +0000")
+            for msg_id in ("a", "b"):
+                db.upsert_message(key=f"gmail:{msg_id}", provider="gmail", msg_id=msg_id, folder="inbox",
+                                  from_addr=f"{msg_id}@client.com", subject="Meeting", date=now, unread=True)
+            engine = AutomationEngine({"gmail": provider})
+            result = engine.run(["gmail"], ["inbox"], 10, "send_only", 24, source="local")
+
+            provider.list_emails.assert_not_called()
+            # fetched when read from the store, and b once more before drafting
+            assert [sorted(c.args[0]) for c in provider.fetch_many.call_args_list] == [["a", "b"], ["b"]]
+            drafts.assert_called_once_with("a@client.com", "Meeting", "Can we talk tomorrow?")
+            assert [c.args[0] for c in provider.send_reply.call_args_list] == ["a"]
+            assert db.get_message("gmail:a")["body_text"] == "Can we talk tomorrow?"
+            actions = {p["id"]: p["recommended_action"] for p in result["processed"]}
+            assert actions == {"a": "suggest_reply", "b": "skip"}
+
+
+class TestPriorityModel:
+    def _history(self):
+        import db
+        for i in range(6):
+            db.upsert_message(key=f"gmail:b{i}", provider="gmail", msg_id=f"b{i}", folder="inbox",
+                              from_addr="Boss <boss@client.com>", subject=f"Contract review {i}")
+            db.log_action(f"gmail:b{i}", "gmail", f"b{i}", "send", "success", "Resposta enviada")
+            db.upsert_message(key=f"gmail:p{i}", provider="gmail", msg_id=f"p{i}", folder="inbox",
+                              from_addr="Shop <promo@shop.com>", subject=f"Sale {i}")
+            db.log_action(f"gmail:p{i}", "gmail", f"p{i}", "delete", "success", "Email excluído")
+        db.log_action("gmail:b0", "gmail", "b0", "send", "error", "boom")
+
+    def test_learns_incrementally_from_actions(self, tmp_path):
+        import db
+        import priority_model
+
+        with patch.object(db, "DB_PATH", str(tmp_path / "rank.db")):
+            self._history()
+            model = priority_model.PriorityModel()
+            assert priority_model.train(model) == 12
+            assert priority_model.train(model) == 0
+
+            boss, promo = model.score_many(["boss@client.com", "promo@shop.com"], ["Contract", "Sale"])
+            assert boss > 0.7 and promo < 0.3
+
+            reloaded = priority_model.load_model()
+            assert reloaded.cursor == model.cursor
+            assert reloaded.score_many(["boss@client.com"], ["Contract"])[0] == pytest.approx(boss, abs=1e-4)
+
+    def test_automation_actions_are_not_learned(self, tmp_path):
+        import db
+        import automation
+        import priority_model
+
+        with patch.object(db, "DB_PATH", str(tmp_path / "rank.db")):
+            self._history()
+            db.upsert_message(key="gmail:n1", provider="gmail", msg_id="n1", folder="inbox",
+                              from_addr="news@shop.com", subject="Weekly")
+            automation.log_action("gmail", "n1", "mark_read", "success", "Newsletter")
+            model = priority_model.PriorityModel()
+            assert priority_model.train(model) == 12
+
+    def test_get_model_trains_off_the_calling_thread(self, tmp_path):
+        import threading
+        import db
+        import priority_model
+
+        trained_on = []
+
+        def train(model, limit=None):
+            trained_on.append(threading.current_thread().name)
+            return 0
+
+        with patch.object(db, "DB_PATH", str(tmp_path / "rank.db")), \
+                patch.object(priority_model, "_model", None), \
+                patch.object(priority_model, "_next_train", 0.0), \
+                patch.object(priority_model, "train", side_effect=train):
+            model = priority_model.get_model()
+            for thread in threading.enumerate():
+                if thread.name == "priority-model-train":
+                    thread.join(5)
+            assert priority_model.get_model() is model
+
+        assert trained_on == ["priority-model-train"]
+
+    def test_sort_items_by_priority_score(self, tmp_path):
+        import db
+        import priority_model
+
+        with patch.object(db, "DB_PATH", str(tmp_path / "rank.db")):
+            self._history()
+            model = priority_model.PriorityModel()
+            priority_model.train(model)
+
+        items = [{"from": "promo@shop.com", "subject": "Sale"}, {"from": "a@x.com", "subject": "Hi"},
+                 {"from": "boss@client.com", "subject": "Contract"}]
+        assert priority_model.sort_items(items, "date", model) is items
+        ranked = priority_model.sort_items(items, "priority_score", model)
+        assert [it["from"] for it in ranked] == ["boss@client.com", "a@x.com", "promo@shop.com"]
+        assert priority_model.PriorityModel().score_many(["a@x.com"], ["Hi"]) == [0.5]
+
+
 class TestAutomationEndpoints:
     @pytest.fixture
     def client(self):
@@ -120,6 +120,34 @@ class TestUtilityFunctions:
         assert parse_email_address("simple@example.com") == "simple@example.com"
         assert parse_email_address("") == ""
 
+    def test_merge_top_k_stops_pulling_sources(self):
+        from listing import merge_top_k, normalize_ts
+
+        pulled = []
+
+        def source(name, stamps):
+            for ts in stamps:
+                pulled.append((name, ts))
+                yield ts
+
+        top = merge_top_k([source("a", [90, 50, 10]), source("b", [80, 70, 60, 5])], 3, key=float)
+        assert top == [90, 80, 70]
+        assert ("b", 5) not in pulled and ("a", 10) not in pulled
+        assert normalize_ts("Sat, 17 Jan 2026 10:00:00 +0000") == normalize_ts("2026-01-17T10:00:00Z")
+        assert normalize_ts("garbage") == 0.0
+
+    def test_counts_of_sources_that_stopped_early(self):
+        from listing import Listing, listing_counts
+        from providers.base import EmailMessage
+
+        def msg(i, unread):
+            email_msg = EmailMessage(id=str(i), provider="gmail", from_addr="", subject="", body="", date="")
+            email_msg.unread = unread
+            return email_msg
+
+        assert listing_counts([msg(1, True), msg(2, False)]) == (2, 1)
+        assert listing_counts(Listing([msg(1, True)], total=40, unread=12)) == (40, 12)
+
     def test_normalize_text(self):
         from utils.text import normalize_text
         
@@ -196,3 +224,317 @@ class TestDispatchImport:
     def test_dispatch_import_malformed_json(self, client):
         response = client.post("/dispatch/import", content="not json", headers={"Content-Type": "application/json"})
         assert response.status_code == 422
+
+
+def _list_provider(name, delay):
+    import time
+    from providers.base import EmailMessage
+
+    provider = MagicMock(provider_name=name)
+
+    def list_emails(**kwargs):
+        time.sleep(delay)
+        return [EmailMessage(id=f"{name}-1", provider=name, from_addr="a@x.com",
+                             subject="Hi", body="hello", date="2026-01-18T10:00:00Z")]
+    provider.list_emails.side_effect = list_emails
+    return provider
+
+
+class TestUiMessages:
+    def test_late_provider_is_pending(self, client):
+        import session_api
+
+        providers = {"fast": _list_provider("fast", 0), "slow": _list_provider("slow", 0.5)}
+        with patch.dict(session_api._providers_map, providers, clear=True), \
+                patch.object(session_api, "UI_MESSAGES_DEADLINE_S", 0.2), \
+                patch("session_api.snapshot_save"), TestClient(client.app) as c:
+            data = c.get("/ui/messages?providers=fast,slow&range=last_n_days&n=3650").json()
+            assert [it["id"] for it in data["items"]] == ["fast-1"]
+            assert data["provider_status"]["slow"]["pending"] is True
+            assert data["pending"] == ["slow:inbox"]
+
+            late = c.get(f"/ui/messages/pending/{data['pending_id']}?wait=5").json()
+            assert late["done"] is True
+            assert [it["id"] for it in late["items"]] == ["slow-1"]
+            assert c.get(f"/ui/messages/pending/{data['pending_id']}").status_code == 404
+
+    def test_stream_emits_batches_then_summary(self, client):
+        import json
+        import session_api
+
+        providers = {"fast": _list_provider("fast", 0), "slow": _list_provider("slow", 0.2)}
+        with patch.dict(session_api._providers_map, providers, clear=True), \
+                patch("session_api.snapshot_save"):
+            response = client.get("/ui/messages?providers=fast,slow&range=last_n_days&n=3650&stream=1")
+        assert response.headers["content-type"].startswith("application/x-ndjson")
+        frames = [json.loads(line) for line in response.text.splitlines()]
+
+        assert [f["type"] for f in frames] == ["start", "batch", "batch", "summary"]
+        assert [f["provider"] for f in frames[1:3]] == ["fast", "slow"]
+        assert frames[-1]["counts"]["loaded"] == 2
+        assert frames[-1]["snapshot_id"].startswith("snap_")
+
+    def test_cached_by_filter_with_etag(self, client, tmp_path):
+        import db
+        import session_api
+
+        provider = _list_provider("fast", 0)
+        url = "/ui/messages?providers=fast&range=last_n_days&n=3650"
+        with patch.dict(session_api._providers_map, {"fast": provider}, clear=True), \
+                patch.object(db, "DB_PATH", str(tmp_path / "ui.db")):
+            first = client.get(url)
+            assert first.headers["X-Cache"] == "miss"
+            etag = first.headers["ETag"]
+
+            # same filters in another order/case hit the cache without touching the provider
+            second = client.get("/ui/messages?providers=FAST&range=last_n_days&n=3650&session_id=other")
+            assert second.headers["X-Cache"] == "fresh"
+            assert second.json()["items"] == first.json()["items"]
+            assert provider.list_emails.call_count == 1
+
+            assert client.get(url, headers={"If-None-Match": etag}).status_code == 304
+
+            with patch.object(session_api, "UI_CACHE_MAX_AGE_S", -1):
+                assert client.get(url).headers["X-Cache"] == "stale"
+
+    def test_empty_result_is_cached_but_not_a_snapshot(self, client, tmp_path):
+        import db
+        import session_api
+
+        provider = MagicMock(provider_name="empty")
+        provider.list_emails.return_value = []
+        url = "/ui/messages?providers=empty&range=last_n_days&n=3650"
+        with patch.dict(session_api._providers_map, {"empty": provider}, clear=True), \
+                patch.object(db, "DB_PATH", str(tmp_path / "ui.db")):
+            first = client.get(url)
+            assert first.json()["items"] == [] and first.json()["snapshot_id"] is None
+            etag = first.headers["ETag"]
+
+            assert client.get(url).headers["X-Cache"] == "fresh"
+            assert client.get(url, headers={"If-None-Match": etag}).status_code == 304
+            assert provider.list_emails.call_count == 1
+            assert db.snapshot_get_latest(None) is None
+
+    def test_identical_refreshes_share_one_fetch(self, client, tmp_path):
+        import asyncio
+        import db
+        import session_api
+
+        provider = _list_provider("slow", 0.2)
+        url = "/ui/messages?providers=slow&range=last_n_days&n=3650&refresh=1"
+        with patch.dict(session_api._providers_map, {"slow": provider}, clear=True), \
+                patch.object(db, "DB_PATH", str(tmp_path / "ui.db")):
+            async def run():
+                import httpx
+                transport = httpx.ASGITransport(app=client.app)
+                async with httpx.AsyncClient(transport=transport, base_url="http://test") as ac:
+                    return await asyncio.gather(ac.get(url), ac.get(url))
+
+            first, second = asyncio.run(run())
+        assert first.json()["items"] == second.json()["items"]
+        assert provider.list_emails.call_count == 1
+
+    def test_source_local_reads_the_store(self, client, tmp_path):
+        from datetime import datetime, timedelta, timezone
+        import db
+        import session_api
+
+        received = (datetime.now(timezone.utc) - timedelta(days=1)).isoformat()
+
+        provider = _list_provider("fast", 0)
+        with patch.dict(session_api._providers_map, {"fast": provider}, clear=True), \
+                patch.object(db, "DB_PATH", str(tmp_path / "ui.db")):
+            db.upsert_message(key="fast:9", provider="fast", msg_id="9", folder="inbox",
+                              from_addr="b@x.com", subject="Stored", date=received, unread=True)
+            response = client.get("/ui/messages?providers=fast&range=last_n_days&n=7&source=local")
+
+        assert response.headers["X-Cache"] == "local"
+        data = response.json()
+        assert [it["id"] for it in data["items"]] == ["9"]
+        assert data["provider_status"]["fast"]["source"] == "local"
+        provider.list_emails.assert_not_called()
+
+    def test_sort_by_priority_score(self, client, tmp_path):
+        import db
+        import session_api
+        import priority_model
+
+        from providers.base import EmailMessage
+
+        def provider(name, hour):
+            mock = MagicMock(provider_name=name)
+            mock.list_emails.return_value = [
+                EmailMessage(id=f"{name}-1", provider=name, from_addr=f"{name}@x.com", subject="Hi",
+                             body="hello", date=f"2026-01-18T{hour:02d}:00:00Z")
+            ]
+            return mock
+
+        model = priority_model.PriorityModel()
+        model.learn([{"from_addr": "old@x.com", "subject": "Hi", "label": 1}] * 5)
+        providers = {"new": provider("new", 10), "old": provider("old", 8)}
+        url = "/ui/messages?providers=new,old&range=last_n_days&n=3650"
+        with patch.dict(session_api._providers_map, providers, clear=True), \
+                patch.object(db, "DB_PATH", str(tmp_path / "ui.db")), \
+                patch.object(priority_model, "get_model", return_value=model):
+            by_date = client.get(url)
+            by_score = client.get(url + "&sort=priority_score")
+
+        assert [it["from"] for it in by_date.json()["items"]] == ["new@x.com", "old@x.com"]
+        assert by_score.headers["ETag"] != by_date.headers["ETag"]
+        items = by_score.json()["items"]
+        assert [it["from"] for it in items] == ["old@x.com", "new@x.com"]
+        assert items[0]["priority_score"] > 0.5
+
+    def test_unknown_sort_is_rejected(self, client):
+        response = client.get("/ui/messages?sort=score")
+        assert response.status_code == 400
+        assert "priority_score" in response.json()["detail"]
+        assert client.get("/assistant/brief?sort=score").status_code == 400
+
+
+    def test_only_top_k_items_are_classified(self, client):
+        import session_api
+        from providers.base import EmailMessage
+
+        def provider(name, hours):
+            mock = MagicMock(provider_name=name)
+            mock.list_emails.return_value = [
+                EmailMessage(id=f"{name}-{h}", provider=name, from_addr="a@x.com", subject="Hi",
+                             body="hello", date=f"2026-01-18T{h:02d}:00:00Z")
+                for h in hours
+            ]
+            return mock
+
+        providers = {"a": provider("a", [9, 7, 1]), "b": provider("b", [8, 2])}
+        with patch.dict(session_api._providers_map, providers, clear=True), \
+                patch("session_api.snapshot_save"), \
+                patch("session_api.classify_many", wraps=session_api.classify_many) as classify:
+            data = client.get("/ui/messages?providers=a,b&range=last_n_days&n=3650&limit=3&refresh=1").json()
+
+        assert [it["id"] for it in data["items"]] == ["a-9", "b-8", "a-7"]
+        assert data["counts"]["total_available"] == 5 and data["counts"]["loaded"] == 3
+        assert classify.call_count == 1
+        assert len(classify.call_args.args[0]["from"]) == 3
+        assert {it["classification"] for it in data["items"]} == {"human"}
+
+
+    def test_dashboard_keys_resolve_to_the_stored_message(self, client, tmp_path):
+        import db
+        import session_api
+
+        provider = _list_provider("fast", 0)
+        with patch.dict(session_api._providers_map, {"fast": provider}, clear=True), \
+                patch.object(db, "DB_PATH", str(tmp_path / "ui.db")):
+            item = client.get("/ui/messages?providers=fast&range=last_n_days&n=3650").json()["items"][0]
+            assert item["key"] == "fast:inbox:fast-1"
+
+            assert db.resolve_key(item["key"]) == "fast:fast-1"
+            assert db.get_message(item["key"])["subject"] == "Hi"
+            db.set_draft(item["key"], "Thanks!")
+            assert db.get_draft("fast:fast-1") == "Thanks!"
+            assert db.mark_status(item["key"], "read")
+            assert db.get_message("fast:fast-1")["status"] == "read"
+
+            db.register_aliases({"fast:old-id": "fast:fast-1"})
+            assert db.get_message("fast:old-id")["msg_id"] == "fast-1"
+
+    def test_apple_uids_stay_distinct_across_folders(self, client, tmp_path):
+        import db
+        import session_api
+        from providers.base import EmailMessage
+
+        provider = MagicMock(provider_name="apple")
+        provider.list_emails.side_effect = lambda folder, **kwargs: [
+            EmailMessage(id="7", provider="apple", from_addr="a@x.com", subject=f"Hi from {folder}",
+                         body="hello", date="2026-01-18T10:00:00Z")]
+        with patch.dict(session_api._providers_map, {"apple": provider}, clear=True), \
+                patch.object(db, "DB_PATH", str(tmp_path / "ui.db")):
+            items = client.get("/ui/messages?providers=apple&folders=inbox,spam&range=last_n_days&n=3650").json()["items"]
+            assert sorted(it["key"] for it in items) == ["apple:inbox:7", "apple:spam:7"]
+
+            assert db.canonical_key("apple:inbox:7") == "apple:7"
+            assert db.canonical_key("apple:spam:7") == "apple:spam:7"
+            assert db.get_message("apple:inbox:7")["subject"] == "Hi from inbox"
+            assert db.get_message("apple:spam:7")["subject"] == "Hi from spam"
+            db.mark_status("apple:spam:7", "read")
+            assert db.get_message("apple:7")["status"] != "read"
+
+class TestInboxMessage:
+    def test_live_message_is_classified_with_its_header_class(self, client, tmp_path):
+        import db
+        import inbox_api
+        from providers.base import EmailMessage
+
+        msg = EmailMessage(id="m1", provider="fast", from_addr="shop@x.com", subject="Hello",
+                           body="Can we talk tomorrow?", date="2026-01-18T10:00:00Z")
+        msg.header_class = "bulk"
+        provider = MagicMock(provider_name="fast")
+        provider.get_message.return_value = msg
+        with patch.dict(inbox_api._providers_map, {"fast": provider}, clear=True), \
+                patch.object(db, "DB_PATH", str(tmp_path / "inbox.db")):
+            data = client.get("/inbox/message/fast:m1").json()
+            assert data["classification"] == "newsletter"
+            assert db.get_message("fast:m1")["priority"] == "low"
+
+
+class TestAssistantBrief:
+    def test_one_unread_listing_per_provider(self, client, tmp_path):
+        import db
+        import main
+        from providers.base import EmailMessage
+
+        def provider(name):
+            mock = MagicMock(provider_name="apple")
+            mock.list_emails.return_value = [
+                EmailMessage(id=f"{name}-{i}", provider=name, from_addr="a@x.com",
+                             subject=f"Hi {i}", body="hello", date="2026-01-18T10:00:00Z")
+                for i in range(3)
+            ]
+            return mock
+
+        gmail, apple = provider("gmail"), provider("apple")
+        with patch.object(main, "gmail_provider", gmail), patch.object(main, "apple_provider", apple), \
+                patch.object(db, "DB_PATH", str(tmp_path / "brief.db")):
+            data = client.get("/assistant/brief?providers=gmail,apple&limit_per_provider=3").json()
+            assert len({item["key"] for item in data["items"]}) == data["summary"]["total"] == 6
+            assert db.get_message("gmail:gmail-2")["status"] == "classified"
+
+        for mock in (gmail, apple):
+            mock.list_emails.assert_called_once()
+            assert mock.list_emails.call_args.kwargs["unread_only"] is True
+            mock.queue_next.assert_not_called()
+
+
+class TestSessionStart:
+    def test_background_ingest_reports_progress(self, client, tmp_path):
+        import time
+        import db
+        import session_api
+
+        broken = MagicMock(provider_name="broken")
+        broken.list_emails.side_effect = Exception("IMAP down")
+        providers = {"fast": _list_provider("fast", 0.1), "broken": broken}
+        with patch.dict(session_api._providers_map, providers, clear=True), \
+                patch.object(db, "DB_PATH", str(tmp_path / "session.db")):
+            started = client.post("/session/start", json={
+                "providers": ["fast", "broken"], "folders": ["inbox", "spam"],
+            }).json()
+            assert started["status"] == "running" and started["total_jobs"] == 4
+
+            progress = started
+            for _ in range(50):
+                progress = client.get(f"/session/start/{started['job_id']}").json()
+                if progress["status"] != "running":
+                    break
+                time.sleep(0.05)
+
+            assert progress["status"] == "done"
+            assert progress["counts"] == {"fast": 2, "broken": 0, "total": 2}
+            assert {(e["provider"], e["folder"]) for e in progress["errors"]} == {("broken", "inbox"), ("broken", "spam")}
+            assert db.get_session_item_count(started["session_id"]) == {"fast": 1}
+            assert db.get_message("fast:fast-1")["session_id"] == started["session_id"]
+
+            waited = client.post("/session/start", json={
+                "providers": ["fast"], "folders": ["inbox"], "wait": True,
+            }).json()
+            assert waited["status"] == "done" and waited["counts"] == {"fast": 1, "total": 1}
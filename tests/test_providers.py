@@ -1,6 +1,8 @@
 import pytest
-from unittest.mock import MagicMock, patch
+from unittest.mock import ANY, MagicMock, patch
 import os
+import time
+from datetime import datetime, timezone
 
 from providers.base import EmailProvider, EmailMessage, DebugStatus
 
@@ -74,6 +76,54 @@ class TestAppleMailProvider:
             provider._require_creds()
         assert "not configured" in str(exc.value)
 
+    @patch.dict(os.environ, {"APPLE_EMAIL": "test@icloud.com", "APPLE_APP_PASSWORD": "testpass"})
+    def test_bulk_ops_share_one_session(self, mock_imap):
+        from providers.apple import AppleMailProvider
+        mock_imap.uid.return_value = ("OK", [])
+        provider = AppleMailProvider()
+
+        results = provider.mark_read_many(["1", "2", "3"])
+
+        assert mock_imap.login.call_count == 1
+        mock_imap.uid.assert_called_once_with("store", "1,2,3", "+FLAGS", "(\\Seen)")
+        assert all(r["ok"] for r in results.values())
+
+    @patch.dict(os.environ, {"APPLE_EMAIL": "test@icloud.com", "APPLE_APP_PASSWORD": "testpass"})
+    def test_fetch_many_parses_uid_set(self, mock_imap):
+        from providers.apple import AppleMailProvider
+        raw = b"From: a@example.com\r\nSubject: Hi\r\n\r\nbody"
+        mock_imap.uid.return_value = ("OK", [
+            (b"1 (UID 10 BODY[] {40}", raw), b")",
+            (b"2 (BODY[] {40}", raw), b" UID 11)",
+        ])
+
+        fetched = AppleMailProvider().fetch_many(["10", "11", "12"])
+
+        assert sorted(fetched) == ["10", "11"]
+        assert fetched["11"].subject == "Hi"
+        assert mock_imap.uid.call_args.args[:2] == ("fetch", "10,11,12")
+
+    @patch.dict(os.environ, {"APPLE_EMAIL": "test@icloud.com", "APPLE_APP_PASSWORD": "testpass"})
+    def test_unread_only_searches_unseen_on_the_server(self, mock_imap):
+        from providers.apple import AppleMailProvider
+
+        def uid(command, *args):
+            if command == "SEARCH":
+                return ("OK", [b"7 9"])
+            return ("OK", [(b'1 (UID 9 INTERNALDATE "17-Jan-2026 10:00:00 +0000" FLAGS () '
+                            b'BODY[HEADER.FIELDS (FROM SUBJECT)] {40}',
+                            b"From: a@example.com\r\nSubject: Unread\r\n\r\n"), b")"])
+
+        mock_imap.uid.side_effect = uid
+        emails = AppleMailProvider().list_emails(
+            "inbox", limit=1, unread_only=True,
+            date_start=datetime(2026, 1, 16, tzinfo=timezone.utc),
+            date_end=datetime(2026, 1, 18, tzinfo=timezone.utc))
+
+        searches = [c.args for c in mock_imap.uid.call_args_list if c.args[0] == "SEARCH"]
+        assert searches == [("SEARCH", None, "UNSEEN", "SINCE", "14-Jan-2026")]
+        assert [(m.id, m.unread) for m in emails] == [("9", True)]
+
 
 class TestMicrosoftProvider:
     def test_init(self):
@@ -112,6 +162,114 @@ class TestMicrosoftProvider:
         assert result.id == "msg-123"
         assert result.provider == "microsoft"
 
+    def test_debug_status_uses_one_batch(self, mock_graph_requests):
+        from providers.microsoft import MicrosoftProvider
+        provider = MicrosoftProvider(MagicMock(return_value="test-token"))
+
+        mock_graph_requests.request.return_value.json.return_value = {"responses": [
+            {"id": "0", "status": 200, "body": {"mail": "me@outlook.com"}},
+            {"id": "1", "status": 200, "body": {"value": [{"displayName": "Inbox"}]}},
+            {"id": "2", "status": 200, "body": {"totalItemCount": 10, "unreadItemCount": 3}},
+            {"id": "3", "status": 404, "body": {"error": {"code": "ErrorItemNotFound"}}},
+        ]}
+
+        status = provider.debug_status()
+        assert mock_graph_requests.request.call_count == 1
+        assert status.email == "me@outlook.com"
+        assert status.inbox_unseen == 3
+        assert status.junk_total == 0
+
+    def test_list_emails_follows_next_link(self, mock_graph_requests):
+        from datetime import datetime, timezone
+        from providers.microsoft import MicrosoftProvider
+        provider = MicrosoftProvider(MagicMock(return_value="test-token"))
+
+        page1, page2 = MagicMock(status_code=200, headers={}), MagicMock(status_code=200, headers={})
+        page1.json.return_value = {
+            "value": [{"id": "a", "subject": "One", "isRead": False, "bodyPreview": "hi",
+                       "from": {"emailAddress": {"address": "x@y.com"}}}],
+            "@odata.nextLink": "https://graph.microsoft.com/v1.0/me/mailFolders/inbox/messages?$skip=1",
+        }
+        page2.json.return_value = {"value": [{"id": "b", "subject": "Two", "isRead": True}]}
+        mock_graph_requests.request.side_effect = [page1, page2]
+
+        emails = provider.list_emails(limit=10, date_start=datetime(2026, 1, 1, tzinfo=timezone.utc))
+
+        assert [e.id for e in emails] == ["a", "b"]
+        assert emails[0].unread is True and emails[1].unread is False
+        first_call = mock_graph_requests.request.call_args_list[0].kwargs
+        assert first_call["params"]["$filter"] == "receivedDateTime ge 2026-01-01T00:00:00Z"
+        assert first_call["headers"]["Prefer"] == 'outlook.body-content-type="text"'
+        assert mock_graph_requests.request.call_args_list[1].args[1].endswith("$skip=1")
+
+    def test_delta_sync_stores_delta_link(self, tmp_path):
+        import db
+        from providers.base import EmailMessage
+        from mail_sync import GraphDeltaSync
+
+        provider = MagicMock()
+        msg = EmailMessage(id="a", provider="microsoft", from_addr="x@y.com", subject="Hi", body="", date="")
+        msg.unread = True
+        provider.delta_messages.return_value = {
+            "changed": [msg], "removed": [], "delta_link": "https://graph/delta?token=1", "requests": 1,
+        }
+
+        with patch.object(db, "DB_PATH", str(tmp_path / "sync.db")):
+            result = GraphDeltaSync(provider, folders=["inbox"]).sync()
+            assert result["folders"]["inbox"]["changed"] == 1
+            assert db.sync_state_get("microsoft", "inbox")["cursor"] == "https://graph/delta?token=1"
+            assert db.get_message("microsoft:a")["unread"] == 1
+
+            GraphDeltaSync(provider, folders=["inbox"]).sync()
+            provider.delta_messages.assert_called_with("inbox", "https://graph/delta?token=1")
+
+    def test_graph_batch_retries_throttled_items(self, mock_graph_requests):
+        import graph
+
+        first, second = MagicMock(status_code=200, headers={}), MagicMock(status_code=200, headers={})
+        first.json.return_value = {"responses": [
+            {"id": "0", "status": 204},
+            {"id": "1", "status": 429, "headers": {"Retry-After": "0"}},
+        ]}
+        second.json.return_value = {"responses": [{"id": "1", "status": 204}]}
+        mock_graph_requests.request.side_effect = [first, second]
+
+        results = graph.graph_batch("tok", [
+            {"method": "PATCH", "url": "/me/messages/a", "body": {"isRead": True}},
+            {"method": "PATCH", "url": "/me/messages/b", "body": {"isRead": True}},
+        ])
+
+        assert [r["status"] for r in results] == [204, 204]
+        retried = mock_graph_requests.request.call_args_list[1].kwargs["json"]["requests"]
+        assert [r["url"] for r in retried] == ["/me/messages/b"]
+
+    def test_graph_post_is_not_retried_on_5xx(self, mock_graph_requests):
+        import requests
+        import graph
+        from urllib3.exceptions import NewConnectionError
+
+        unavailable = MagicMock(status_code=503, headers={"Retry-After": "0"})
+        unavailable.raise_for_status.side_effect = requests.HTTPError("503")
+        mock_graph_requests.request.return_value = unavailable
+        with pytest.raises(requests.HTTPError):
+            graph.graph_post("tok", "/me/sendMail", {"message": {}})
+        assert mock_graph_requests.request.call_count == 1
+
+        # GETs still are, and a POST that never reached the server is too
+        ok = MagicMock(status_code=200, headers={}, text="{}")
+        ok.json.return_value = {}
+        mock_graph_requests.request.reset_mock()
+        mock_graph_requests.request.side_effect = [unavailable, ok]
+        graph.graph_get("tok", "/me/messages")
+        assert mock_graph_requests.request.call_count == 2
+
+        refused = requests.exceptions.ConnectionError(MagicMock(reason=NewConnectionError(None, "refused")))
+        mock_graph_requests.request.reset_mock()
+        mock_graph_requests.request.side_effect = [refused, ok]
+        with patch.object(graph.time, "sleep"):
+            graph.graph_post("tok", "/me/sendMail", {"message": {}})
+        assert mock_graph_requests.request.call_count == 2
+
 
 class TestGmailProvider:
     @patch.dict(os.environ, {"GMAIL_CLIENT_ID": "client123", "GMAIL_CLIENT_SECRET": "secret456"})
@@ -164,3 +322,614 @@ class TestGmailProvider:
         with pytest.raises(Exception) as exc:
             provider._get_service()
         assert "Not authenticated" in str(exc.value)
+
+    @patch.dict(os.environ, {"GMAIL_CLIENT_ID": "client123", "GMAIL_CLIENT_SECRET": "secret456"})
+    def test_get_service_is_cached(self):
+        from datetime import datetime, timedelta
+        from google.oauth2.credentials import Credentials
+        from providers.gmail import GmailProvider
+
+        provider = GmailProvider(base_url="https://example.com")
+        creds = Credentials(token="tok", refresh_token="ref", client_id="c", client_secret="s")
+        creds.expiry = datetime.utcnow() + timedelta(hours=1)
+
+        with patch.object(provider, "_load_credentials", return_value=creds) as load, \
+                patch("providers.gmail.build") as build:
+            first = provider._get_service()
+            second = provider._get_service()
+            assert first is second
+            assert build.call_count == 1
+            assert load.call_count == 1
+
+            provider.invalidate_service()
+            provider._get_service()
+            assert build.call_count == 2
+
+    def test_list_emails_uses_metadata(self):
+        from providers.gmail import GmailProvider, LIST_FIELDS
+
+        provider = GmailProvider(base_url="https://example.com")
+        service = MagicMock()
+        service.users.return_value.messages.return_value.list.return_value.execute.return_value = {
+            "messages": [{"id": "m1"}]
+        }
+        provider._get_service = MagicMock(return_value=service)
+        provider._batch_get = MagicMock(return_value={"m1": {
+            "id": "m1", "labelIds": ["INBOX", "UNREAD"], "snippet": "Hi &amp; welcome",
+            "payload": {"headers": [
+                {"name": "From", "value": "News <news@example.com>"},
+                {"name": "Subject", "value": "Weekly"},
+                {"name": "List-Id", "value": "<news.example.com>"},
+            ]},
+        }})
+
+        emails = provider.list_emails(limit=10)
+
+        assert provider._batch_get.call_args.kwargs["fmt"] == "metadata"
+        assert provider._batch_get.call_args.kwargs["fields"] == LIST_FIELDS
+        assert emails[0].body == "Hi & welcome"
+        assert emails[0].unread is True
+        assert emails[0].headers["list-id"] == "<news.example.com>"
+        assert emails[0].header_class is None  # List-Id alone is only a hint
+
+    def test_batch_get_chunks_and_retries(self):
+        import providers.gmail as gmail
+
+        class FakeBatch:
+            calls = []
+            attempts = {}
+
+            def __init__(self, callback):
+                self.callback = callback
+                self.ids = []
+
+            def add(self, request, request_id):
+                self.ids.append(request_id)
+
+            def execute(self):
+                FakeBatch.calls.append(list(self.ids))
+                for msg_id in self.ids:
+                    # chunks run concurrently: fail m3's own first attempt, not the Nth batch call
+                    FakeBatch.attempts[msg_id] = FakeBatch.attempts.get(msg_id, 0) + 1
+                    if msg_id == "m3" and FakeBatch.attempts[msg_id] == 1:
+                        err = Exception("rate limited")
+                        err.resp = MagicMock(status=429)
+                        self.callback(msg_id, None, err)
+                    else:
+                        self.callback(msg_id, {"id": msg_id}, None)
+
+        provider = gmail.GmailProvider(base_url="https://example.com")
+        service = MagicMock()
+        service.new_batch_http_request.side_effect = lambda callback: FakeBatch(callback)
+        provider._get_service = MagicMock(return_value=service)
+
+        ids = [f"m{i}" for i in range(5)]
+        with patch.object(gmail, "GMAIL_BATCH_SIZE", 2), patch.object(gmail, "GMAIL_RETRY_BASE_S", 0):
+            fetched = provider._batch_get(ids, fmt="metadata")
+
+        assert sorted(fetched) == ids
+        assert sorted(len(c) for c in FakeBatch.calls) == [1, 1, 2, 2]
+        assert ["m3"] in FakeBatch.calls
+
+    def test_get_message_is_cached(self):
+        import message_cache
+        from providers.gmail import GmailProvider
+
+        provider = GmailProvider(base_url="https://example.com")
+        service = MagicMock()
+        get = service.users.return_value.messages.return_value.get
+        get.return_value.execute.return_value = {
+            "id": "m1", "payload": {"headers": [], "body": {"data": "SGVsbG8="}},
+        }
+        provider._get_service = MagicMock(return_value=service)
+        message_cache.install({"gmail": provider}, message_cache.MessageCache())
+
+        assert provider.get_message("m1").body == "Hello"
+        assert provider.get_message("m1").body == "Hello"
+        assert get.call_count == 1
+
+
+class TestAppleFetchParser:
+    def test_parse_fetch_headers(self):
+        from apple_imap import parse_fetch_headers
+
+        data = [
+            (
+                b'1 (UID 345 INTERNALDATE "17-Jul-2026 02:44:25 -0300" FLAGS (\\Seen \\Answered) '
+                b'RFC822.SIZE 2048 BODY[HEADER.FIELDS (FROM SUBJECT LIST-ID)] {120}',
+                b"From: =?UTF-8?Q?Jo=C3=A3o?= <joao@example.com>\r\n"
+                b"Subject: Hello\r\n"
+                b"List-Id: <news.example.com>\r\n\r\n",
+            ),
+            b")",
+            (b'2 (FLAGS () BODY[HEADER.FIELDS (FROM)] {2}', b"\r\n"),
+        ]
+
+        records = parse_fetch_headers(data)
+
+        assert len(records) == 1
+        rec = records[0]
+        assert rec.uid == 345
+        assert rec.size == 2048
+        assert rec.seen
+        assert rec.from_addr == "João <joao@example.com>"
+        assert rec.subject == "Hello"
+        assert rec.headers["list-id"] == "<news.example.com>"
+        assert rec.dt_utc.isoformat() == "2026-07-17T05:44:25+00:00"
+
+
+class TestGmailHistorySync:
+    def _provider(self):
+        from providers.gmail import GmailProvider
+        provider = GmailProvider(base_url="https://example.com")
+        provider.get_history_id = MagicMock(return_value="100")
+        provider._get_service = MagicMock()
+        provider._get_service.return_value.users.return_value.messages.return_value \
+            .list.return_value.execute.return_value = {"messages": [{"id": "m1"}]}
+        provider._batch_get = MagicMock(side_effect=lambda ids, **kw: {
+            i: {"id": i, "labelIds": ["INBOX", "UNREAD"], "payload": {"headers": [
+                {"name": "From", "value": "Ana <ana@example.com>"},
+                {"name": "Subject", "value": f"Hello {i}"},
+            ]}} for i in ids
+        })
+        return provider
+
+    def test_full_then_incremental(self, tmp_path):
+        import db
+        from mail_sync import GmailHistorySync
+
+        with patch.object(db, "DB_PATH", str(tmp_path / "sync.db")):
+            provider = self._provider()
+            sync = GmailHistorySync(provider)
+
+            first = sync.sync()
+            assert first["mode"] == "full"
+            assert db.get_message("gmail:m1")["unread"] == 1
+
+            provider.list_history = MagicMock(return_value={
+                "history_id": "105", "requests": 1, "records": [
+                    {"labelsRemoved": [{"message": {"id": "m1", "labelIds": ["INBOX"]}}]},
+                    {"messagesAdded": [{"message": {"id": "m2", "labelIds": ["INBOX"]}}]},
+                ]})
+            second = sync.sync()
+            assert second["mode"] == "incremental"
+            assert second["added"] == 1 and second["updated"] == 1
+            provider._batch_get.assert_called_with(["m2"], fmt="metadata", metadata_headers=ANY)
+            assert db.get_message("gmail:m1")["unread"] == 0
+            assert db.sync_state_get("gmail")["cursor"] == "105"
+
+            provider.list_history = MagicMock(return_value=None)
+            assert sync.sync()["reason"] == "history_expired"
+
+
+class TestSyncScheduler:
+    def test_backoff_then_success_fills_local_store(self, tmp_path):
+        import db
+        import sync_scheduler
+        from mail_sync import local_emails
+
+        calls = {"n": 0}
+
+        def list_emails(folder, **kwargs):
+            calls["n"] += 1
+            if calls["n"] == 1:
+                raise Exception("IMAP down")
+            if folder != "inbox":
+                return []
+            return [EmailMessage(id="42", provider="apple", from_addr="ana@example.com",
+                                 subject="Hello", body="", date="Sat, 17 Jan 2026 10:00:00 +0000")]
+
+        provider = MagicMock(provider_name="apple")
+        provider.list_emails.side_effect = list_emails
+        with patch.object(db, "DB_PATH", str(tmp_path / "sync.db")), \
+                patch.dict(sync_scheduler._state, clear=True), \
+                patch.dict(sync_scheduler._providers, clear=True), \
+                patch.object(sync_scheduler, "SYNC_JITTER", 0):
+            sync_scheduler.register_providers({"apple": provider})
+
+            with pytest.raises(Exception):
+                sync_scheduler.sync_provider("apple")
+            state = sync_scheduler._state["apple"]
+            assert state["failures"] == 1
+            assert state["next_run"] - time.time() == pytest.approx(2 * sync_scheduler._interval("apple"), abs=5)
+
+            sync_scheduler.sync_provider("apple")
+            status = sync_scheduler.get_sync_status()["providers"]["apple"]
+            assert status["failures"] == 0 and status["lag_s"] < 5
+            assert set(status["folders"]) == {"inbox", "spam"}
+
+            emails = local_emails("apple", "inbox")
+            assert [(m.id, m.subject, m.body_is_snippet) for m in emails] == [("42", "Hello", True)]
+            assert local_emails("apple", "inbox", date_start=datetime(2026, 2, 1, tzinfo=timezone.utc)) == []
+
+    def test_folder_lag_tracked_per_folder(self, tmp_path):
+        import db
+        import sync_scheduler
+
+        def list_emails(folder, **kwargs):
+            if folder == "spam":
+                raise Exception("SELECT Junk failed")
+            return []
+
+        provider = MagicMock(provider_name="apple")
+        provider.list_emails.side_effect = list_emails
+        with patch.object(db, "DB_PATH", str(tmp_path / "sync.db")), \
+                patch.dict(sync_scheduler._state, clear=True), \
+                patch.dict(sync_scheduler._providers, clear=True):
+            sync_scheduler.register_providers({"apple": provider})
+            with pytest.raises(Exception):
+                sync_scheduler.sync_provider("apple")
+
+            status = sync_scheduler.get_sync_status()["providers"]["apple"]
+            assert status["failures"] == 1 and status["lag_s"] is None
+            assert status["folders"]["inbox"]["lag_s"] < 5 and status["folders"]["inbox"]["last_error"] is None
+            assert status["folders"]["spam"] == {"lag_s": None, "last_error": "SELECT Junk failed"}
+
+            # a restart picks the per-folder success back up
+            sync_scheduler._state.clear()
+            sync_scheduler.register_providers({"apple": provider})
+            folders = sync_scheduler.get_sync_status()["providers"]["apple"]["folders"]
+            assert folders["inbox"]["lag_s"] < 5 and folders["spam"]["lag_s"] is None
+
+    def test_local_emails_fetch_missing_bodies(self, tmp_path):
+        import db
+        from mail_sync import local_emails
+        from policy_engine import get_engine
+
+        provider = MagicMock(provider_name="gmail")
+        provider.fetch_many.return_value = {
+            "1": EmailMessage(id="1", provider="gmail", from_addr="bank@x.com", subject="Acesso",
+                              body="Seu código é 123456", date=""),
+        }
+        date = "Sat, 17 Jan 2026 10:00:00 +0000"
+        with patch.object(db, "DB_PATH", str(tmp_path / "local.db")):
+            db.upsert_message(key="gmail:1", provider="gmail", msg_id="1", folder="inbox",
+                              from_addr="bank@x.com", subject="Acesso", date=date)
+            db.upsert_message(key="gmail:2", provider="gmail", msg_id="2", folder="inbox",
+                              from_addr="news@x.com", subject="Weekly", date=date, header_class="bulk")
+            db.upsert_message(key="gmail:3", provider="gmail", msg_id="3", folder="inbox",
+                              from_addr="ana@x.com", subject="Oi", date=date)
+
+            assert all(m.body == "" and m.body_is_snippet for m in local_emails("gmail", "inbox"))
+            provider.fetch_many.assert_not_called()
+
+            emails = {m.id: m for m in local_emails("gmail", "inbox", providers={"gmail": provider})}
+            assert sorted(provider.fetch_many.call_args.args[0]) == ["1", "3"]
+            assert emails["1"].body == "Seu código é 123456" and not emails["1"].body_is_snippet
+            assert emails["3"].body_is_snippet
+            assert get_engine().categorize(emails["1"].from_addr, emails["1"].subject, emails["1"].body) == "otp"
+            assert db.get_message("gmail:1")["body_text"] == "Seu código é 123456"
+
+    def test_received_ts_backfilled_for_existing_rows(self, tmp_path):
+        import sqlite3
+        import db
+
+        path = str(tmp_path / "old.db")
+        conn = sqlite3.connect(path)
+        conn.execute("CREATE TABLE messages (key TEXT PRIMARY KEY, provider TEXT NOT NULL, msg_id TEXT NOT NULL, "
+                     "folder TEXT, from_addr TEXT, subject TEXT, date TEXT, body_hash TEXT, status TEXT)")
+        conn.execute("INSERT INTO messages (key, provider, msg_id, folder, date) VALUES "
+                     "('apple:1', 'apple', '1', 'inbox', 'Sat, 17 Jan 2026 10:00:00 +0000'), "
+                     "('apple:2', 'apple', '2', 'inbox', NULL)")
+        conn.commit()
+        conn.close()
+
+        with patch.object(db, "DB_PATH", path):
+            db.init_db()
+            assert db.get_message("apple:1")["received_ts"] == db.date_to_ts("Sat, 17 Jan 2026 10:00:00 +0000")
+            assert db.get_message("apple:2")["received_ts"] is None
+
+
+class TestBulkActions:
+    def test_gmail_actions_grouped_into_batch_modify(self):
+        import bulk_actions
+        from providers.gmail import GmailProvider
+
+        provider = GmailProvider(base_url="https://example.com")
+        service = MagicMock()
+        provider._get_service = MagicMock(return_value=service)
+        single = MagicMock(spec=["mark_read"])
+        providers = {"gmail": provider, "apple": single}
+
+        ops = [("gmail", "mark_read", f"m{i}") for i in range(3)] + [("apple", "mark_read", "1")]
+        grouped = bulk_actions.GroupedActions(providers)
+        done, failed = {}, {}
+        for op in ops:
+            grouped.add(*op, on_success=lambda r, op=op: done.__setitem__(op, r),
+                        on_error=lambda e, op=op: failed.__setitem__(op, e))
+
+        batch_modify = service.users.return_value.messages.return_value.batchModify
+        batch_modify.assert_not_called()
+        grouped.execute()
+
+        assert batch_modify.call_count == 1
+        assert batch_modify.call_args.kwargs["body"] == {"ids": ["m0", "m1", "m2"], "removeLabelIds": ["UNREAD"]}
+        assert done[("gmail", "mark_read", "m1")]["ok"] is True
+        single.mark_read.assert_called_once_with("1")
+        assert not failed
+
+    def test_dispatch_validates_before_calling_the_provider(self, tmp_path):
+        import db
+        import llm_api
+
+        provider = MagicMock(provider_name="gmail")
+        provider.mark_read_many.side_effect = lambda ids: {i: {"ok": True} for i in ids}
+        with patch.object(db, "DB_PATH", str(tmp_path / "bulk.db")), \
+                patch.dict(llm_api._providers_map, {"gmail": provider}, clear=True):
+            for i in range(4):
+                db.upsert_message(key=f"gmail:m{i}", provider="gmail", msg_id=f"m{i}", subject="Hi")
+            db.mark_status("gmail:m2", "deleted")
+            req = llm_api.DispatchRequest(session_id="s", mode="execute", actions=[
+                llm_api.DispatchAction(key=f"gmail:m{i}", action="mark_read") for i in range(3)
+            ] + [llm_api.DispatchAction(key="gmail:m3", action="delete")])
+            results = llm_api.assistant_dispatch(req, True)["results"]
+
+            provider.mark_read_many.assert_called_once_with(["m0", "m1"])
+            provider.delete.assert_not_called()
+            provider.delete_many.assert_not_called()
+            assert [r["status"] for r in results] == ["ok", "ok", "ok", "ok"]
+            assert results[2]["message"] == "Already deleted"
+            assert db.get_message("gmail:m0")["status"] == "read"
+            assert db.get_message("gmail:m3")["status"] == "pending_delete"
+
+    def test_base_bulk_falls_back_to_single_calls(self):
+        from providers.base import EmailProvider
+
+        class Single(EmailProvider):
+            provider_name = "single"
+            debug_status = queue_next = suggest_reply = send = get_message = MagicMock()
+
+            def mark_read(self, message_id):
+                if message_id == "bad":
+                    raise Exception("nope")
+                return {"ok": True, "id": message_id}
+
+            delete = mark_read
+
+        results = Single().mark_read_many(["a", "bad"])
+        assert results["a"]["ok"] is True
+        assert isinstance(results["bad"], Exception)
+        assert isinstance(Single().move_many(["a"], "archive")["a"], Exception)
+
+
+class TestMsAuth:
+    def test_fresh_token_served_from_memory(self):
+        import time
+        import ms_auth
+
+        with patch.object(ms_auth, "_token", "cached-token"), \
+                patch.object(ms_auth, "_expires_at", time.time() + 3600), \
+                patch.object(ms_auth, "get_item") as get_item, \
+                patch.object(ms_auth, "get_app") as get_app:
+            assert ms_auth.get_access_token() == "cached-token"
+            get_item.assert_not_called()
+            get_app.assert_not_called()
+
+    def test_expiring_token_refreshed_silently(self):
+        import time
+        import ms_auth
+
+        app = MagicMock()
+        app.get_accounts.return_value = [{"username": "me"}]
+        app.acquire_token_silent.return_value = {"access_token": "new-token", "expires_in": 3600}
+        cache = MagicMock()
+        cache.find.return_value = [{"home_account_id": "x"}]
+        cache.has_state_changed = False
+
+        with patch.object(ms_auth, "_token", "old-token"), \
+                patch.object(ms_auth, "_expires_at", time.time() + 60), \
+                patch.object(ms_auth, "_cache", cache), \
+                patch.object(ms_auth, "get_app", return_value=app), \
+                patch.object(ms_auth, "_ensure_refresh_thread"):
+            assert ms_auth.get_access_token() == "new-token"
+            assert app.acquire_token_silent.call_args.kwargs["force_refresh"] is True
+
+    def test_failed_refresh_keeps_the_token_until_it_expires(self):
+        import time
+        import ms_auth
+
+        app = MagicMock()
+        app.get_accounts.return_value = [{"username": "me"}]
+        app.acquire_token_silent.return_value = {"error": "temporarily_unavailable"}
+        cache = MagicMock()
+        cache.find.return_value = [{"home_account_id": "x"}]
+
+        with patch.object(ms_auth, "_token", "old-token"), \
+                patch.object(ms_auth, "_expires_at", time.time() + 60), \
+                patch.object(ms_auth, "_cache", cache), \
+                patch.object(ms_auth, "get_app", return_value=app):
+            assert ms_auth.get_access_token() == "old-token"
+            assert ms_auth._token == "old-token"
+
+            app.acquire_token_silent.return_value = {"error": "invalid_grant"}
+            assert ms_auth.get_access_token() is None
+            assert ms_auth._token is None
+
+
+class TestAsyncProviders:
+    def test_fan_out_runs_graph_and_sync_providers(self):
+        import asyncio
+        import httpx
+        import async_providers
+        from providers.microsoft import MicrosoftProvider
+
+        def handler(request):
+            assert request.headers["Authorization"] == "Bearer tok"
+            folder = "junkemail" if "junkemail" in request.url.path else "inbox"
+            return httpx.Response(200, json={"value": [{
+                "id": f"{folder}-1", "subject": "Hi", "from": {"emailAddress": {"address": "a@x.com"}},
+                "receivedDateTime": "2026-01-18T10:00:00Z", "bodyPreview": "hello", "isRead": False,
+            }]})
+
+        sync_provider = MagicMock(provider_name="apple")
+        sync_provider.list_emails.side_effect = Exception("LOGIN failed")
+        providers = {"microsoft": MicrosoftProvider(lambda: "tok"), "apple": sync_provider}
+
+        async def run():
+            client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+            with patch("async_providers._client", return_value=client):
+                return await async_providers.fan_out(
+                    providers, [("microsoft", "inbox"), ("microsoft", "spam"), ("apple", "inbox")], limit=5
+                )
+
+        results = asyncio.run(run())
+        assert [m.id for m in results[("microsoft", "inbox")]] == ["inbox-1"]
+        assert results[("microsoft", "spam")][0].unread is True
+        assert isinstance(results[("apple", "inbox")], Exception)
+
+    def test_graph_listing_stops_once_it_cannot_reach_the_top_k(self):
+        import asyncio
+        import httpx
+        import async_providers
+        import providers.microsoft
+        from listing import Listing, TopK, normalize_ts
+        from providers.microsoft import MicrosoftProvider
+
+        messages = [{
+            "id": f"m{i}", "subject": "Hi", "from": {"emailAddress": {"address": "a@x.com"}},
+            "receivedDateTime": f"2026-01-{18 - i:02d}T10:00:00Z", "bodyPreview": "", "isRead": i % 2 == 0,
+        } for i in range(6)]
+        listed = []
+
+        def handler(request):
+            skip = int(request.url.params.get("$skip", 0))
+            if request.url.params.get("$select") == "isRead":
+                return httpx.Response(200, json={"value": [{"isRead": m["isRead"]} for m in messages]})
+            listed.append(skip)
+            page = {"value": messages[skip:skip + 2]}
+            if skip + 2 < len(messages):
+                page["@odata.nextLink"] = f"https://graph.microsoft.com/v1.0/me/messages?$skip={skip + 2}"
+            return httpx.Response(200, json=page)
+
+        # another source already holds one newer message and three older ones
+        topk = TopK(4)
+        for day in (20, 15, 14, 13):
+            topk.offer(normalize_ts(f"2026-01-{day}T12:00:00Z"))
+
+        async def run():
+            client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+            with patch("async_providers._client", return_value=client), \
+                    patch.object(providers.microsoft, "MS_PAGE_SIZE", 2):
+                return await async_providers.list_emails(MicrosoftProvider(lambda: "tok"), limit=6, topk=topk)
+
+        result = asyncio.run(run())
+        assert listed == [0, 2]
+        assert isinstance(result, Listing)
+        assert [m.id for m in result] == ["m0", "m1", "m2", "m3"]
+        assert (result.total, result.unread) == (6, 3)
+
+    def test_aclose_closes_the_loop_client(self):
+        import asyncio
+        import async_providers
+
+        async def run():
+            client = async_providers._client()
+            assert async_providers._client() is client
+            await async_providers.aclose()
+            assert client.is_closed
+            assert async_providers._client() is not client
+            await async_providers.aclose()
+
+        asyncio.run(run())
+
+    def test_app_shutdown_closes_the_client(self):
+        from fastapi.testclient import TestClient
+        import async_providers
+
+        with patch.dict(os.environ, {"CLIENT_ID": "test", "CLIENT_SECRET": "test", "BASE_URL": "https://test.com"}):
+            from main import app
+        with patch.object(async_providers, "aclose") as aclose, TestClient(app):
+            pass
+        aclose.assert_awaited_once()
+
+
+class TestMessageCache:
+    def _provider(self):
+        provider = MagicMock(provider_name="gmail")
+        provider.get_message.side_effect = lambda msg_id: EmailMessage(
+            id=msg_id, provider="gmail", subject="Hi", from_addr="a@x.com", date="", body="x" * 100
+        )
+        return provider
+
+    def test_repeat_reads_hit_and_mutations_invalidate(self):
+        import message_cache
+        provider = self._provider()
+        fetch = provider.get_message
+        cache = message_cache.MessageCache(max_items=2, max_bytes=10_000)
+        message_cache.install({"gmail": provider}, cache)
+
+        assert provider.get_message("m1").id == "m1"
+        provider.get_message("m1")
+        assert fetch.call_count == 1
+
+        provider.mark_read("m1")
+        provider.get_message("m1")
+        assert fetch.call_count == 2
+
+        provider.get_message("m2")
+        provider.get_message("m3")
+        stats = cache.stats()
+        assert stats["items"] == 2 and stats["evictions"] == 1
+        assert stats["hits"] == 1 and stats["invalidations"] == 1
+
+    def test_concurrent_misses_share_one_fetch(self):
+        import threading
+        import message_cache
+        provider = self._provider()
+        release = threading.Event()
+        plain = provider.get_message.side_effect
+        provider.get_message.side_effect = lambda msg_id: release.wait(1) and plain(msg_id)
+        fetch = provider.get_message
+        cache = message_cache.MessageCache()
+        message_cache.install({"gmail": provider}, cache)
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(provider.get_message("m1"))) for _ in range(4)]
+        for t in threads:
+            t.start()
+        time.sleep(0.05)
+        release.set()
+        for t in threads:
+            t.join()
+
+        assert fetch.call_count == 1
+        assert len(results) == 4 and len({id(r) for r in results}) == 1
+        assert cache.stats()["shared"] == 3
+
+
+class TestHeaderClass:
+    def test_header_class_rules(self):
+        from policy_engine import header_class
+        assert header_class({"auto-submitted": "auto-replied"}) == "auto_generated"
+        assert header_class({"auto-submitted": "no"}) is None
+        assert header_class({"precedence": "bulk"}) == "bulk"
+        assert header_class({"precedence": "list", "list-id": "<dev.example.org>"}) == "list"
+        # hints fall through to the body classifier
+        assert header_class({"list-unsubscribe": "<mailto:u@x.com>", "list-id": "<x.com>"}) is None
+        assert header_class({"x-auto-response-suppress": "All"}) is None
+
+    def test_hints_and_legacy_classes_use_the_body(self):
+        from assistant_loop import classify_email
+        assert classify_email("ana@client.com", "Re: contract", "Can we talk?", header_class="no_reply")["category"] == "human"
+        assert classify_email("ana@client.com", "Digest", "click to unsubscribe", header_class=None)["category"] == "newsletter"
+
+    def test_blocking_by_header_class(self):
+        from llm_api import _classify_for_blocking
+        auto = _classify_for_blocking("ci@x.com", "Build failed", "automated", "auto_generated")
+        assert auto["blocked"] is False and auto["classification"] == "automated"
+        assert _classify_for_blocking("dev@lists.x.org", "Re: patch", "newsletter", "list")["suggested_action"] == "skip"
+        assert _classify_for_blocking("promo@x.com", "Sale", "newsletter", "bulk")["suggested_action"] == "delete"
+
+    def test_graph_list_item_and_classification_skip_the_body(self):
+        from assistant_loop import classify_email
+        from providers.microsoft import MicrosoftProvider
+
+        msg = MicrosoftProvider(lambda: "tok")._list_item({
+            "id": "m1", "subject": "Build failed", "from": {"emailAddress": {"address": "ci@x.com"}},
+            "receivedDateTime": "2026-01-18T10:00:00Z", "bodyPreview": "Can we talk about this?",
+            "internetMessageHeaders": [{"name": "Auto-Submitted", "value": "auto-generated"}],
+        }, "inbox")
+
+        assert msg.header_class == "auto_generated"
+        assert classify_email(msg.from_addr, msg.subject, msg.body, header_class=msg.header_class)["category"] == "automated"
+        assert classify_email(msg.from_addr, "Your security code", "", header_class="list")["category"] == "otp"